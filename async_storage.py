@@ -0,0 +1,115 @@
+import asyncio
+import logging
+import functools
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Optional, List, Tuple, Set, Callable
+
+from order_store import OrderStore
+from order_record import Order
+from loyalty_ledger import LoyaltyLedger
+
+
+class AsyncStorage:
+    """Async facade the handlers use instead of touching files directly.
+
+    Everything that may block runs on a small bounded thread pool, so a slow
+    disk only delays the update that needs it: order cache revalidation,
+    order writes, report generation, and loyalty operations, which take the
+    write-behind lock shared with the flusher (and flush inline when
+    write-behind is off).
+    """
+
+    def __init__(self, order_store: OrderStore, loyalty_ledger: LoyaltyLedger, max_workers: int = 4):
+        self.order_store = order_store
+        self.loyalty_ledger = loyalty_ledger
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='storage')
+
+    async def run(self, func: Callable, *args, **kwargs):
+        """Run a blocking callable on the storage thread pool"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    # Loyalty: in-memory ledger, but its lock is shared with the flusher
+    async def get_loyalty(self, user_id: str) -> Dict[str, Any]:
+        """Copy of the user's loyalty record with defaults filled in"""
+        return await self.run(self.loyalty_ledger.get, user_id)
+
+    async def credit_loyalty(self, user_id: str, points: int, spent: float = 0, orders: int = 0) -> Dict[str, Any]:
+        return await self.run(self.loyalty_ledger.credit, user_id, points, spent=spent, orders=orders)
+
+    async def debit_loyalty(self, user_id: str, points: int) -> Optional[Dict[str, Any]]:
+        return await self.run(self.loyalty_ledger.debit_if_sufficient, user_id, points)
+
+    # Orders: cached reads may revalidate against the files, writes append
+    async def get_order(self, order_id: str) -> Optional[Order]:
+        return await self.run(self.order_store.get, order_id)
+
+    async def orders_for_user(self, user_id) -> List[Tuple[str, Order]]:
+        return await self.run(self.order_store.orders_for_user, user_id)
+
+    async def orders_since(self, since: datetime) -> List[Tuple[str, Order]]:
+        return await self.run(self.order_store.orders_since, since)
+
+    async def user_ids(self, since: Optional[datetime] = None) -> Set[str]:
+        return await self.run(self.order_store.user_ids, since)
+
+    async def put_order(self, order_id: str, order: Order):
+        await self.run(self.order_store.put, order_id, order)
+
+    async def update_order(self, order_id: str, fields: Dict[str, Any]):
+        await self.run(self.order_store.update, order_id, fields)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+
+class LoopLagMonitor:
+    """Measures how late the event loop wakes up from a fixed sleep.
+
+    Lag close to zero means no handler is blocking the loop; a blocking file
+    write shows up directly as lag of the same duration.
+    """
+
+    def __init__(self, interval: float = 0.5, warn_threshold: float = 0.1):
+        self.interval = interval
+        self.warn_threshold = warn_threshold
+        self.last = 0.0
+        self.max = 0.0
+        self.avg = 0.0
+        self.samples = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            self.record(loop.time() - started - self.interval)
+
+    def record(self, lag: float):
+        lag = max(lag, 0.0)
+        self.last = lag
+        self.max = max(self.max, lag)
+        self.samples += 1
+        # Exponential moving average keeps the figure current without a buffer
+        self.avg = lag if self.samples == 1 else self.avg * 0.9 + lag * 0.1
+        if lag > self.warn_threshold:
+            logging.warning(f"Event loop lag {lag * 1000:.0f} ms")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'last_ms': self.last * 1000,
+            'avg_ms': self.avg * 1000,
+            'max_ms': self.max * 1000,
+            'samples': self.samples
+        }
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
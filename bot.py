@@ -1,13 +1,25 @@
 import os
-import json
+import re
 import logging
-from telegram import Update, ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton, ForceReply
-from telegram.ext import Application, CommandHandler, MessageHandler, ContextTypes, filters, ConversationHandler, CallbackQueryHandler
+from telegram import Update, ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton, ForceReply, InlineQueryResultArticle, InputTextMessageContent
+from telegram.ext import Application, CommandHandler, MessageHandler, ContextTypes, filters, ConversationHandler, InlineQueryHandler
 from dotenv import load_dotenv
 from datetime import datetime, time, timedelta
 import telegram
-import pandas as pd
-import io
+from order_store import create_order_store, CachedOrderStore
+from order_record import Order
+from order_export import OrderExporter
+from order_analytics import SalesAnalytics, format_report
+from loyalty_ledger import get_ledger
+from async_storage import AsyncStorage, LoopLagMonitor
+from update_processor import PerUserUpdateProcessor
+from persistence import ShopPersistence
+from broadcast import BroadcastManager
+from notification_outbox import NotificationOutbox
+from user_registry import UserRegistry, ALL, ORDERED, NOT_ORDERED, NEW
+from routing import TextRouter, CallbackRouter
+from callback_codec import encode_callback
+from catalog import get_catalog, CatalogWatcher, format_product, PREV_PAGE, NEXT_PAGE, MESSAGE_LIMIT
 
 # Load environment variables
 load_dotenv()
@@ -26,11 +38,62 @@ ADMIN_TRACKING_INPUT = 999  # New state for admin tracking code input
 
 # Path to orders file
 ORDERS_FILE = 'orders.json'
+ORDERS_DB = 'orders.db'
+BOT_STATE_DB = 'bot_state.db'
 LOYALTY_FILE = 'loyalty.json'
+CATALOG_FILE = 'catalog.json'
+BROADCASTS_FILE = 'broadcasts.json'
+NOTIFICATIONS_FILE = 'notifications.json'
+EXPORTS_FILE = 'exports.json'
+EXPORT_UPLOAD_TIMEOUT = 120  # seconds; large reports take a while to upload
+USERS_FILE = 'users.json'
+
+# Update types the handlers actually use
+ALLOWED_UPDATES = [Update.MESSAGE, Update.CALLBACK_QUERY, Update.INLINE_QUERY]
+
+# Product search: results per /search reply and per inline query
+SEARCH_RESULTS_LIMIT = 8
+INLINE_RESULTS_LIMIT = 20
 
 # Admin settings
 ADMIN_ID = "7100115774"  # Admin ID
 ADMIN_CHAT_ID = "-1002673493739"  # Admin group ID as string
+ADMIN_ORDERS_PAGE_SIZE = 10
+ADMIN_USERS_PAGE_SIZE = 50
+
+# Inline button actions of the admin panel (callback_data via callback_codec)
+ADMIN_ACTIONS = (
+    "admin_back", "admin_broadcast", "admin_add_product", "admin_stats",
+    "admin_export", "admin_recent_orders", "admin_new_users", "admin_analytics",
+    "admin_bc_all", "admin_bc_ordered", "admin_bc_not_ordered", "admin_bc_new",
+    "admin_exp_new", "admin_exp_today", "admin_exp_week", "admin_exp_month", "admin_exp_all",
+    "admin_fmt_xlsx", "admin_fmt_csv", "admin_fmt_jsonl"
+)
+
+# Broadcast audience buttons: action -> (user registry segment, label)
+BROADCAST_SEGMENTS = {
+    "admin_bc_all": (ALL, "👥 Всем"),
+    "admin_bc_ordered": (ORDERED, "🛒 С заказами"),
+    "admin_bc_not_ordered": (NOT_ORDERED, "🙋 Без заказов"),
+    "admin_bc_new": (NEW, "🆕 Новым за 7 дней")
+}
+
+# Export period buttons: action -> (calendar days up to today, label);
+# 0 continues from the last export, None is the whole history
+EXPORT_PERIODS = {
+    "admin_exp_new": (0, "🆕 С прошлой выгрузки"),
+    "admin_exp_today": (1, "📅 Сегодня"),
+    "admin_exp_week": (7, "🗓 7 дней"),
+    "admin_exp_month": (30, "🗓 30 дней"),
+    "admin_exp_all": (None, "🗄 За всё время")
+}
+
+# Export format buttons: action -> (order_export format, label)
+EXPORT_FORMATS = {
+    "admin_fmt_xlsx": ('xlsx', "📗 Excel"),
+    "admin_fmt_csv": ('csv', "📄 CSV"),
+    "admin_fmt_jsonl": ('jsonl.gz', "🗜 JSONL.gz")
+}
 
 # Add global variables
 PROMO_CODES = {
@@ -60,37 +123,89 @@ DELIVERY_METHODS = {
         'details': '• Без дополнительной платы\n• В любое удобное время\n• Проверка товара на месте\n• Адрес: г. Гродно\n• Требуется номер телефона и желаемое время'
     }
 }
+# Button text -> delivery method id
+DELIVERY_METHOD_BY_NAME = {method['name']: method_id for method_id, method in DELIVERY_METHODS.items()}
+
+# Order storage backend: 'journal' (orders.json + orders.journal) or 'sqlite',
+# behind a process-wide cache that is loaded once and written through; the
+# cache also keeps the columnar copy the sales analytics are computed from
+ORDER_STORE = CachedOrderStore(
+    create_order_store(os.getenv('ORDER_STORE', 'journal'), ORDERS_FILE, ORDERS_DB),
+    order_analytics=SalesAnalytics()
+)
+
+# Loyalty balances: per-user atomic ledger, kept in memory and flushed to disk
+# in batches. LOYALTY_FLUSH_INTERVAL_MS is the maximum data-loss window on a crash.
+LOYALTY_LEDGER = get_ledger(
+    LOYALTY_FILE,
+    write_behind=True,
+    flush_interval_ms=int(os.getenv('LOYALTY_FLUSH_INTERVAL_MS', '1000')),
+    max_pending=int(os.getenv('LOYALTY_MAX_PENDING', '100'))
+)
+LOYALTY_STORE = LOYALTY_LEDGER.store
+
+# Order reports are built by a worker process that reads only the requested
+# time range (SQLite index, or the cache's time index piped to it)
+EXPORTER = OrderExporter(
+    os.getenv('ORDER_STORE', 'journal'), ORDERS_FILE, ORDERS_DB,
+    {method_id: method['name'] for method_id, method in DELIVERY_METHODS.items()},
+    cache=ORDER_STORE,
+    state_file=EXPORTS_FILE
+)
+
+# Handlers reach storage through the async facade so disk I/O never blocks the loop
+STORAGE = AsyncStorage(ORDER_STORE, LOYALTY_LEDGER)
+LOOP_LAG = LoopLagMonitor()
+
+# Admin group notifications are queued on disk and retried in the background
+ADMIN_OUTBOX = NotificationOutbox(NOTIFICATIONS_FILE)
+
+# Everyone who pressed /start or ordered, with blocked/last_seen/has_ordered flags
+USERS = UserRegistry(USERS_FILE, write_behind=True)
+if USERS.needs_import:
+    # First start with the registry: customers so far are only known from orders
+    USERS.import_orders(ORDER_STORE.all_orders().values())
+
+# Admin mailings run in the background, rate limited, and resume after a restart
+BROADCASTS = BroadcastManager(
+    BROADCASTS_FILE,
+    concurrency=int(os.getenv('BROADCAST_CONCURRENCY', '8')),
+    rate=float(os.getenv('BROADCAST_RATE', '25')),
+    on_blocked=USERS.set_blocked
+)
 
 # Load orders
 def load_orders():
-    """Load orders from file"""
+    """Load all orders from the order store"""
     try:
-        if os.path.exists(ORDERS_FILE):
-            with open(ORDERS_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        return {}
+        return ORDER_STORE.all_orders()
     except Exception as e:
         print(f"Error loading orders: {e}")
         return {}
 
-# Save orders
-def save_orders():
-    """Save orders to file"""
+# Save order
+async def save_order(order_id, order):
+    """Write a single order to the order store off the event loop; False if it failed"""
     try:
-        with open(ORDERS_FILE, 'w', encoding='utf-8') as f:
-            json.dump(ORDERS, f, ensure_ascii=False, indent=2)
+        await STORAGE.put_order(order_id, order)
+        return True
     except Exception as e:
-        print(f"Error saving orders: {e}")
+        logging.error(f"Error saving order {order_id}: {e}")
+        return False
+
+async def update_order(order_id, **fields):
+    """Write an order change (status, tracking code) to the order store; False if it failed"""
+    try:
+        await STORAGE.update_order(order_id, fields)
+        return True
+    except Exception as e:
+        logging.error(f"Error updating order {order_id}: {e}")
+        return False
 
 async def show_my_orders(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Show user's orders"""
     user_id = str(update.effective_user.id)
-    orders = load_orders()
-    
-    user_orders = []
-    for order_id, order in orders.items():
-        if order.get('user_id') == user_id:
-            user_orders.append((order_id, order))
+    user_orders = await STORAGE.orders_for_user(user_id)
     
     if not user_orders:
         await update.message.reply_text(
@@ -102,16 +217,16 @@ async def show_my_orders(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     orders_text = "📦 Ваши заказы:\n\n"
     
-    for order_id, order in sorted(user_orders, key=lambda x: x[1]['timestamp'], reverse=True):
-        status = "✅ Доставлен" if order.get('delivered') else "🚚 В пути"
+    for order_id, order in user_orders:
+        status = "✅ Доставлен" if order.delivered else "🚚 В пути"
         orders_text += (
             f"🆔 Заказ: {order_id}\n"
-            f"📅 Дата: {order['timestamp']}\n"
-            f"💰 Сумма: {order.get('final_sum', 0)} р.\n"
+            f"📅 Дата: {order.timestamp}\n"
+            f"💰 Сумма: {order.final_price} р.\n"
             f"📦 Статус: {status}\n"
         )
-        if order.get('tracking_code'):
-            orders_text += f"📤 Трек-код: {order['tracking_code']}\n"
+        if order.tracking_code:
+            orders_text += f"📤 Трек-код: {order.tracking_code}\n"
         orders_text += "\n"
     
     keyboard = [[KeyboardButton("◀️ В главное меню")]]
@@ -120,93 +235,6 @@ async def show_my_orders(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(orders_text, reply_markup=reply_markup)
     return MAIN_MENU
 
-# Product catalog
-PRODUCTS = {
-    'airpods_pro_2': {
-        'name': 'AirPods Pro 2',
-        'price': 65,
-        'old_price': 105,
-        'category': 'Наушники',
-        'bonus': '🎁 Фирменный чехол в подарок',
-        'description': '✨ Премиум копия\n• Активное шумоподавление\n• Поддержка iOS и Android\n• До 6 часов работы\n• Прозрачный режим'
-    },
-    'airpods_4': {
-        'name': 'AirPods 4',
-        'price': 135,
-        'category': 'Наушники',
-        'description': '✨ Премиум качество\n• Улучшенный звук\n• Автоподключение\n• До 5 часов работы\n• Сенсорное управление'
-    },
-    'airpods_2': {
-        'name': 'AirPods 2',
-        'price': 35,
-        'category': 'Наушники',
-        'description': '✨ Отличное качество\n• Чистый звук\n• Быстрое подключение\n• До 4 часов работы'
-    },
-    'airpods_3': {
-        'name': 'AirPods 3',
-        'price': 50,
-        'category': 'Наушники',
-        'description': '✨ Премиум качество\n• Объемный звук\n• Автоподключение\n• До 5 часов работы\n• Влагозащита'
-    },
-    'watch_8_ultra': {
-        'name': 'Apple Watch 8 Ultra',
-        'price': 65,
-        'old_price': 75,
-        'category': 'Часы',
-        'description': '✨ Премиум копия\n• Титановый корпус\n• Спортивный дизайн\n• Пульсометр\n• До 36 часов работы'
-    },
-    'watch_9': {
-        'name': 'Apple Watch 9',
-        'price': 100,
-        'category': 'Часы',
-        'description': '✨ Премиум качество\n• Алюминиевый корпус\n• Контроль здоровья\n• До 18 часов работы\n• Always-On Display'
-    },
-    'watch_ultra_2': {
-        'name': 'Apple Watch Ultra 2',
-        'price': 120,
-        'category': 'Часы',
-        'description': '✨ Максимальная комплектация\n• Титановый корпус\n• Расширенные датчики\n• До 36 часов работы\n• Сверхяркий экран'
-    },
-    'dyson_fan': {
-        'name': 'Фен Dyson(full)',
-        'price': 185,
-        'old_price': 220,
-        'category': 'Другое',
-        'bonus': '🎁 AirPods 2 в подарок',
-        'description': '✨ Премиум копия\n• Мощный поток воздуха\n• Контроль температуры\n• Защита от перегрева\n• Полная комплектация'
-    },
-    'block_20w': {
-        'name': 'Блок 20w (AAA+)',
-        'price': 20,
-        'category': 'Аксессуары',
-        'description': '✨ Высшее качество AAA+\n• Быстрая зарядка 20W\n• Для iPhone/iPad\n• Защита от перегрева'
-    },
-    'cable_lightning': {
-        'name': 'Кабель lightning',
-        'price': 10,
-        'category': 'Аксессуары',
-        'description': '✨ Премиум качество\n• Быстрая зарядка\n• Усиленная оплетка\n• Длина 1 метр'
-    },
-    'cable_magsafe': {
-        'name': 'Кабель Magsafe',
-        'price': 20,
-        'category': 'Аксессуары',
-        'description': '✨ Оригинальное качество\n• Магнитное крепление\n• Быстрая зарядка 15W\n• Для iPhone 12+'
-    },
-    'dualsock_4': {
-        'name': 'DualShock 4 v2',
-        'price': 50,
-        'category': 'Другое',
-        'description': '✨ Премиум копия\n• Беспроводной геймпад\n• До 8 часов работы\n• Тачпад\n• Поддержка PC/PS4'
-    },
-    'casio_vintage': {
-        'name': 'Casio Vintage square',
-        'price': 35,
-        'category': 'Часы',
-        'description': '✨ Премиум качество\n• Стальной корпус\n• Календарь\n• Подсветка\n• Влагозащита'
-    }
-}
-
 def get_main_keyboard() -> ReplyKeyboardMarkup:
     """Return main menu keyboard"""
     keyboard = [
@@ -217,28 +245,115 @@ def get_main_keyboard() -> ReplyKeyboardMarkup:
     ]
     return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
 
+# Product catalog (catalog.json) with cached page screens and a search index
+# (PRODUCT_CATALOG.search). Reloads build a new index off to the side and swap it in,
+# so take PRODUCT_CATALOG.current once per handler.
+PRODUCT_CATALOG = get_catalog(CATALOG_FILE)
+CATALOG_WATCHER = CatalogWatcher(PRODUCT_CATALOG, interval=float(os.getenv('CATALOG_RELOAD_INTERVAL', '5')))
+
 def get_catalog_keyboard():
     """Get catalog keyboard"""
-    categories = sorted(set(product['category'] for product in PRODUCTS.values()))
+    return PRODUCT_CATALOG.current.catalog_keyboard
+
+async def show_category_page(update: Update, context: ContextTypes.DEFAULT_TYPE, index, category, page=0):
+    """Send one page of a category and remember it in the session"""
+    text, reply_markup, page = index.render_page(category, page)
+    # Session keeps only what is needed to resolve the keyboard it was shown
+    context.user_data['current_category'] = category
+    context.user_data['catalog_version'] = index.version
+    context.user_data['catalog_page'] = page
+    context.user_data.pop('category_products', None)
+    
+    await update.message.reply_text(text, reply_markup=reply_markup)
+
+async def show_quantity_selection(update: Update, context: ContextTypes.DEFAULT_TYPE, product_id, product):
+    """Ask how many items of the product to order"""
+    # Save selected product
+    context.user_data['selected_product'] = product_id
+    
+    # Show quantity selection keyboard
     keyboard = []
-    for category in categories:
-        keyboard.append([KeyboardButton(f"📁 {category}")])
-    keyboard.append([KeyboardButton("◀️ В главное меню")])
-    return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+    # Create rows of 3 numbers each
+    for i in range(1, 10, 3):
+        row = [str(i), str(i+1), str(i+2)]
+        keyboard.append([KeyboardButton(num) for num in row])
+    keyboard.append([KeyboardButton("◀️ Назад")])
+    
+    await update.message.reply_text(
+        f"Выберите количество для {product['name']}:",
+        reply_markup=ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+    )
+    return SELECTING_QUANTITY
 
-def format_product(product):
-    """Format product information"""
-    text = f"📱 {product['name']}\n💰 Цена: {product['price']} р."
+async def show_search_results(update: Update, context: ContextTypes.DEFAULT_TYPE, query):
+    """Reply with the products matching a free-text query"""
+    index = PRODUCT_CATALOG.current
+    product_ids = [
+        product_id for product_id in PRODUCT_CATALOG.search.search(query, SEARCH_RESULTS_LIMIT)
+        if product_id in index.products
+    ]
+    if not product_ids:
+        await update.message.reply_text(
+            f"🔍 По запросу «{query}» ничего не найдено. Выберите категорию из меню",
+            reply_markup=index.catalog_keyboard
+        )
+        return CATALOG
     
-    if 'old_price' in product:
-        text += f" (было {product['old_price']} р.)"
+    items = [index.products[product_id] for product_id in product_ids]
+    text = f"🔍 Найдено по запросу «{query}»:\n\n" + "\n\n".join(format_product(product) for product in items)
+    if len(text) > MESSAGE_LIMIT:
+        text = text[:MESSAGE_LIMIT - 1] + "…"
+    keyboard = [[KeyboardButton(product['name'])] for product in items]
+    keyboard.extend([[KeyboardButton("◀️ Назад")], [KeyboardButton("◀️ В главное меню")]])
     
-    if 'description' in product:
-        text += f"\n\n{product['description']}"
-    if 'bonus' in product:
-        text += f"\n{product['bonus']}"
+    # Result buttons span categories, so they resolve through this list
+    context.user_data['search_results'] = product_ids
+    context.user_data['current_category'] = None
+    context.user_data['catalog_version'] = index.version
     
-    return text
+    await update.message.reply_text(text, reply_markup=ReplyKeyboardMarkup(keyboard, resize_keyboard=True))
+    return CATALOG
+
+async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Search products: /search <запрос>"""
+    query = ' '.join(context.args or []).strip()
+    if not query:
+        await update.message.reply_text(
+            "Введите запрос после команды, например:\n/search airpods\n\n"
+            "Или напишите название товара в разделе «🛍 Каталог»"
+        )
+        return None
+    return await show_search_results(update, context, query)
+
+async def handle_inline_search(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Answer inline queries (@bot <запрос>) from the search index"""
+    query = update.inline_query.query.strip()
+    index = PRODUCT_CATALOG.current
+    if query:
+        product_ids = PRODUCT_CATALOG.search.search(query, INLINE_RESULTS_LIMIT)
+    else:
+        product_ids = list(index.products)[:INLINE_RESULTS_LIMIT]
+    
+    results = []
+    for product_id in product_ids:
+        product = index.products.get(product_id)
+        if product is None:
+            continue
+        reply_markup = None
+        # Deep link straight into the order flow; start payloads allow only [A-Za-z0-9_-]
+        if re.fullmatch(r'[A-Za-z0-9_-]{1,62}', product_id):
+            reply_markup = InlineKeyboardMarkup([[InlineKeyboardButton(
+                "🛒 Заказать", url=f"https://t.me/{context.bot.username}?start=p_{product_id}"
+            )]])
+        results.append(InlineQueryResultArticle(
+            id=product_id[:64],
+            title=product['name'],
+            description=f"{product['price']} р. · {product['category']}",
+            input_message_content=InputTextMessageContent(format_product(product)),
+            reply_markup=reply_markup
+        ))
+    
+    await update.inline_query.answer(results, cache_time=60)
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Start command handler"""
@@ -262,6 +377,21 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "Все представленные товары являются репликами Premium+ качества📄"
     )
     
+    user = update.effective_user
+    if user:
+        USERS.touch(user.id, user.username)
+    
+    # Deep link from an inline search result: /start p_<product_id>
+    if context.args and context.args[0].startswith('p_'):
+        index = PRODUCT_CATALOG.current
+        product_id = context.args[0][2:]
+        product = index.products.get(product_id)
+        if product:
+            context.user_data['current_category'] = product['category']
+            context.user_data['catalog_version'] = index.version
+            context.user_data['catalog_page'] = 0
+            return await show_quantity_selection(update, context, product_id, product)
+    
     await update.message.reply_text(
         welcome_message,
         reply_markup=get_main_keyboard(),
@@ -270,31 +400,12 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return MAIN_MENU
 
 async def handle_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Main menu handler"""
-    text = update.message.text
-
-    if text == "🛍 Каталог":
-        await update.message.reply_text(
-            "Выберите категорию товаров:",
-            reply_markup=get_catalog_keyboard()
-        )
-        return CATALOG
-    elif text == "🎁 Бонусная программа":
-        return await show_loyalty(update, context)
-    elif text == "📦 Мои заказы":
-        return await show_my_orders(update, context)
-    elif text == "❓ FAQ":
-        return await show_faq(update, context)
-    elif text == "🚚 Доставка":
-        return await show_delivery(update, context)
-    elif text == "🔄 Перезапустить бота":
-        return await restart_bot(update, context)
-    else:
-        await update.message.reply_text(
-            "Пожалуйста, используйте кнопки меню",
-            reply_markup=get_main_keyboard()
-        )
-        return MAIN_MENU
+    """Main menu fallback: menu buttons are routed by the MAIN_MENU TextRouter"""
+    await update.message.reply_text(
+        "Пожалуйста, используйте кнопки меню",
+        reply_markup=get_main_keyboard()
+    )
+    return MAIN_MENU
 
 async def handle_catalog(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Catalog handler"""
@@ -307,47 +418,29 @@ async def handle_catalog(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return MAIN_MENU
     
-    if text == "◀️ Назад":
+    if text in ("◀️ Назад", "🛍 Каталог"):
         await update.message.reply_text(
             "Выберите категорию товаров:",
             reply_markup=get_catalog_keyboard()
         )
         return CATALOG
     
+    # Page navigation inside the current category
+    if text in (PREV_PAGE, NEXT_PAGE) and context.user_data.get('current_category'):
+        index = PRODUCT_CATALOG.current
+        category = context.user_data['current_category']
+        if index.has_category(category):
+            page = context.user_data.get('catalog_page', 0) + (1 if text == NEXT_PAGE else -1)
+            await show_category_page(update, context, index, category, page)
+            return CATALOG
+    
     # If category selected
     if text.startswith("📁 "):
         category = text[2:].strip()
-        products_in_category = []
-        keyboard = []
-        products_text = []
-        
-        # Collect products info and create buttons
-        for product_id, product in PRODUCTS.items():
-            if product['category'] == category:
-                products_text.append(format_product(product))
-                button_text = f"{product['name']}"  # Removed phone emoji
-                keyboard.append([KeyboardButton(button_text)])
-                products_in_category.append(product_id)
+        index = PRODUCT_CATALOG.current
         
-        keyboard.extend([
-            [KeyboardButton("◀️ Назад")],
-            [KeyboardButton("◀️ В главное меню")]
-        ])
-        
-        if products_in_category:
-            context.user_data['current_category'] = category
-            context.user_data['category_products'] = {
-                f"{PRODUCTS[pid]['name']}": pid  # Removed phone emoji
-                for pid in products_in_category
-            }
-            
-            message = f"📁 Категория: {category}\n\n"
-            message += "\n\n".join(products_text)
-            
-            await update.message.reply_text(
-                message,
-                reply_markup=ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-            )
+        if index.has_category(category):
+            await show_category_page(update, context, index, category)
         else:
             await update.message.reply_text(
                 "В этой категории пока нет товаров",
@@ -356,30 +449,40 @@ async def handle_catalog(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return CATALOG
     
     # If product selected
-    if 'category_products' in context.user_data and text in context.user_data['category_products']:
-        product_id = context.user_data['category_products'][text]
-        product = PRODUCTS[product_id]
-        
-        # Save selected product
-        context.user_data['selected_product'] = product_id
-        
-        # Show quantity selection keyboard
-        keyboard = []
-        # Create rows of 3 numbers each
-        for i in range(1, 10, 3):
-            row = [str(i), str(i+1), str(i+2)]
-            keyboard.append([KeyboardButton(num) for num in row])
-        keyboard.append([KeyboardButton("◀️ Назад")])
-        
+    products = PRODUCT_CATALOG.current.products
+    product_id = PRODUCT_CATALOG.resolver.resolve(
+        context.user_data.get('catalog_version'),
+        context.user_data.get('current_category'),
+        text
+    )
+    if not product_id:
+        product_id = next((
+            result_id for result_id in context.user_data.get('search_results', [])
+            if result_id in products and products[result_id]['name'] == text
+        ), None)
+    if product_id and product_id not in products:
         await update.message.reply_text(
-            f"Выберите количество для {product['name']}:",
-            reply_markup=ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+            "❌ Этот товар больше недоступен. Выберите категорию из меню",
+            reply_markup=get_catalog_keyboard()
         )
-        return SELECTING_QUANTITY
+        return CATALOG
     
+    if product_id:
+        return await show_quantity_selection(update, context, product_id, products[product_id])
+    
+    # Anything else typed in the catalog is a search query
+    return await show_search_results(update, context, text)
+
+async def back_to_category_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Go back to the category page the product was picked from"""
+    category = context.user_data.get('current_category')
+    index = PRODUCT_CATALOG.current
+    if category and index.has_category(category):
+        await show_category_page(update, context, index, category, context.user_data.get('catalog_page', 0))
+        return CATALOG
     await update.message.reply_text(
-        "Выберите категорию из меню",
-        reply_markup=get_catalog_keyboard()
+        "Выберите категорию товаров:",
+        reply_markup=index.catalog_keyboard
     )
     return CATALOG
 
@@ -388,33 +491,7 @@ async def handle_quantity(update: Update, context: ContextTypes.DEFAULT_TYPE):
     text = update.message.text
     
     if text == "◀️ Назад":
-        # Go back to category view
-        category = context.user_data.get('current_category')
-        if category:
-            products_in_category = []
-            keyboard = []
-            products_text = []
-            
-            for product_id, product in PRODUCTS.items():
-                if product['category'] == category:
-                    products_text.append(format_product(product))
-                    button_text = f"{product['name']}"  # Removed phone emoji
-                    keyboard.append([KeyboardButton(button_text)])
-                    products_in_category.append(product_id)
-            
-            keyboard.extend([
-                [KeyboardButton("◀️ Назад")],
-                [KeyboardButton("◀️ В главное меню")]
-            ])
-            
-            message = f"📁 Категория: {category}\n\n"
-            message += "\n\n".join(products_text)
-            
-            await update.message.reply_text(
-                message,
-                reply_markup=ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-            )
-            return CATALOG
+        return await back_to_category_page(update, context)
     
     try:
         quantity = int(text)
@@ -422,14 +499,14 @@ async def handle_quantity(update: Update, context: ContextTypes.DEFAULT_TYPE):
             raise ValueError
         
         product_id = context.user_data.get('selected_product')
-        if not product_id:
+        product = PRODUCT_CATALOG.current.products.get(product_id) if product_id else None
+        if not product:
             await update.message.reply_text(
                 "❌ Произошла ошибка. Пожалуйста, начните выбор товара заново.",
                 reply_markup=get_catalog_keyboard()
             )
             return CATALOG
         
-        product = PRODUCTS[product_id]
         total_price = product['price'] * quantity
         
         # Save order details in context
@@ -442,8 +519,7 @@ async def handle_quantity(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         # Check loyalty points
         user_id = str(update.effective_user.id)
-        loyalty_data = load_loyalty_data()
-        user_data = loyalty_data.get(user_id, {"points": 0, "total_spent": 0, "orders": 0})
+        user_data = await STORAGE.get_loyalty(user_id)
         available_points = user_data.get("points", 0)
         
         message = (
@@ -504,8 +580,7 @@ async def handle_points_usage(update: Update, context: ContextTypes.DEFAULT_TYPE
     
     if text == "✅ Использовать баллы":
         user_id = str(update.effective_user.id)
-        loyalty_data = load_loyalty_data()
-        user_data = loyalty_data.get(user_id, {"points": 0, "total_spent": 0, "orders": 0})
+        user_data = await STORAGE.get_loyalty(user_id)
         available_points = user_data["points"]
         points_value = available_points * 0.1  # 1 балл = 0.1 руб
         
@@ -514,6 +589,11 @@ async def handle_points_usage(update: Update, context: ContextTypes.DEFAULT_TYPE
         final_price = order['total_price'] - max_discount
         points_used = int(max_discount * 10)  # Конвертируем обратно в баллы
         
+        # Атомарно списываем баллы пользователя
+        if await STORAGE.debit_loyalty(user_id, points_used) is None:
+            # Баланс изменился с момента расчета, оформляем без баллов
+            points_used, max_discount, final_price = 0, 0, order['total_price']
+        
         # Сохраняем данные заказа
         context.user_data['order'].update({
             'points_used': points_used,
@@ -521,11 +601,6 @@ async def handle_points_usage(update: Update, context: ContextTypes.DEFAULT_TYPE
             'final_price': final_price
         })
         
-        # Обновляем баллы пользователя
-        user_data["points"] -= points_used
-        loyalty_data[user_id] = user_data
-        save_loyalty_data(loyalty_data)
-        
         message = (
             "💫 Баллы будут использованы!\n\n"
             f"Начальная сумма: {order['total_price']} р.\n"
@@ -558,14 +633,8 @@ async def handle_delivery_method(update: Update, context: ContextTypes.DEFAULT_T
     if text == "◀️ Назад":
         return await handle_quantity(update, context)
     
-    selected_method = None
-    for method_id, method in DELIVERY_METHODS.items():
-        if method['name'] == text:
-            selected_method = method
-            context.user_data['order']['delivery_method'] = method_id
-            break
-    
-    if not selected_method:
+    method_id = DELIVERY_METHOD_BY_NAME.get(text)
+    if not method_id:
         keyboard = [[KeyboardButton(method['name'])] for method in DELIVERY_METHODS.values()]
         keyboard.append([KeyboardButton("◀️ Назад")])
         await update.message.reply_text(
@@ -573,6 +642,7 @@ async def handle_delivery_method(update: Update, context: ContextTypes.DEFAULT_T
             reply_markup=ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
         )
         return DELIVERY_METHOD
+    context.user_data['order']['delivery_method'] = method_id
     
     # Ask for order comment
     await update.message.reply_text(
@@ -793,14 +863,43 @@ async def handle_order_confirmation(update: Update, context: ContextTypes.DEFAUL
                 return MAIN_MENU
 
             user = update.effective_user
-            current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            now = datetime.now()
+            current_time = now.strftime("%Y-%m-%d %H:%M:%S")
             
             # Calculate final price if not set
             if 'final_price' not in order:
-                product = PRODUCTS[order['product_id']]
+                product = PRODUCT_CATALOG.current.products[order['product_id']]
                 order['final_price'] = product['price'] * order['quantity']
                 context.user_data['order'] = order
             
+            # Persist the order (one journal append)
+            order_id = f"ORDER_{now.strftime('%Y%m%d_%H%M%S')}_{user.id}"
+            saved = await save_order(order_id, Order(
+                user_id=user.id,
+                username=f"@{user.username}" if user.username else None,
+                full_name=user.full_name,
+                product_id=order.get('product_id'),
+                product_name=order.get('product_name'),
+                quantity=order.get('quantity'),
+                total_price=order.get('total_price'),
+                final_price=order.get('final_price'),
+                points_used=order.get('points_used', 0),
+                delivery_method=order.get('delivery_method'),
+                comment=order.get('comment'),
+                user_data=order.get('user_data'),
+                created_at=int(now.timestamp())
+            ))
+            if not saved:
+                # Nothing was stored: keep the order data so the customer can retry
+                await update.message.reply_text(
+                    "❌ Не удалось сохранить заказ. Пожалуйста, попробуйте еще раз или свяжитесь с администратором.",
+                    reply_markup=ReplyKeyboardMarkup([
+                        [KeyboardButton("✅ Оформить заказ")],
+                        [KeyboardButton("❌ Отменить"), KeyboardButton("◀️ Назад")]
+                    ], resize_keyboard=True)
+                )
+                return CONFIRM_ORDER
+            
             print(f"Preparing to send order to admin group {ADMIN_CHAT_ID}")
             print(f"User info: {user.first_name} (ID: {user.id})")
             
@@ -835,22 +934,11 @@ async def handle_order_confirmation(update: Update, context: ContextTypes.DEFAUL
                 if line.strip():  # Only add non-empty lines
                     admin_message += f"{line}\n"
 
-            print("Attempting to send message to admin group...")
-            
             # Create inline keyboard for tracking code
             keyboard = InlineKeyboardMarkup([
-                [InlineKeyboardButton("📤 Отправить трек-код", callback_data=f"track|{user.id}")]
+                [InlineKeyboardButton("📤 Отправить трек-код", callback_data=encode_callback("track", order_id))]
             ])
             
-            # Send message to admin group
-            sent_message = await context.bot.send_message(
-                chat_id=ADMIN_CHAT_ID,
-                text=admin_message,
-                parse_mode=None,
-                reply_markup=keyboard
-            )
-            print(f"Message successfully sent to admin group: {sent_message.message_id}")
-            
             # Send confirmation to user with improved formatting
             success_message = (
                 "✅ Заказ успешно оформлен!\n"
@@ -876,10 +964,22 @@ async def handle_order_confirmation(update: Update, context: ContextTypes.DEFAUL
                 "━━━━━━━━━━━━━━━"
             )
             
-            await update.message.reply_text(
-                success_message,
-                reply_markup=get_main_keyboard()
-            )
+            # The customer hears back first; the admin group gets the order
+            # through the outbox, which survives API errors and restarts.
+            # The order is saved by now, so a failed reply or notification
+            # must not skip the loyalty credit and cleanup below
+            try:
+                await update.message.reply_text(
+                    success_message,
+                    reply_markup=get_main_keyboard()
+                )
+            except Exception as e:
+                logging.error(f"Could not confirm order {order_id} to user {user.id}: {e}")
+            try:
+                await ADMIN_OUTBOX.enqueue(ADMIN_CHAT_ID, admin_message, reply_markup=keyboard)
+                logging.info(f"Order {order_id} queued for admin group {ADMIN_CHAT_ID}")
+            except Exception as e:
+                logging.error(f"Could not queue order {order_id} for admin group {ADMIN_CHAT_ID}: {e}")
             
             # Clear the order data from context
             if 'order' in context.user_data:
@@ -888,20 +988,14 @@ async def handle_order_confirmation(update: Update, context: ContextTypes.DEFAUL
             
             # Начисляем баллы за заказ
             user_id = str(update.effective_user.id)
-            loyalty_data = load_loyalty_data()
-            user_data = loyalty_data.get(user_id, {"points": 0, "total_spent": 0, "orders": 0})
             
             # Рассчитываем и начисляем новые баллы
             order_total = order.get('final_price', 0)
             new_points = calculate_points(order_total)
             
-            # Обновляем данные пользователя
-            user_data["points"] += new_points
-            user_data["total_spent"] += order_total
-            user_data["orders"] += 1
-            
-            loyalty_data[user_id] = user_data
-            save_loyalty_data(loyalty_data)
+            # Атомарно обновляем данные пользователя
+            user_data = await STORAGE.credit_loyalty(user_id, new_points, spent=order_total, orders=1)
+            USERS.mark_ordered(user_id)
             
             # Отправляем сообщение о начислении баллов
             points_message = (
@@ -919,9 +1013,7 @@ async def handle_order_confirmation(update: Update, context: ContextTypes.DEFAUL
             return MAIN_MENU
                 
         except Exception as e:
-            print(f"Error processing order: {str(e)}")
-            print(f"Error type: {type(e)}")
-            print(f"Full error details: {e.__dict__}")
+            logging.error(f"Error processing order: {e}")
             # Send error message to user only if no success message was sent
             if 'success_message' not in locals():
                 await update.message.reply_text(
@@ -940,25 +1032,6 @@ async def handle_order_confirmation(update: Update, context: ContextTypes.DEFAUL
     )
     return CONFIRM_ORDER
 
-def load_loyalty_data():
-    """Load loyalty data from file"""
-    try:
-        if os.path.exists(LOYALTY_FILE):
-            with open(LOYALTY_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        return {}
-    except Exception as e:
-        logging.error(f"Error loading loyalty data: {e}")
-        return {}
-
-def save_loyalty_data(data):
-    """Save loyalty data to file"""
-    try:
-        with open(LOYALTY_FILE, 'w', encoding='utf-8') as f:
-            json.dump(data, ensure_ascii=False, indent=2, fp=f)
-    except Exception as e:
-        logging.error(f"Error saving loyalty data: {e}")
-
 def calculate_points(amount):
     """Calculate bonus points from purchase amount"""
     return int(amount * 0.05)  # 5% от суммы заказа в баллах
@@ -966,8 +1039,7 @@ def calculate_points(amount):
 async def show_loyalty(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Show loyalty program information"""
     user_id = str(update.effective_user.id)
-    loyalty_data = load_loyalty_data()
-    user_data = loyalty_data.get(user_id, {"points": 0, "total_spent": 0, "orders": 0})
+    user_data = await STORAGE.get_loyalty(user_id)
     
     # Форматируем числа для красивого отображения
     points = user_data.get("points", 0)
@@ -1063,18 +1135,25 @@ async def show_delivery(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(delivery_text, reply_markup=reply_markup)
     return MAIN_MENU
 
-async def send_tracking_code(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def send_tracking_code(update: Update, context: ContextTypes.DEFAULT_TYPE, data):
     """Handle the tracking code button press"""
     query = update.callback_query
     await query.answer()  # Answer the callback query to remove loading state
     
     try:
-        # Parse user ID from callback data
-        _, user_id = query.data.split('|')
-        user_id = int(user_id)
+        if data.order_id:
+            order = await STORAGE.get_order(data.order_id)
+            if not order:
+                await query.message.reply_text(f"❌ Заказ {data.order_id} не найден.")
+                return MAIN_MENU
+            user_id = int(order.user_id)
+        else:
+            # Legacy button without an order: only the customer is known
+            user_id = data.user_id
         
-        # Save target user ID in context
+        # Save target user and order in context
         context.user_data['target_user_id'] = user_id
+        context.user_data['target_order_id'] = data.order_id or None
         
         # Remove inline keyboard
         await query.message.edit_reply_markup(None)
@@ -1128,14 +1207,23 @@ async def handle_admin_tracking_input(update: Update, context: ContextTypes.DEFA
                 text=tracking_message
             )
             
+            # Record the shipment on the order the button was bound to
+            order_id = context.user_data.get('target_order_id')
+            recorded = order_id and await update_order(order_id, tracking_code=tracking_code, delivered=True)
+            
             # Confirm to admin
+            status_line = ""
+            if recorded:
+                status_line = f"\nЗаказ {order_id} отмечен как отправленный"
+            elif order_id:
+                status_line = f"\n⚠️ Не удалось отметить заказ {order_id} как отправленный"
             await update.message.reply_text(
-                f"✅ Трек-код успешно отправлен пользователю (ID: {user_id})"
+                f"✅ Трек-код успешно отправлен пользователю (ID: {user_id})" + status_line
             )
             
             # Clear context data
-            if 'target_user_id' in context.user_data:
-                del context.user_data['target_user_id']
+            context.user_data.pop('target_user_id', None)
+            context.user_data.pop('target_order_id', None)
             
             return MAIN_MENU
             
@@ -1192,48 +1280,40 @@ async def restart_bot(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return MAIN_MENU
 
 def get_stats_for_last_7_days():
-    """Get statistics for the last 7 days"""
-    orders = load_orders()
-    now = datetime.now()
-    week_ago = now - timedelta(days=7)
-    
-    # Filter orders for last 7 days
-    recent_orders = {
-        order_id: order for order_id, order in orders.items()
-        if datetime.strptime(order.get('timestamp', ''), "%Y-%m-%d %H:%M:%S") > week_ago
-    }
+    """Get statistics for the last 7 days (today and the 6 days before)"""
+    week_ago = datetime.now() - timedelta(days=7)
     
-    # Calculate statistics
-    total_orders = len(recent_orders)
-    total_sum = sum(order.get('final_price', 0) for order in recent_orders.values())
-    completed = sum(1 for order in recent_orders.values() if order.get('delivered'))
-    in_progress = total_orders - completed
-    
-    # Get unique users
-    unique_users = len(set(order.get('user_id') for order in recent_orders.values()))
-    
-    # Get top 3 clients
-    user_totals = {}
-    for order in recent_orders.values():
-        user_id = order.get('user_id')
-        if user_id:
-            user_totals[user_id] = user_totals.get(user_id, 0) + order.get('final_price', 0)
-    
-    top_clients = sorted(user_totals.items(), key=lambda x: x[1], reverse=True)[:3]
-    
-    return {
-        'total_orders': total_orders,
-        'total_sum': total_sum,
-        'completed': completed,
-        'in_progress': in_progress,
-        'new_users': unique_users,
-        'top_clients': top_clients
-    }
+    # Sums of the per-day buckets the order store keeps up to date
+    aggregates = ORDER_STORE.aggregates()
+    stats = aggregates.last_days(7)
+    
+    # Users who pressed /start (or first ordered) this week
+    stats['new_users'] = len(USERS.new_users(week_ago))
+    stats['top_clients'] = aggregates.top_clients(3)
+    return stats
+
+def parse_stats_window(args):
+    """/stats, /analytics and /export arguments -> (since, until) dates: none, a number of days, or two dates"""
+    today = datetime.now().date()
+    if not args:
+        return today - timedelta(days=29), today
+    if len(args) == 1 and args[0].isdigit() and int(args[0]) > 0:
+        return today - timedelta(days=int(args[0]) - 1), today
+    if len(args) == 2:
+        since, until = (datetime.strptime(arg, "%Y-%m-%d").date() for arg in args)
+        if since <= until:
+            return since, until
+    raise ValueError("Invalid stats window")
+
+def sales_report(since, until):
+    """Text of the sales analytics for the days since .. until (storage thread)"""
+    report = ORDER_STORE.analytics().report(since, until)
+    return format_report(report, {method_id: method['name'] for method_id, method in DELIVERY_METHODS.items()})
 
 async def show_admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE, message_id=None):
     """Show admin panel with statistics"""
     # Get statistics for last 7 days
-    stats = get_stats_for_last_7_days()
+    stats = await STORAGE.run(get_stats_for_last_7_days)
     
     # Format admin panel message
     admin_message = (
@@ -1255,16 +1335,16 @@ async def show_admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE, m
     # Create inline keyboard with admin actions
     keyboard = [
         [
-            InlineKeyboardButton("📢 Рассылка", callback_data="admin_broadcast"),
-            InlineKeyboardButton("➕ Добавить товар", callback_data="admin_add_product")
+            InlineKeyboardButton("📢 Рассылка", callback_data=encode_callback("admin_broadcast")),
+            InlineKeyboardButton("➕ Добавить товар", callback_data=encode_callback("admin_add_product"))
         ],
         [
-            InlineKeyboardButton("📊 Статистика", callback_data="admin_stats"),
-            InlineKeyboardButton("📥 Экспорт в Excel", callback_data="admin_export")
+            InlineKeyboardButton("📊 Статистика", callback_data=encode_callback("admin_stats")),
+            InlineKeyboardButton("📥 Экспорт заказов", callback_data=encode_callback("admin_export"))
         ],
         [
-            InlineKeyboardButton("📋 Заказы за 7 дней", callback_data="admin_recent_orders"),
-            InlineKeyboardButton("👥 Новые пользователи", callback_data="admin_new_users")
+            InlineKeyboardButton("📋 Заказы за 7 дней", callback_data=encode_callback("admin_recent_orders")),
+            InlineKeyboardButton("👥 Новые пользователи", callback_data=encode_callback("admin_new_users"))
         ]
     ]
     
@@ -1289,26 +1369,36 @@ async def admin_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await show_admin_panel(update, context)
     return MAIN_MENU
 
-async def handle_admin_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def handle_admin_callback(update: Update, context: ContextTypes.DEFAULT_TYPE, data):
     """Handle admin panel button callbacks"""
     query = update.callback_query
     await query.answer()
     
-    if query.data == "admin_back":
+    if str(update.effective_chat.id) != ADMIN_CHAT_ID:
+        return None
+    
+    if data.action == "admin_back":
         # Return to main admin panel
         await show_admin_panel(update, context, query.message.message_id)
         return MAIN_MENU
     
-    elif query.data == "admin_broadcast":
-        keyboard = [[InlineKeyboardButton("◀️ Назад", callback_data="admin_back")]]
+    elif data.action == "admin_broadcast" or data.action in BROADCAST_SEGMENTS:
+        if data.action in BROADCAST_SEGMENTS:
+            context.user_data['broadcast_segment'] = data.action
+        selected = context.user_data.get('broadcast_segment', "admin_bc_all")
+        keyboard = [
+            [InlineKeyboardButton(("✅ " if action == selected else "") + label, callback_data=encode_callback(action))]
+            for action, (_, label) in BROADCAST_SEGMENTS.items()
+        ]
+        keyboard.append([InlineKeyboardButton("◀️ Назад", callback_data=encode_callback("admin_back"))])
         await query.message.edit_text(
-            "📢 Введите текст для рассылки:",
+            "📢 Выберите получателей и введите текст для рассылки:",
             reply_markup=InlineKeyboardMarkup(keyboard)
         )
         return ADMIN_BROADCAST
         
-    elif query.data == "admin_add_product":
-        keyboard = [[InlineKeyboardButton("◀️ Назад", callback_data="admin_back")]]
+    elif data.action == "admin_add_product":
+        keyboard = [[InlineKeyboardButton("◀️ Назад", callback_data=encode_callback("admin_back"))]]
         await query.message.edit_text(
             "➕ Для добавления товара отправьте данные в формате:\n"
             "Название\n"
@@ -1319,104 +1409,160 @@ async def handle_admin_callback(update: Update, context: ContextTypes.DEFAULT_TY
         )
         return ADMIN_ADD_PRODUCT
         
-    elif query.data == "admin_stats":
-        stats = get_stats_for_last_7_days()
+    elif data.action == "admin_stats":
+        stats = await STORAGE.run(get_stats_for_last_7_days)
+        month = (await STORAGE.run(ORDER_STORE.aggregates)).last_days(30)
         stats_message = (
             "📊 Подробная статистика\n"
             "━━━━━━━━━━━━━━━\n\n"
             f"Заказов за неделю: {stats['total_orders']}\n"
             f"Общая сумма: {stats['total_sum']} р.\n"
             f"Средний чек: {stats['total_sum']/stats['total_orders'] if stats['total_orders'] else 0:.2f} р.\n"
-            f"Конверсия: {(stats['completed']/stats['total_orders']*100) if stats['total_orders'] else 0:.1f}%"
+            f"Конверсия: {(stats['completed']/stats['total_orders']*100) if stats['total_orders'] else 0:.1f}%\n\n"
+            f"Заказов за 30 дней: {month['total_orders']}\n"
+            f"Общая сумма: {month['total_sum']} р.\n"
+            f"Покупателей: {month['customers']}\n\n"
+            "Другой период: /stats <дней> или /stats ГГГГ-ММ-ДД ГГГГ-ММ-ДД"
         )
-        keyboard = [[InlineKeyboardButton("◀️ Назад", callback_data="admin_back")]]
+        keyboard = [
+            [InlineKeyboardButton("📈 Аналитика за 30 дней", callback_data=encode_callback("admin_analytics"))],
+            [InlineKeyboardButton("◀️ Назад", callback_data=encode_callback("admin_back"))]
+        ]
         await query.message.edit_text(
             stats_message,
             reply_markup=InlineKeyboardMarkup(keyboard)
         )
         
-    elif query.data == "admin_export":
-        try:
-            # Show processing message
-            processing_message = await query.message.edit_text(
-                "📊 Подготовка файла...",
-                reply_markup=None
-            )
-            
-            # Generate Excel file
-            excel_buffer = await export_to_excel(context)
-            
-            # Get current date for filename
-            current_date = datetime.now().strftime("%Y-%m-%d")
-            
-            # Send Excel file
-            await context.bot.send_document(
-                chat_id=update.effective_chat.id,
-                document=excel_buffer,
-                filename=f'orders_{current_date}.xlsx',
-                caption="📊 Отчет по заказам"
-            )
-            
-            # Return to admin panel
-            await show_admin_panel(update, context, processing_message.message_id)
-            
-        except Exception as e:
-            logging.error(f"Error exporting to Excel: {e}")
-            keyboard = [[InlineKeyboardButton("◀️ Назад", callback_data="admin_back")]]
-            await query.message.edit_text(
-                "❌ Произошла ошибка при создании отчета",
+    elif data.action == "admin_analytics":
+        today = datetime.now().date()
+        report = await STORAGE.run(sales_report, today - timedelta(days=29), today)
+        keyboard = [[InlineKeyboardButton("◀️ Назад", callback_data=encode_callback("admin_stats"))]]
+        await query.message.edit_text(
+            report + "\n\nДругой период: /analytics <дней> или /analytics ГГГГ-ММ-ДД ГГГГ-ММ-ДД",
+            reply_markup=InlineKeyboardMarkup(keyboard)
+        )
+        
+    elif data.action == "admin_export" or data.action in EXPORT_PERIODS:
+        if data.action in EXPORT_PERIODS:
+            context.user_data['export_period'] = data.action
+        selected = context.user_data.get('export_period', "admin_exp_new")
+        periods = [
+            InlineKeyboardButton(("✅ " if action == selected else "") + label, callback_data=encode_callback(action))
+            for action, (_, label) in EXPORT_PERIODS.items()
+        ]
+        keyboard = [periods[i:i + 2] for i in range(0, len(periods), 2)]
+        keyboard.append([
+            InlineKeyboardButton(label, callback_data=encode_callback(action))
+            for action, (_, label) in EXPORT_FORMATS.items()
+        ])
+        keyboard.append([InlineKeyboardButton("◀️ Назад", callback_data=encode_callback("admin_back"))])
+        last_export = f"{EXPORTER.last_export:%d.%m.%Y %H:%M}" if EXPORTER.last_export else "еще не было"
+        await query.message.edit_text(
+            "📥 Экспорт заказов\n"
+            "━━━━━━━━━━━━━━━\n\n"
+            f"Прошлая выгрузка: {last_export}\n"
+            "Выберите период, затем формат файла.\n\n"
+            "Другой период: /export ГГГГ-ММ-ДД ГГГГ-ММ-ДД [xlsx|csv|jsonl]",
+            reply_markup=InlineKeyboardMarkup(keyboard)
+        )
+        return MAIN_MENU
+        
+    elif data.action in EXPORT_FORMATS:
+        days, _ = EXPORT_PERIODS[context.user_data.get('export_period', "admin_exp_new")]
+        until = datetime.now().replace(microsecond=0)
+        if days == 0:
+            since = EXPORTER.last_export
+        elif days is None:
+            since = None
+        else:
+            since = datetime.combine(until.date() - timedelta(days=days - 1), time.min)
+        
+        # Show processing message; the file follows when the worker is done
+        processing_message = await query.message.edit_text(
+            "📊 Подготовка файла...",
+            reply_markup=None
+        )
+        # Claimed right before the task starts, so two exports cannot both pass
+        if not EXPORTER.reserve():
+            keyboard = [[InlineKeyboardButton("◀️ Назад", callback_data=encode_callback("admin_back"))]]
+            await processing_message.edit_text(
+                "⏳ Отчет уже готовится, файл придет сюда",
                 reply_markup=InlineKeyboardMarkup(keyboard)
             )
+            return MAIN_MENU
+        context.application.create_task(
+            send_orders_export(update, context, processing_message, EXPORT_FORMATS[data.action][0], since, until),
+            update=update
+        )
         return MAIN_MENU
         
-    elif query.data == "admin_recent_orders":
-        orders = load_orders()
+    elif data.action == "admin_recent_orders":
         now = datetime.now()
         week_ago = now - timedelta(days=7)
-        recent_orders = {
-            order_id: order for order_id, order in orders.items()
-            if datetime.strptime(order.get('timestamp', ''), "%Y-%m-%d %H:%M:%S") > week_ago
-        }
+        recent_orders = await STORAGE.orders_since(week_ago)
         
         if not recent_orders:
-            keyboard = [[InlineKeyboardButton("◀️ Назад", callback_data="admin_back")]]
+            keyboard = [[InlineKeyboardButton("◀️ Назад", callback_data=encode_callback("admin_back"))]]
             await query.message.edit_text(
                 "📋 Нет заказов за последние 7 дней",
                 reply_markup=InlineKeyboardMarkup(keyboard)
             )
             return
             
+        pages = -(-len(recent_orders) // ADMIN_ORDERS_PAGE_SIZE)
+        page = min(max(data.page, 0), pages - 1)
         orders_message = "📋 Заказы за 7 дней:\n\n"
-        for order_id, order in recent_orders.items():
-            status = "✅" if order.get('delivered') else "🕒"
+        if pages > 1:
+            orders_message = f"📋 Заказы за 7 дней (стр. {page + 1}/{pages}):\n\n"
+        start_index = page * ADMIN_ORDERS_PAGE_SIZE
+        for order_id, order in recent_orders[start_index:start_index + ADMIN_ORDERS_PAGE_SIZE]:
+            status = "✅" if order.delivered else "🕒"
             orders_message += (
                 f"{status} Заказ {order_id}\n"
-                f"👤 Пользователь: {order.get('user_id')}\n"
-                f"💰 Сумма: {order.get('final_price')} р.\n"
-                f"📅 Дата: {order.get('timestamp')}\n\n"
+                f"👤 Пользователь: {order.user_id}\n"
+                f"💰 Сумма: {order.final_price} р.\n"
+                f"📅 Дата: {order.timestamp}\n\n"
             )
         
-        keyboard = [[InlineKeyboardButton("◀️ Назад", callback_data="admin_back")]]
+        navigation = []
+        if page > 0:
+            navigation.append(InlineKeyboardButton("⬅️ Пред.", callback_data=encode_callback("admin_recent_orders", page=page - 1)))
+        if page < pages - 1:
+            navigation.append(InlineKeyboardButton("След. ➡️", callback_data=encode_callback("admin_recent_orders", page=page + 1)))
+        keyboard = [navigation] if navigation else []
+        keyboard.append([InlineKeyboardButton("◀️ Назад", callback_data=encode_callback("admin_back"))])
         await query.message.edit_text(
             orders_message,
             reply_markup=InlineKeyboardMarkup(keyboard)
         )
         
-    elif query.data == "admin_new_users":
-        orders = load_orders()
+    elif data.action == "admin_new_users":
         now = datetime.now()
         week_ago = now - timedelta(days=7)
-        new_users = set()
-        
-        for order in orders.values():
-            if datetime.strptime(order.get('timestamp', ''), "%Y-%m-%d %H:%M:%S") > week_ago:
-                new_users.add(order.get('user_id'))
+        new_users = USERS.new_users(week_ago)
         
+        pages = max(1, -(-len(new_users) // ADMIN_USERS_PAGE_SIZE))
+        page = min(max(data.page, 0), pages - 1)
         users_message = f"👥 Новые пользователи за 7 дней: {len(new_users)}\n\n"
-        for user_id in new_users:
-            users_message += f"• ID: {user_id}\n"
+        if pages > 1:
+            users_message = f"👥 Новые пользователи за 7 дней: {len(new_users)} (стр. {page + 1}/{pages})\n\n"
+        start_index = page * ADMIN_USERS_PAGE_SIZE
+        for user_id in new_users[start_index:start_index + ADMIN_USERS_PAGE_SIZE]:
+            record = USERS.get(user_id) or {}
+            users_message += f"• ID: {user_id}"
+            if record.get('username'):
+                users_message += f" (@{record['username']})"
+            if record.get('has_ordered'):
+                users_message += " 🛒"
+            users_message += "\n"
         
-        keyboard = [[InlineKeyboardButton("◀️ Назад", callback_data="admin_back")]]
+        navigation = []
+        if page > 0:
+            navigation.append(InlineKeyboardButton("⬅️ Пред.", callback_data=encode_callback("admin_new_users", page=page - 1)))
+        if page < pages - 1:
+            navigation.append(InlineKeyboardButton("След. ➡️", callback_data=encode_callback("admin_new_users", page=page + 1)))
+        keyboard = [navigation] if navigation else []
+        keyboard.append([InlineKeyboardButton("◀️ Назад", callback_data=encode_callback("admin_back"))])
         await query.message.edit_text(
             users_message,
             reply_markup=InlineKeyboardMarkup(keyboard)
@@ -1435,34 +1581,17 @@ async def handle_admin_broadcast(update: Update, context: ContextTypes.DEFAULT_T
         
     broadcast_text = update.message.text
     
-    # Load orders to get unique users
-    orders = load_orders()
-    all_users = set(order.get('user_id') for order in orders.values() if order.get('user_id'))
-    
-    success_count = 0
-    fail_count = 0
+    # Audience from the user registry; blocked users are skipped
+    segment, _ = BROADCAST_SEGMENTS[context.user_data.pop('broadcast_segment', "admin_bc_all")]
+    recipients = USERS.segment(segment, since=datetime.now() - timedelta(days=7))
     
-    # Send message to all users
-    for user_id in all_users:
-        try:
-            await context.bot.send_message(
-                chat_id=user_id,
-                text=broadcast_text
-            )
-            success_count += 1
-        except Exception as e:
-            logging.error(f"Failed to send broadcast to {user_id}: {e}")
-            fail_count += 1
-    
-    # Send summary to admin
-    summary = (
-        "📢 Результаты рассылки:\n"
-        f"✅ Успешно отправлено: {success_count}\n"
-        f"❌ Ошибок отправки: {fail_count}\n"
-        f"👥 Всего пользователей: {len(all_users)}"
-    )
+    # Sent in the background; the progress message below is edited as it goes
+    try:
+        await BROADCASTS.start(broadcast_text, recipients, ADMIN_CHAT_ID)
+    except Exception as e:
+        logging.error(f"Error starting broadcast: {e}")
+        await update.message.reply_text("❌ Не удалось запустить рассылку")
     
-    await update.message.reply_text(summary)
     await show_admin_panel(update, context)
     return MAIN_MENU
 
@@ -1489,13 +1618,13 @@ async def handle_admin_add_product(update: Update, context: ContextTypes.DEFAULT
         # Generate product ID
         product_id = name.lower().replace(' ', '_')
         
-        # Add to PRODUCTS dictionary
-        PRODUCTS[product_id] = {
+        # Save to catalog.json and swap in the rebuilt catalog
+        await STORAGE.run(PRODUCT_CATALOG.add_product, product_id, {
             'name': name,
             'price': price,
             'category': category,
             'description': description
-        }
+        })
         
         # Confirm to admin
         confirmation = (
@@ -1510,7 +1639,7 @@ async def handle_admin_add_product(update: Update, context: ContextTypes.DEFAULT
         await show_admin_panel(update, context)
         
     except ValueError as e:
-        keyboard = [[InlineKeyboardButton("◀️ Назад", callback_data="admin_back")]]
+        keyboard = [[InlineKeyboardButton("◀️ Назад", callback_data=encode_callback("admin_back"))]]
         await update.message.reply_text(
             "❌ Ошибка в формате данных!\n\n"
             "Используйте формат:\n"
@@ -1522,7 +1651,7 @@ async def handle_admin_add_product(update: Update, context: ContextTypes.DEFAULT
         )
     except Exception as e:
         logging.error(f"Error adding product: {e}")
-        keyboard = [[InlineKeyboardButton("◀️ Назад", callback_data="admin_back")]]
+        keyboard = [[InlineKeyboardButton("◀️ Назад", callback_data=encode_callback("admin_back"))]]
         await update.message.reply_text(
             "❌ Произошла ошибка при добавлении товара",
             reply_markup=InlineKeyboardMarkup(keyboard)
@@ -1530,84 +1659,182 @@ async def handle_admin_add_product(update: Update, context: ContextTypes.DEFAULT
     
     return MAIN_MENU
 
-async def export_to_excel(context: ContextTypes.DEFAULT_TYPE):
-    """Export orders data to Excel file"""
-    orders = load_orders()
+async def send_orders_export(update: Update, context: ContextTypes.DEFAULT_TYPE, message,
+                             fmt, since, until, up_to_now=True):
+    """Export orders placed in [since, until) in a worker process and send the file (background task).
+
+    ``up_to_now`` exports that start at or before the "since last export"
+    mark (or cover the whole history) move it to ``until``.
+    The caller has claimed the exporter with ``EXPORTER.reserve()``.
+    """
+    async def report_progress(done, total):
+        await message.edit_text(f"📊 Подготовка файла... {done} из {total} заказов")
     
-    # Prepare data for Excel
-    excel_data = []
-    for order_id, order in orders.items():
-        # Convert timestamp string to datetime
-        try:
-            order_date = datetime.strptime(order.get('timestamp', ''), "%Y-%m-%d %H:%M:%S")
-        except:
-            order_date = None
-            
-        excel_data.append({
-            'ID заказа': order_id,
-            'Дата': order_date,
-            'Покупатель ID': order.get('user_id'),
-            'Товар': order.get('product_name'),
-            'Количество': order.get('quantity'),
-            'Сумма': order.get('final_price'),
-            'Способ доставки': DELIVERY_METHODS[order.get('delivery_method', '')]['name'] if order.get('delivery_method') else '',
-            'Статус': 'Доставлен' if order.get('delivered') else 'В обработке',
-            'Трек-код': order.get('tracking_code', ''),
-            'Использовано баллов': order.get('points_used', 0),
-            'Комментарий': order.get('comment', '')
-        })
+    try:
+        path, rows = await EXPORTER.export(fmt, since, until, report_progress, reserved=True)
+    except Exception as e:
+        logging.error(f"Error exporting orders: {e}")
+        keyboard = [[InlineKeyboardButton("◀️ Назад", callback_data=encode_callback("admin_back"))]]
+        await message.edit_text(
+            "❌ Произошла ошибка при создании отчета",
+            reply_markup=InlineKeyboardMarkup(keyboard)
+        )
+        return
     
-    # Create DataFrame
-    df = pd.DataFrame(excel_data)
+    last_day = until - timedelta(seconds=1)
+    period = f"{since:%d.%m.%Y %H:%M} — {last_day:%d.%m.%Y %H:%M}" if since else f"по {last_day:%d.%m.%Y %H:%M}"
+    try:
+        if not rows:
+            keyboard = [[InlineKeyboardButton("◀️ Назад", callback_data=encode_callback("admin_back"))]]
+            await message.edit_text(
+                f"📭 Нет заказов за период {period}",
+                reply_markup=InlineKeyboardMarkup(keyboard)
+            )
+        else:
+            await message.edit_text(f"📤 Отправка файла ({rows} заказов)...")
+            since_name = f"{since:%Y-%m-%d}_" if since else ""
+            with open(path, 'rb') as document:
+                await context.bot.send_document(
+                    chat_id=update.effective_chat.id,
+                    document=document,
+                    filename=f'orders_{since_name}{last_day:%Y-%m-%d}.{fmt}',
+                    caption=f"📊 Отчет по заказам {period}: {rows}",
+                    write_timeout=EXPORT_UPLOAD_TIMEOUT
+                )
+            # Return to admin panel
+            await show_admin_panel(update, context, message.message_id)
+        # Only an export that leaves no gap after the previous one moves the mark
+        last_export = EXPORTER.last_export
+        if up_to_now and (since is None or (last_export is not None and since <= last_export)):
+            await EXPORTER.mark_exported(until)
+    except Exception as e:
+        logging.error(f"Error sending the order report: {e}")
+        await message.edit_text("❌ Не удалось отправить отчет")
+    finally:
+        os.remove(path)
+
+async def on_startup(application: Application):
+    """Start background monitors once the event loop is running"""
+    LOOP_LAG.start()
+    CATALOG_WATCHER.start()
+    BROADCASTS.start_background(application.bot)
+    ADMIN_OUTBOX.start_background(application.bot)
+
+async def on_shutdown(application: Application):
+    """Flush buffered data before the process exits"""
+    LOOP_LAG.stop()
+    CATALOG_WATCHER.stop()
+    await BROADCASTS.stop()
+    await ADMIN_OUTBOX.stop()
+    USERS.close()
+    STORAGE.shutdown()
+    LOYALTY_STORE.close()
+    ORDER_STORE.close()
+
+async def reload_catalog_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Reload catalog.json on admin request without pausing other updates"""
+    if str(update.effective_chat.id) != ADMIN_CHAT_ID:
+        return
     
-    # Sort by date
-    if not df.empty and df['Дата'].notna().any():
-        df = df.sort_values('Дата', ascending=False)
+    try:
+        index = await STORAGE.run(PRODUCT_CATALOG.reload)
+        if index is not None:
+            await update.message.reply_text(
+                f"✅ Каталог обновлен: версия {index.version}, товаров: {len(index.products)}"
+            )
+        else:
+            await update.message.reply_text("ℹ️ Каталог не изменился")
+    except Exception as e:
+        logging.error(f"Error reloading catalog: {e}")
+        await update.message.reply_text("❌ Ошибка при загрузке каталога, оставлена текущая версия")
+
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Order totals for a custom window: /stats [days | from to]"""
+    if str(update.effective_chat.id) != ADMIN_CHAT_ID:
+        return
     
-    # Create Excel file in memory
-    excel_buffer = io.BytesIO()
+    try:
+        since, until = parse_stats_window(context.args)
+    except ValueError:
+        await update.message.reply_text(
+            "Использование: /stats <дней> или /stats ГГГГ-ММ-ДД ГГГГ-ММ-ДД"
+        )
+        return
     
-    # Create Excel writer
-    with pd.ExcelWriter(excel_buffer, engine='xlsxwriter') as writer:
-        # Write orders sheet
-        df.to_excel(writer, sheet_name='Заказы', index=False)
-        
-        # Get workbook and worksheet
-        workbook = writer.book
-        worksheet = writer.sheets['Заказы']
-        
-        # Add formats
-        header_format = workbook.add_format({
-            'bold': True,
-            'bg_color': '#4B5563',
-            'font_color': 'white',
-            'border': 1
-        })
-        
-        cell_format = workbook.add_format({
-            'border': 1
-        })
-        
-        # Apply formats
-        for col_num, value in enumerate(df.columns.values):
-            worksheet.write(0, col_num, value, header_format)
-            
-        # Auto-adjust columns width
-        for i, col in enumerate(df.columns):
-            max_length = max(
-                df[col].astype(str).apply(len).max(),
-                len(str(col))
-            ) + 2
-            worksheet.set_column(i, i, max_length)
-            
-        # Add totals
-        total_row = len(df) + 2
-        worksheet.write(total_row, 0, 'ИТОГО:', header_format)
-        worksheet.write(total_row, 5, f'=SUM(F2:F{len(df)+1})', header_format)
+    stats = (await STORAGE.run(ORDER_STORE.aggregates)).window(since, until)
+    await update.message.reply_text(
+        f"📊 Статистика {since:%d.%m.%Y} — {until:%d.%m.%Y}\n"
+        "━━━━━━━━━━━━━━━\n\n"
+        f"Всего заказов: {stats['total_orders']}\n"
+        f"На сумму: {stats['total_sum']} р.\n"
+        f"Выполнено: {stats['completed']}\n"
+        f"В обработке: {stats['in_progress']}\n"
+        f"Покупателей: {stats['customers']}"
+    )
+
+async def analytics_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Sales analytics for a custom window: /analytics [days | from to]"""
+    if str(update.effective_chat.id) != ADMIN_CHAT_ID:
+        return
+    
+    try:
+        since, until = parse_stats_window(context.args)
+    except ValueError:
+        await update.message.reply_text(
+            "Использование: /analytics <дней> или /analytics ГГГГ-ММ-ДД ГГГГ-ММ-ДД"
+        )
+        return
+    
+    await update.message.reply_text(await STORAGE.run(sales_report, since, until))
+
+async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Order export for a custom window: /export [days | from to] [xlsx|csv|jsonl]"""
+    if str(update.effective_chat.id) != ADMIN_CHAT_ID:
+        return
+    
+    formats = {fmt.split('.')[0]: fmt for fmt, _ in EXPORT_FORMATS.values()}
+    args = list(context.args)
+    fmt = formats[args.pop().lower()] if args and args[-1].lower() in formats else 'xlsx'
+    try:
+        since_date, until_date = parse_stats_window(args)
+    except ValueError:
+        await update.message.reply_text(
+            "Использование: /export <дней> или /export ГГГГ-ММ-ДД ГГГГ-ММ-ДД, "
+            "в конце можно указать формат: xlsx, csv или jsonl"
+        )
+        return
     
-    # Get the value of the buffer
-    excel_buffer.seek(0)
-    return excel_buffer
+    now = datetime.now().replace(microsecond=0)
+    since = datetime.combine(since_date, time.min)
+    until = datetime.combine(until_date + timedelta(days=1), time.min)
+    up_to_now = until > now
+    processing_message = await update.message.reply_text("📊 Подготовка файла...")
+    if not EXPORTER.reserve():
+        await processing_message.edit_text("⏳ Отчет уже готовится, файл придет сюда")
+        return
+    context.application.create_task(
+        send_orders_export(update, context, processing_message, fmt, since, min(until, now), up_to_now),
+        update=update
+    )
+
+async def health_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Show event loop lag and storage cache counters to admins"""
+    if str(update.effective_chat.id) != ADMIN_CHAT_ID:
+        return
+    
+    lag = LOOP_LAG.stats()
+    cache = ORDER_STORE.stats()
+    await update.message.reply_text(
+        "🩺 Состояние бота\n"
+        "━━━━━━━━━━━━━━━\n\n"
+        f"Задержка event loop: {lag['last_ms']:.1f} мс "
+        f"(средняя {lag['avg_ms']:.1f}, макс. {lag['max_ms']:.1f})\n"
+        f"Кэш заказов: {cache['hits']} попаданий, {cache['misses']} промахов, "
+        f"{cache['orders']} заказов\n"
+        f"Баллы: {len(LOYALTY_STORE.dirty_keys)} ожидают записи, {LOYALTY_STORE.flushes} сбросов на диск\n"
+        f"Рассылки в процессе: {len(BROADCASTS.active())}\n"
+        f"Уведомления админам в очереди: {ADMIN_OUTBOX.pending()}"
+    )
 
 def main():
     """Start the bot"""
@@ -1615,64 +1842,82 @@ def main():
     if not token:
         raise ValueError("Bot token not found. Create .env file and add BOT_TOKEN")
 
-    # Create and configure application
-    application = Application.builder().token(token).build()
+    # Create and configure application.
+    # Different users are served concurrently, one user's updates stay in order.
+    builder = Application.builder().token(token)
+    
+    # Alternative Bot API endpoint, e.g. the fake server in webhook_harness.py
+    api_url = os.getenv('TELEGRAM_API_URL')
+    if api_url:
+        builder = builder.base_url(f"{api_url}/bot").base_file_url(f"{api_url}/file/bot")
+    
+    application = (
+        builder
+        .concurrent_updates(PerUserUpdateProcessor(int(os.getenv('MAX_CONCURRENT_UPDATES', '64'))))
+        # Carts and conversation states survive restarts
+        .persistence(ShopPersistence(BOT_STATE_DB, update_interval=float(os.getenv('PERSISTENCE_INTERVAL', '5'))))
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+        .build()
+    )
     
     # Add new states for admin functions
     global ADMIN_BROADCAST, ADMIN_ADD_PRODUCT
     ADMIN_BROADCAST = 1000
     ADMIN_ADD_PRODUCT = 1001
     
+    # Every inline button goes through one router, keyed by the decoded action
+    callback_router = CallbackRouter({
+        "track": send_tracking_code,
+        **{action: handle_admin_callback for action in ADMIN_ACTIONS}
+    })
+    
     # Main conversation handler
     conv_handler = ConversationHandler(
         entry_points=[
             CommandHandler("start", start),
             CommandHandler("admin", admin_command),
-            CallbackQueryHandler(send_tracking_code, pattern="^track")
+            CommandHandler("search", search_command),
+            callback_router.handler()
         ],
         states={
             MAIN_MENU: [
-                MessageHandler(filters.Regex("^🛍 Каталог$"), handle_catalog),
-                MessageHandler(filters.Regex("^🎁 Бонусная программа$"), show_loyalty),
-                MessageHandler(filters.Regex("^📦 Мои заказы$"), show_my_orders),
-                MessageHandler(filters.Regex("^❓ FAQ$"), show_faq),
-                MessageHandler(filters.Regex("^🚚 Доставка$"), show_delivery),
-                MessageHandler(filters.Regex("^🔄 Перезапустить бота$"), restart_bot),
-                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_main_menu),
-                CallbackQueryHandler(send_tracking_code, pattern="^track"),
-                CallbackQueryHandler(handle_admin_callback, pattern="^admin_"),
+                TextRouter({
+                    "🛍 Каталог": handle_catalog,
+                    "🎁 Бонусная программа": show_loyalty,
+                    "📦 Мои заказы": show_my_orders,
+                    "❓ FAQ": show_faq,
+                    "🚚 Доставка": show_delivery,
+                    "🔄 Перезапустить бота": restart_bot
+                }, handle_main_menu).handler(),
+                callback_router.handler(),
                 CommandHandler("admin", admin_command)
             ],
             ADMIN_BROADCAST: [
-                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_admin_broadcast)
+                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_admin_broadcast),
+                callback_router.handler()
             ],
             ADMIN_ADD_PRODUCT: [
-                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_admin_add_product)
+                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_admin_add_product),
+                callback_router.handler()
             ],
             CATALOG: [
-                MessageHandler(filters.Regex("^◀️ В главное меню$"), start),
-                MessageHandler(filters.Regex("^◀️ Назад$"), handle_catalog),
-                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_catalog)
+                TextRouter({"◀️ В главное меню": start}, handle_catalog).handler()
             ],
             SELECTING_QUANTITY: [
-                MessageHandler(filters.Regex("^◀️ Назад$"), handle_catalog),
-                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_quantity)
+                TextRouter({"◀️ Назад": back_to_category_page}, handle_quantity).handler()
             ],
             USE_POINTS: [
-                MessageHandler(filters.Regex("^◀️ Назад$"), handle_quantity),
-                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_points_usage)
+                TextRouter({"◀️ Назад": handle_quantity}, handle_points_usage).handler()
             ],
             DELIVERY_METHOD: [
-                MessageHandler(filters.Regex("^◀️ Назад$"), handle_quantity),
-                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_delivery_method)
+                TextRouter({"◀️ Назад": handle_quantity}, handle_delivery_method).handler()
             ],
             ORDER_COMMENT: [
-                MessageHandler(filters.Regex("^◀️ Назад$"), handle_delivery_method),
-                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_order_comment)
+                TextRouter({"◀️ Назад": handle_delivery_method}, handle_order_comment).handler()
             ],
             ENTER_USER_DATA: [
-                MessageHandler(filters.Regex("^◀️ Назад$"), handle_delivery_method),
-                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_user_data)
+                TextRouter({"◀️ Назад": handle_delivery_method}, handle_user_data).handler()
             ],
             CONFIRM_ORDER: [
                 MessageHandler(filters.TEXT & ~filters.COMMAND, handle_order_confirmation)
@@ -1683,18 +1928,41 @@ def main():
         },
         fallbacks=[
             CommandHandler("start", start),
+            CommandHandler("search", search_command),
             MessageHandler(filters.Regex("^◀️ В главное меню$"), start)
         ],
-        name="main_conversation"
+        name="main_conversation",
+        persistent=True
     )
 
     # Add handlers
     application.add_handler(conv_handler)
+    application.add_handler(CommandHandler("health", health_command))
+    application.add_handler(CommandHandler("stats", stats_command))
+    application.add_handler(CommandHandler("export", export_command))
+    application.add_handler(CommandHandler("analytics", analytics_command))
+    application.add_handler(CommandHandler("reload_catalog", reload_catalog_command))
+    application.add_handler(InlineQueryHandler(handle_inline_search))
 
-    print("Bot is running!")
-    
-    # Run the bot
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    # Run the bot: webhook mode when WEBHOOK_URL is set, long polling otherwise
+    webhook_url = os.getenv('WEBHOOK_URL')
+    if webhook_url:
+        secret_token = os.getenv('WEBHOOK_SECRET')
+        if not secret_token:
+            raise ValueError("Webhook mode requires WEBHOOK_SECRET in .env")
+        
+        print(f"Bot is running (webhook: {webhook_url})!")
+        application.run_webhook(
+            listen=os.getenv('WEBHOOK_LISTEN', '0.0.0.0'),
+            port=int(os.getenv('WEBHOOK_PORT', '8443')),
+            url_path=os.getenv('WEBHOOK_PATH', 'telegram'),
+            webhook_url=webhook_url,
+            secret_token=secret_token,
+            allowed_updates=ALLOWED_UPDATES
+        )
+    else:
+        print("Bot is running!")
+        application.run_polling(allowed_updates=ALLOWED_UPDATES)
 
 if __name__ == '__main__':
     main() 
\ No newline at end of file
@@ -0,0 +1,331 @@
+import os
+import json
+import asyncio
+import logging
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Callable
+
+import telegram
+from telegram.error import RetryAfter, Forbidden, BadRequest, TimedOut, NetworkError, TelegramError
+
+
+class BroadcastLimiter:
+    """Token bucket for Telegram's global limit plus a per-chat minimum interval.
+
+    Telegram allows about 30 messages per second across all chats and about
+    one message per second into the same chat.  ``acquire()`` waits until
+    both allow one more message.  A ``RetryAfter`` from Telegram pauses the
+    whole bucket, since the flood limit applies to the bot, not to one worker.
+    """
+
+    def __init__(self, rate: float = 25, burst: int = 5, per_chat_interval: float = 1.0):
+        self.rate = rate
+        self.burst = burst
+        self.per_chat_interval = per_chat_interval
+        self.tokens = float(burst)
+        self._updated: Optional[float] = None
+        self._paused_until = 0.0
+        self._chat_next: Dict[int, float] = {}
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, chat_id: int):
+        loop = asyncio.get_running_loop()
+        wait = self._chat_next.get(chat_id, 0) - loop.time()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+        async with self._lock:
+            while True:
+                now = loop.time()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                if self._updated is not None:
+                    self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    break
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+        now = loop.time()
+        self._chat_next[chat_id] = now + self.per_chat_interval
+        if len(self._chat_next) > 10000:
+            self._chat_next = {chat: at for chat, at in self._chat_next.items() if at > now}
+
+    def pause(self, seconds: float):
+        loop = asyncio.get_running_loop()
+        self._paused_until = max(self._paused_until, loop.time() + seconds)
+
+
+class BroadcastManager:
+    """Runs admin mailings as background jobs that survive restarts.
+
+    A job is the text, the recipient list and its progress.  ``concurrency``
+    workers take recipients in order and send through the shared limiter.
+    The recipient list is written once, to ``<state_file>_<job_id>_recipients.json``;
+    progress is written to ``state_file`` every ``save_interval`` seconds
+    (atomic replace, skipped if nothing changed).  Delivery is at-least-once:
+    after a crash the few messages that were in flight may be sent again.
+    ``cursor`` is the index below which every recipient is finished, and
+    ``done_ahead`` lists the finished indexes above it.
+
+    If a worker fails with an unexpected error, the other workers are
+    cancelled and the job is kept with ``status`` "failed"; failed jobs are
+    not resumed on restart.
+
+    The admin sees one progress message that is edited at most every
+    ``progress_interval`` seconds.  ``on_blocked(chat_id)`` is called for
+    recipients who blocked the bot.
+    """
+
+    def __init__(self, state_file: str = 'broadcasts.json', concurrency: int = 8,
+                 rate: float = 25, max_retries: int = 3,
+                 save_interval: float = 2.0, progress_interval: float = 3.0,
+                 on_blocked: Optional[Callable[[int], None]] = None):
+        self.state_file = state_file
+        self.on_blocked = on_blocked
+        self.concurrency = concurrency
+        self.rate = rate
+        self.max_retries = max_retries
+        self.save_interval = save_interval
+        self.progress_interval = progress_interval
+        self.jobs: Dict[str, Dict[str, Any]] = self._load()
+        self.bot: Optional[telegram.Bot] = None
+        self.limiter: Optional[BroadcastLimiter] = None
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._save_task: Optional[asyncio.Task] = None
+        self._saved: Optional[str] = None
+
+    # State files
+    def _recipients_file(self, job_id: str) -> str:
+        return f"{os.path.splitext(self.state_file)[0]}_{job_id}_recipients.json"
+
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            with open(self.state_file, 'r', encoding='utf-8') as f:
+                jobs = json.load(f).get('jobs', {})
+        except FileNotFoundError:
+            return {}
+        except (json.JSONDecodeError, ValueError) as e:
+            logging.error(f"Cannot read {self.state_file}, broadcasts will not resume: {e}")
+            return {}
+        for job_id, job in list(jobs.items()):
+            recipients_file = self._recipients_file(job_id)
+            if 'recipients' in job:
+                # State files from before recipients were kept separately
+                self._write(recipients_file, json.dumps(job['recipients']))
+                continue
+            try:
+                with open(recipients_file, 'r', encoding='utf-8') as f:
+                    job['recipients'] = json.load(f)
+            except (OSError, ValueError) as e:
+                logging.error(f"Cannot read recipients of broadcast {job_id}, dropping it: {e}")
+                del jobs[job_id]
+        return jobs
+
+    @staticmethod
+    def _write(path: str, data: str):
+        tmp_file = f"{path}.tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, path)
+
+    async def save(self):
+        # Serialized on the loop, so the snapshot is consistent; written off it.
+        # Only progress is saved here, recipient lists are written once.
+        data = json.dumps({'jobs': {
+            job_id: {key: value for key, value in job.items() if key != 'recipients'}
+            for job_id, job in self.jobs.items()
+        }}, ensure_ascii=False, separators=(',', ':'))
+        if data == self._saved:
+            return
+        await asyncio.get_running_loop().run_in_executor(None, self._write, self.state_file, data)
+        self._saved = data
+
+    async def _save_periodically(self):
+        while True:
+            await asyncio.sleep(self.save_interval)
+            try:
+                await self.save()
+            except Exception as e:
+                logging.error(f"Error saving broadcast progress: {e}")
+
+    # Lifecycle
+    def start_background(self, bot: telegram.Bot):
+        """Attach the bot and resume unfinished jobs; call once the loop runs"""
+        self.bot = bot
+        self.limiter = BroadcastLimiter(rate=self.rate)
+        loop = asyncio.get_running_loop()
+        self._save_task = loop.create_task(self._save_periodically())
+        for job_id, job in self.jobs.items():
+            if job.get('status') == 'failed':
+                continue
+            logging.info(f"Resuming broadcast {job_id}: {job['cursor']}/{len(job['recipients'])}")
+            self._tasks[job_id] = loop.create_task(self._run(job_id))
+
+    async def stop(self):
+        for task in list(self._tasks.values()) + [self._save_task]:
+            if task is not None:
+                task.cancel()
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+        self._tasks.clear()
+        self._save_task = None
+        await self.save()
+
+    async def start(self, text: str, recipients: List[int], admin_chat_id) -> str:
+        """Create a job, post its progress message and start sending"""
+        job_id = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+        message = await self.bot.send_message(admin_chat_id, self._progress_text({
+            'recipients': recipients, 'sent': 0, 'failed': 0, 'blocked': 0, 'cursor': 0, 'done_ahead': []
+        }))
+        self.jobs[job_id] = {
+            'text': text,
+            'recipients': recipients,
+            'cursor': 0,
+            'done_ahead': [],
+            'sent': 0,
+            'failed': 0,
+            'blocked': 0,
+            'admin_chat_id': admin_chat_id,
+            'progress_message_id': message.message_id,
+            'created': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        }
+        await asyncio.get_running_loop().run_in_executor(
+            None, self._write, self._recipients_file(job_id), json.dumps(recipients)
+        )
+        await self.save()
+        self._tasks[job_id] = asyncio.get_running_loop().create_task(self._run(job_id))
+        return job_id
+
+    def active(self) -> List[str]:
+        return [job_id for job_id, job in self.jobs.items() if job.get('status') != 'failed']
+
+    # Sending
+    async def _send(self, chat_id: int, text: str) -> str:
+        """Deliver one message; returns 'sent', 'blocked' or 'failed'"""
+        for attempt in range(self.max_retries + 1):
+            await self.limiter.acquire(chat_id)
+            try:
+                await self.bot.send_message(chat_id=chat_id, text=text)
+                return 'sent'
+            except RetryAfter as e:
+                # Flood control: everyone waits, then this message is retried
+                logging.warning(f"Broadcast hit flood control, pausing {e.retry_after} s")
+                self.limiter.pause(e.retry_after)
+            except Forbidden:
+                return 'blocked'
+            except BadRequest as e:
+                logging.error(f"Failed to send broadcast to {chat_id}: {e}")
+                return 'failed'
+            except (TimedOut, NetworkError) as e:
+                logging.warning(f"Broadcast to {chat_id} failed (attempt {attempt + 1}): {e}")
+                await asyncio.sleep(2 ** attempt)
+            except TelegramError as e:
+                logging.error(f"Failed to send broadcast to {chat_id}: {e}")
+                return 'failed'
+        return 'failed'
+
+    async def _run(self, job_id: str):
+        job = self.jobs[job_id]
+        recipients = job['recipients']
+        done_ahead = set(job['done_ahead'])
+        next_index = job['cursor']
+
+        def finish(index: int, result: str):
+            job[result] += 1
+            done_ahead.add(index)
+            while job['cursor'] in done_ahead:
+                done_ahead.discard(job['cursor'])
+                job['cursor'] += 1
+            job['done_ahead'] = sorted(done_ahead)
+
+        async def worker():
+            nonlocal next_index
+            while True:
+                while next_index < len(recipients) and next_index in done_ahead:
+                    next_index += 1
+                if next_index >= len(recipients):
+                    return
+                index = next_index
+                next_index += 1
+                chat_id = int(recipients[index])
+                result = await self._send(chat_id, job['text'])
+                if result == 'blocked' and self.on_blocked is not None:
+                    self.on_blocked(chat_id)
+                finish(index, result)
+
+        loop = asyncio.get_running_loop()
+        progress = loop.create_task(self._report_progress(job))
+        workers = [loop.create_task(worker()) for _ in range(self.concurrency)]
+        try:
+            done, _ = await asyncio.wait(workers, return_when=asyncio.FIRST_EXCEPTION)
+        finally:
+            # On an error or on stop() none of the workers may outlive the job
+            progress.cancel()
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+        self._tasks.pop(job_id, None)
+        error = next((task.exception() for task in done if not task.cancelled() and task.exception()), None)
+        if error is not None:
+            logging.error(f"Broadcast {job_id} stopped at {job['cursor']}/{len(recipients)}",
+                          exc_info=error)
+            job['status'] = 'failed'
+            job['error'] = repr(error)
+            await self.save()
+            await self._edit_progress(job, final=True)
+            return
+
+        del self.jobs[job_id]
+        await self.save()
+        try:
+            os.remove(self._recipients_file(job_id))
+        except OSError as e:
+            logging.warning(f"Cannot remove recipients of broadcast {job_id}: {e}")
+        await self._edit_progress(job, final=True)
+        logging.info(f"Broadcast {job_id} finished: {job['sent']} sent, {job['failed']} failed, {job['blocked']} blocked")
+
+    # Progress in the admin chat
+    @staticmethod
+    def _progress_text(job: Dict[str, Any], final: bool = False) -> str:
+        total = len(job['recipients'])
+        done = job['cursor'] + len(job['done_ahead'])
+        if job.get('status') == 'failed':
+            header = f"⚠️ Рассылка остановлена из-за ошибки: {done}/{total}"
+        elif final:
+            header = "📢 Рассылка завершена"
+        else:
+            header = f"📢 Рассылка: {done}/{total}"
+        return (
+            f"{header}\n"
+            f"✅ Успешно отправлено: {job['sent']}\n"
+            f"❌ Ошибок отправки: {job['failed']}\n"
+            f"🚫 Заблокировали бота: {job['blocked']}\n"
+            f"👥 Всего пользователей: {total}"
+        )
+
+    async def _edit_progress(self, job: Dict[str, Any], final: bool = False):
+        try:
+            await self.bot.edit_message_text(
+                self._progress_text(job, final),
+                chat_id=job['admin_chat_id'],
+                message_id=job['progress_message_id']
+            )
+        except BadRequest as e:
+            # "Message is not modified" and deleted progress messages are harmless
+            logging.debug(f"Broadcast progress not updated: {e}")
+        except RetryAfter as e:
+            logging.warning(f"Broadcast progress edit rate limited: {e}")
+
+    async def _report_progress(self, job: Dict[str, Any]):
+        last = None
+        while True:
+            await asyncio.sleep(self.progress_interval)
+            current = (job['cursor'], len(job['done_ahead']))
+            if current != last:
+                last = current
+                await self._edit_progress(job)
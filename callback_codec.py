@@ -0,0 +1,78 @@
+import re
+from typing import NamedTuple, Optional
+
+VERSION = '1'
+MAX_BYTES = 64  # Telegram's limit for callback_data
+
+_ORDER_ID_RE = re.compile(r'ORDER_(\d{8})_(\d{6})_([1-9]\d*)')
+_DIGITS = '0123456789abcdefghijklmnopqrstuvwxyz'
+
+
+class CallbackData(NamedTuple):
+    """Decoded inline button payload.
+
+    ``user_id`` is only set for legacy ``track|<user_id>`` buttons that were
+    sent before buttons were bound to an order.
+    """
+    action: str
+    order_id: str = ''
+    page: int = 0
+    user_id: Optional[int] = None
+
+
+def _base36(number: int) -> str:
+    digits = []
+    while True:
+        number, digit = divmod(number, 36)
+        digits.append(_DIGITS[digit])
+        if not number:
+            return ''.join(reversed(digits))
+
+
+def pack_order_id(order_id: str) -> str:
+    """ORDER_<date>_<time>_<user id> -> two base36 numbers (about half the bytes)"""
+    if not order_id:
+        return ''
+    match = _ORDER_ID_RE.fullmatch(order_id)
+    if match:
+        date, time, user_id = match.groups()
+        return f"{_base36(int(date + time))}.{_base36(int(user_id))}"
+    return f"={order_id}"
+
+
+def unpack_order_id(packed: str) -> str:
+    if not packed:
+        return ''
+    if packed.startswith('='):
+        return packed[1:]
+    stamp, user_id = packed.split('.')
+    stamp = f"{int(stamp, 36):014d}"
+    return f"ORDER_{stamp[:8]}_{stamp[8:]}_{int(user_id, 36)}"
+
+
+def encode_callback(action: str, order_id: str = '', page: int = 0) -> str:
+    """``<version>:<action>:<page>:<order>``; zero page and empty order stay empty"""
+    if ':' in action:
+        raise ValueError(f"Action must not contain ':': {action!r}")
+    data = f"{VERSION}:{action}:{page or ''}:{pack_order_id(order_id)}"
+    if len(data.encode('utf-8')) > MAX_BYTES:
+        raise ValueError(f"callback_data longer than {MAX_BYTES} bytes: {data!r}")
+    return data
+
+
+def decode_callback(data: Optional[str]) -> Optional[CallbackData]:
+    """Decode current and legacy payloads; None if the data is not ours"""
+    if not data:
+        return None
+    try:
+        if data.startswith(f"{VERSION}:"):
+            _, action, page, packed = data.split(':', 3)
+            return CallbackData(action, unpack_order_id(packed), int(page or 0))
+        # Buttons sent by older versions of the bot
+        if data.startswith('track|'):
+            return CallbackData('track', user_id=int(data.split('|', 1)[1]))
+        if data.startswith('admin_'):
+            return CallbackData(data)
+    except ValueError:
+        pass
+    return None
@@ -0,0 +1,269 @@
+import os
+import json
+import asyncio
+import logging
+import threading
+from types import MappingProxyType
+from collections import OrderedDict
+from typing import Dict, Any, List, Mapping, Optional, Tuple
+
+from telegram import ReplyKeyboardMarkup, KeyboardButton
+
+from product_search import ProductSearch
+
+PAGE_SIZE = 8
+MESSAGE_LIMIT = 4096  # Telegram's limit for a text message
+PREV_PAGE = "⬅️ Пред."
+NEXT_PAGE = "След. ➡️"
+
+
+def format_product(product: Dict[str, Any]) -> str:
+    """Format product information"""
+    text = f"📱 {product['name']}\n💰 Цена: {product['price']} р."
+
+    if 'old_price' in product:
+        text += f" (было {product['old_price']} р.)"
+
+    if 'description' in product:
+        text += f"\n\n{product['description']}"
+    if 'bonus' in product:
+        text += f"\n{product['bonus']}"
+
+    return text
+
+
+class CatalogIndex:
+    """Category index with lazily rendered, cached catalog pages.
+
+    Built once per catalog change.  A category page is rendered from a slice
+    of ``PAGE_SIZE`` products the first time it is requested and cached for
+    the lifetime of this index (i.e. per catalog version), so rendering cost
+    stays flat however large the category grows.
+    """
+
+    def __init__(self, products: Dict[str, Dict[str, Any]], version: int = 1, page_size: int = PAGE_SIZE):
+        self.version = version
+        self.page_size = page_size
+        self.products: Mapping[str, Dict[str, Any]] = MappingProxyType(dict(products))
+        self.prices_by_name: Mapping[str, float] = MappingProxyType({
+            product['name']: product['price'] for product in products.values()
+        })
+        self.by_category: Dict[str, List[str]] = {}
+        for product_id, product in products.items():
+            self.by_category.setdefault(product['category'], []).append(product_id)
+        self.categories: List[str] = sorted(self.by_category)
+
+        self.catalog_keyboard = ReplyKeyboardMarkup(
+            [[KeyboardButton(f"📁 {category}")] for category in self.categories]
+            + [[KeyboardButton("◀️ В главное меню")]],
+            resize_keyboard=True
+        )
+
+        self._pages: Dict[Tuple[str, int], Tuple[str, ReplyKeyboardMarkup]] = {}
+        category_products: Dict[str, Mapping[str, str]] = {}
+        for category, product_ids in self.by_category.items():
+            category_products[category] = MappingProxyType({
+                products[product_id]['name']: product_id for product_id in product_ids
+            })
+        # Button text -> product id per category; read-only, shared by all sessions
+        self.category_products: Mapping[str, Mapping[str, str]] = MappingProxyType(category_products)
+
+    def has_category(self, category: str) -> bool:
+        return category in self.by_category
+
+    def page_count(self, category: str) -> int:
+        return max(1, -(-len(self.by_category.get(category, ())) // self.page_size))
+
+    def render_page(self, category: str, page: int) -> Tuple[str, ReplyKeyboardMarkup, int]:
+        """Message text and keyboard for one page; returns the clamped page too"""
+        pages = self.page_count(category)
+        page = min(max(page, 0), pages - 1)
+        cached = self._pages.get((category, page))
+        if cached is None:
+            start = page * self.page_size
+            items = [self.products[product_id] for product_id in self.by_category[category][start:start + self.page_size]]
+
+            text = f"📁 Категория: {category}"
+            if pages > 1:
+                text += f" (стр. {page + 1}/{pages})"
+            text += "\n\n" + "\n\n".join(format_product(product) for product in items)
+            if len(text) > MESSAGE_LIMIT:
+                text = text[:MESSAGE_LIMIT - 1] + "…"
+
+            keyboard = [[KeyboardButton(product['name'])] for product in items]
+            navigation = []
+            if page > 0:
+                navigation.append(KeyboardButton(PREV_PAGE))
+            if page < pages - 1:
+                navigation.append(KeyboardButton(NEXT_PAGE))
+            if navigation:
+                keyboard.append(navigation)
+            keyboard.extend([[KeyboardButton("◀️ Назад")], [KeyboardButton("◀️ В главное меню")]])
+
+            cached = self._pages[(category, page)] = (text, ReplyKeyboardMarkup(keyboard, resize_keyboard=True))
+        return cached[0], cached[1], page
+
+
+class ProductResolver:
+    """Shared button text -> product id resolver across catalog versions.
+
+    Sessions only remember the catalog version and category they were shown;
+    a keyboard rendered from an older version still resolves through that
+    version's (immutable) name map, as long as it is among the last
+    ``keep_versions`` catalogs.
+    """
+
+    def __init__(self, keep_versions: int = 5):
+        self.keep_versions = keep_versions
+        self._versions: "OrderedDict[int, Mapping[str, Mapping[str, str]]]" = OrderedDict()
+        self.current_version: Optional[int] = None
+
+    def register(self, index: CatalogIndex):
+        self._versions[index.version] = index.category_products
+        self._versions.move_to_end(index.version)
+        self.current_version = index.version
+        while len(self._versions) > self.keep_versions:
+            self._versions.popitem(last=False)
+
+    def resolve(self, version: Optional[int], category: Optional[str], name: str) -> Optional[str]:
+        """Product id for a button, or None if it is not a product button"""
+        names = self._versions.get(version)
+        if names is None:
+            # Unknown or expired version: fall back to the current catalog
+            names = self._versions.get(self.current_version, {})
+        return names.get(category, {}).get(name)
+
+
+def load_catalog_file(path: str) -> Tuple[int, Dict[str, Dict[str, Any]]]:
+    """Read ``{"version": ..., "products": {...}}`` from the catalog file"""
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    return data.get('version', 1), data['products']
+
+
+def save_catalog_file(path: str, products: Mapping[str, Dict[str, Any]], version: int):
+    tmp_file = f"{path}.tmp"
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump({'version': version, 'products': dict(products)}, f, ensure_ascii=False, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, path)
+
+
+class CatalogManager:
+    """Owns the live CatalogIndex for a catalog file.
+
+    A reload builds the new catalog and all its indexes off to the side
+    (``build()``, safe to run on a worker thread) and then swaps a single
+    reference (``swap()``).  Readers take ``current`` once per request and
+    therefore always see one complete catalog, never a half-built one.
+    Writers (``reload()`` and ``add_product()``) hold ``_write_lock`` from
+    build to swap, so one never swaps out a catalog the other just made live.
+
+    ``search`` is the product search index; every swap applies only the
+    products that changed to it.
+    """
+
+    def __init__(self, path: str = 'catalog.json', resolver: Optional[ProductResolver] = None):
+        self.path = path
+        self.resolver = resolver or ProductResolver()
+        self._write_lock = threading.Lock()
+        self._signature = self._file_signature()
+        version, products = load_catalog_file(path)
+        self.current = CatalogIndex(products, version)
+        self.resolver.register(self.current)
+        self.search = ProductSearch()
+        self.search.sync(self.current.products, version)
+
+    def _file_signature(self) -> Optional[tuple]:
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def changed_on_disk(self) -> bool:
+        return self._file_signature() != self._signature
+
+    def build(self) -> Optional[CatalogIndex]:
+        """Load the file and build a new index; None if nothing changed.
+
+        Use ``reload()`` to build and swap under the write lock.
+        """
+        signature = self._file_signature()
+        version, products = load_catalog_file(self.path)
+        self._signature = signature
+        current = self.current
+        if products == dict(current.products):
+            return None
+        # Hand edits may forget to bump the version; keys must stay unique
+        return CatalogIndex(products, max(version, current.version + 1))
+
+    def swap(self, index: Optional[CatalogIndex]) -> bool:
+        if index is None:
+            return False
+        self.resolver.register(index)
+        self.current = index
+        self.search.sync(index.products, index.version)
+        logging.info(f"Catalog version {index.version} is live ({len(index.products)} products)")
+        return True
+
+    def reload(self) -> Optional[CatalogIndex]:
+        """Build and swap in the file's catalog; the new index, or None if unchanged"""
+        with self._write_lock:
+            index = self.build()
+            return index if self.swap(index) else None
+
+    def add_product(self, product_id: str, product: Dict[str, Any]) -> CatalogIndex:
+        """Persist a new product and swap in the rebuilt catalog"""
+        with self._write_lock:
+            current = self.current
+            products = dict(current.products)
+            products[product_id] = product
+            index = CatalogIndex(products, current.version + 1)
+            save_catalog_file(self.path, index.products, index.version)
+            self._signature = self._file_signature()
+            self.swap(index)
+            return index
+
+
+class CatalogWatcher:
+    """Polls the catalog file and hot-reloads it without blocking the loop"""
+
+    def __init__(self, manager: CatalogManager, interval: float = 5.0):
+        self.manager = manager
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                if self.manager.changed_on_disk():
+                    # Off the loop: the search index catches up inside swap
+                    await loop.run_in_executor(None, self.manager.reload)
+            except Exception as e:
+                logging.error(f"Catalog reload failed, keeping version {self.manager.current.version}: {e}")
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+_CATALOGS: Dict[str, CatalogManager] = {}
+_CATALOGS_LOCK = threading.Lock()
+
+
+def get_catalog(path: str = 'catalog.json') -> CatalogManager:
+    """Shared manager per catalog file, so bot.py and OrderSystem agree on prices"""
+    key = os.path.abspath(path)
+    with _CATALOGS_LOCK:
+        if key not in _CATALOGS:
+            _CATALOGS[key] = CatalogManager(path)
+        return _CATALOGS[key]
@@ -0,0 +1 @@
+# The modules live in the repository root; this file puts it on sys.path for tests/
@@ -0,0 +1,381 @@
+import os
+import sys
+import json
+import logging
+import threading
+from datetime import datetime
+from typing import Dict, Any, Optional, Iterator, List, Tuple
+
+from write_behind import WriteBehindFile
+
+DEFAULT_RECORD = {"points": 0, "total_spent": 0, "orders": 0}
+
+# Event types: "opening" carries balances imported from a pre-ledger loyalty.json
+ACCRUAL = 'accrual'
+REDEMPTION = 'redemption'
+OPENING = 'opening'
+
+
+def apply_event(balances: Dict[str, Dict[str, Any]], event: Dict[str, Any]):
+    """Fold one event into a balances dict"""
+    record = balances.get(event['user_id'])
+    if record is None:
+        record = balances[event['user_id']] = dict(DEFAULT_RECORD)
+    if event['type'] == REDEMPTION:
+        record["points"] -= event['points']
+    else:
+        record["points"] += event['points']
+        record["total_spent"] += event.get('spent', 0)
+        record["orders"] += event.get('orders', 0)
+
+
+class LoyaltyEventLog:
+    """Append-only log of immutable loyalty events, one JSON record per line.
+
+    Appends are buffered and written in one batch by ``flush()``, which the
+    ledger's write-behind store calls before it rewrites loyalty.json, so the
+    log on disk is never behind the balances file.  ``size`` is the number of
+    bytes on disk; snapshots store it so startup reads only the tail after
+    them.  ``seq`` is restored by the ledger from that snapshot and tail.
+
+    A ``read_only`` log (another process reading the live file) never
+    truncates a torn tail: it may just be an append still in progress.
+    """
+
+    def __init__(self, path: str, fsync: bool = True, read_only: bool = False):
+        self.path = path
+        self.fsync = fsync
+        self.read_only = read_only
+        self.seq = 0
+        self.size = os.path.getsize(path) if os.path.exists(path) else 0
+        self._pending: List[str] = []
+        self._lock = threading.Lock()
+
+    def replay(self, after_seq: int = 0, upto_seq: Optional[int] = None,
+               offset: int = 0) -> Iterator[Dict[str, Any]]:
+        """Sequential scan of the events on disk, starting ``offset`` bytes in"""
+        if not os.path.exists(self.path):
+            return
+        good_offset = offset
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            for raw in f:
+                if not raw.endswith(b'\n'):
+                    # Torn final line from a crash mid-append
+                    break
+                try:
+                    event = json.loads(raw)
+                except ValueError:
+                    logging.error(f"Skipping corrupt loyalty event in {self.path} at offset {good_offset}")
+                    good_offset += len(raw)
+                    continue
+                good_offset += len(raw)
+                if event['seq'] <= after_seq:
+                    continue
+                if upto_seq is not None and event['seq'] > upto_seq:
+                    return
+                yield event
+            size = f.seek(0, os.SEEK_END)
+        if size > good_offset and not self.read_only:
+            logging.warning(f"Truncating torn tail of {self.path}: {size - good_offset} bytes")
+            with open(self.path, 'r+b') as f:
+                f.truncate(good_offset)
+            self.size = good_offset
+
+    def append(self, user_id: str, event_type: str, points: int, **fields) -> Dict[str, Any]:
+        with self._lock:
+            self.seq += 1
+            event = {
+                'seq': self.seq,
+                'ts': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                'user_id': user_id,
+                'type': event_type,
+                'points': points
+            }
+            event.update(fields)
+            self._pending.append(json.dumps(event, ensure_ascii=False, separators=(',', ':')) + '\n')
+            return event
+
+    def flush(self):
+        with self._lock:
+            if not self._pending:
+                return
+            with open(self.path, 'ab') as f:
+                f.write(''.join(self._pending).encode('utf-8'))
+                if self.fsync:
+                    f.flush()
+                    os.fsync(f.fileno())
+                self.size = f.tell()
+            self._pending = []
+
+
+def read_snapshot(snapshot_file: Optional[str]) -> Dict[str, Any]:
+    """``{"seq", "offset", "balances"}``; an empty snapshot if there is none"""
+    try:
+        with open(snapshot_file, 'r', encoding='utf-8') as f:
+            snapshot = json.load(f)
+    except (FileNotFoundError, TypeError):
+        snapshot = {"seq": 0, "balances": {}}
+    snapshot.setdefault("offset", 0)  # snapshots written before offsets were kept
+    return snapshot
+
+
+class LoyaltyLedger:
+    """Per-user loyalty balances with atomic increment/decrement operations.
+
+    Every operation reads and changes a single user's record under one lock
+    and marks only that user dirty, so concurrent orders from different users
+    can no longer overwrite each other with stale copies of the whole file.
+
+    With an event log attached every accrual and redemption is also recorded
+    as an immutable event.  Balances stay in memory (O(1) reads); every
+    ``snapshot_every`` events a ``{"seq", "balances"}`` snapshot is written so
+    startup only replays the events after it.
+    """
+
+    def __init__(self, store: WriteBehindFile, events: Optional[LoyaltyEventLog] = None,
+                 snapshot_file: Optional[str] = None, snapshot_every: int = 1000):
+        self.store = store
+        self.events = events
+        self.snapshot_file = snapshot_file
+        self.snapshot_every = snapshot_every
+        self._events_since_snapshot = 0
+        self._pending_snapshot: Optional[Tuple[int, int, Dict[str, Dict[str, Any]]]] = None
+        self._snapshot_lock = threading.Lock()
+        if events is not None:
+            store.before_write = self._persist_events
+            self._rebuild()
+
+    def _rebuild(self):
+        """Snapshot + event tail is the source of truth; loyalty.json is a view.
+
+        Only the events after the snapshot's offset are read.
+        """
+        snapshot = read_snapshot(self.snapshot_file)
+        offset = snapshot["offset"]
+        if offset > self.events.size:
+            logging.warning(f"{self.events.path} is shorter than its snapshot says, replaying it all")
+            offset = 0
+        with self.store.lock:
+            balances = snapshot["balances"]
+            replayed = 0
+            self.events.seq = snapshot["seq"]
+            for event in self.events.replay(after_seq=snapshot["seq"], offset=offset):
+                apply_event(balances, event)
+                self.events.seq = event['seq']
+                replayed += 1
+
+            if self.events.seq == 0:
+                # First start on a pre-ledger loyalty.json: record opening balances
+                for user_id, record in self.store.data.items():
+                    self.events.append(
+                        user_id, OPENING, record.get("points", 0),
+                        spent=record.get("total_spent", 0), orders=record.get("orders", 0)
+                    )
+                    self._events_since_snapshot += 1
+                if self._events_since_snapshot:
+                    self._take_snapshot()
+                    self.store.mark_dirty()
+                return
+
+            self._events_since_snapshot = replayed
+            if balances != self.store.data:
+                logging.warning(f"{self.store.path} is behind the loyalty event log, restoring it")
+                self.store.data.clear()
+                self.store.data.update(balances)
+                self.store.mark_dirty()
+
+    def _record_event(self, user_id: str, event_type: str, points: int, **fields):
+        if self.events is None:
+            return
+        self.events.append(user_id, event_type, points, **fields)
+        self._events_since_snapshot += 1
+        if self._events_since_snapshot >= self.snapshot_every:
+            self._take_snapshot()
+
+    def _take_snapshot(self):
+        # Called under the store lock, so balances and seq match exactly.
+        # Only the records are copied here; the flusher thread serializes and
+        # writes them with the next flush, after the events they cover.  The
+        # log's current size is a safe replay offset: everything on disk is
+        # already covered, and replay skips seq <= the snapshot's anyway.
+        balances = {user_id: dict(record) for user_id, record in self.store.data.items()}
+        with self._snapshot_lock:
+            self._pending_snapshot = (self.events.seq, self.events.size, balances)
+        self._events_since_snapshot = 0
+
+    def _persist_events(self):
+        self.events.flush()
+        with self._snapshot_lock:
+            snapshot, self._pending_snapshot = self._pending_snapshot, None
+        if snapshot is not None and self.snapshot_file:
+            seq, offset, balances = snapshot
+            data = json.dumps({"seq": seq, "offset": offset, "balances": balances},
+                              ensure_ascii=False, separators=(',', ':'))
+            tmp_file = f"{self.snapshot_file}.tmp"
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_file, self.snapshot_file)
+
+    def _record(self, user_id: str) -> Dict[str, Any]:
+        record = self.store.data.get(user_id)
+        if record is None:
+            record = self.store.data[user_id] = dict(DEFAULT_RECORD)
+        return record
+
+    def get(self, user_id: str) -> Dict[str, Any]:
+        """Copy of the user's record with defaults filled in"""
+        with self.store.lock:
+            record = dict(DEFAULT_RECORD)
+            record.update(self.store.data.get(user_id, {}))
+            return record
+
+    def credit(self, user_id: str, points: int, spent: float = 0, orders: int = 0) -> Dict[str, Any]:
+        """Atomically add points (and purchase totals); returns the new record"""
+        with self.store.lock:
+            record = self._record(user_id)
+            record["points"] = record.get("points", 0) + points
+            record["total_spent"] = record.get("total_spent", 0) + spent
+            record["orders"] = record.get("orders", 0) + orders
+            self._record_event(user_id, ACCRUAL, points, spent=spent, orders=orders)
+            self.store.mark_dirty(user_id)
+            return dict(record)
+
+    def debit_if_sufficient(self, user_id: str, points: int) -> Optional[Dict[str, Any]]:
+        """Atomically take points if the balance covers them.
+
+        Returns the new record, or None when the user is unknown or the
+        balance is too low (nothing is changed in that case).
+        """
+        with self.store.lock:
+            record = self.store.data.get(user_id)
+            if record is None or record.get("points", 0) < points:
+                return None
+            record["points"] -= points
+            self._record_event(user_id, REDEMPTION, points)
+            self.store.mark_dirty(user_id)
+            return dict(record)
+
+    def history(self, user_id: str) -> List[Dict[str, Any]]:
+        """All events of one user, oldest first (for disputes)"""
+        if self.events is None:
+            return []
+        self.store.flush()
+        return [event for event in self.events.replay() if event['user_id'] == user_id]
+
+    def verify(self) -> Dict[str, Dict[str, Any]]:
+        """Replay the whole event log and diff it against the snapshot and
+        the current balances.  Returns {section: {user_id: (replayed, stored)}}.
+        """
+        self.store.flush()
+        with self.store.lock:
+            current = {user_id: dict(record) for user_id, record in self.store.data.items()}
+        return _verify(self.events, read_snapshot(self.snapshot_file), current)
+
+    def flush(self):
+        self.store.flush()
+
+    def close(self):
+        self.store.close()
+
+
+def _diff_balances(expected: Dict[str, Dict[str, Any]], actual: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    diffs = {}
+    for user_id in expected.keys() | actual.keys():
+        left = expected.get(user_id, DEFAULT_RECORD)
+        right = actual.get(user_id, DEFAULT_RECORD)
+        if any(abs(left.get(key, 0) - right.get(key, 0)) > 1e-6 for key in DEFAULT_RECORD):
+            diffs[user_id] = (dict(left), dict(right))
+    return diffs
+
+
+def _verify(events: LoyaltyEventLog, snapshot: Dict[str, Any],
+            current: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """Replay ``events`` into a fresh dict and diff it against ``snapshot`` and ``current``"""
+    replayed: Dict[str, Dict[str, Any]] = {}
+    diffs = {"snapshot": None, "current": {}}
+    for event in events.replay():
+        if diffs["snapshot"] is None and event['seq'] > snapshot["seq"]:
+            diffs["snapshot"] = _diff_balances(replayed, snapshot["balances"])
+        apply_event(replayed, event)
+    if diffs["snapshot"] is None:
+        diffs["snapshot"] = _diff_balances(replayed, snapshot["balances"])
+    diffs["current"] = _diff_balances(replayed, current)
+    return diffs
+
+
+def _ledger_files(loyalty_file: str) -> Tuple[str, str]:
+    """(event log, snapshot) paths next to a loyalty file"""
+    base = os.path.splitext(loyalty_file)[0]
+    return f"{base}_events.jsonl", f"{base}_snapshot.json"
+
+
+def verify_files(loyalty_file: str = 'loyalty.json') -> Dict[str, Dict[str, Any]]:
+    """Read-only ``verify()`` of a ledger's files, safe while the bot runs.
+
+    Nothing is repaired or rewritten.  Events the bot has not flushed yet
+    show up as "current" differences until its next flush.
+    """
+    events_file, snapshot_file = _ledger_files(loyalty_file)
+    try:
+        with open(loyalty_file, 'r', encoding='utf-8') as f:
+            current = json.load(f)
+    except FileNotFoundError:
+        current = {}
+    return _verify(LoyaltyEventLog(events_file, read_only=True), read_snapshot(snapshot_file), current)
+
+
+_LEDGERS: Dict[str, LoyaltyLedger] = {}
+_LEDGER_OPTIONS: Dict[str, Dict[str, Any]] = {}
+_LEDGERS_LOCK = threading.Lock()
+
+
+def get_ledger(loyalty_file: str = 'loyalty.json', snapshot_every: int = 1000, **store_options) -> LoyaltyLedger:
+    """Shared ledger per file, so bot.py and LoyaltySystem never hold two
+    diverging in-memory copies of the same loyalty.json.
+
+    Events go to ``<name>_events.jsonl`` and snapshots to ``<name>_snapshot.json``
+    next to the loyalty file.  The first caller's options win: later calls
+    with different ones get the existing ledger and a warning.
+    """
+    key = os.path.abspath(loyalty_file)
+    options = dict(store_options, snapshot_every=snapshot_every)
+    with _LEDGERS_LOCK:
+        if key in _LEDGERS:
+            if options != _LEDGER_OPTIONS[key]:
+                logging.warning(
+                    f"Loyalty ledger for {loyalty_file} is already open with {_LEDGER_OPTIONS[key]}, "
+                    f"ignoring {options}"
+                )
+        else:
+            events_file, snapshot_file = _ledger_files(loyalty_file)
+            _LEDGERS[key] = LoyaltyLedger(
+                WriteBehindFile(loyalty_file, **store_options),
+                events=LoyaltyEventLog(events_file),
+                snapshot_file=snapshot_file,
+                snapshot_every=snapshot_every
+            )
+            _LEDGER_OPTIONS[key] = options
+        return _LEDGERS[key]
+
+
+# Example usage (both only read the files):
+#   python loyalty_ledger.py verify [loyalty.json]
+#   python loyalty_ledger.py history <user_id> [loyalty.json]
+if __name__ == "__main__":
+    if len(sys.argv) >= 2 and sys.argv[1] == 'verify':
+        diffs = verify_files(sys.argv[2] if len(sys.argv) > 2 else 'loyalty.json')
+        for section, section_diffs in diffs.items():
+            print(f"{section}: {len(section_diffs)} mismatched users")
+            for user_id, (replayed, stored) in sorted(section_diffs.items()):
+                print(f"  {user_id}: replayed={replayed} stored={stored}")
+        sys.exit(1 if any(diffs.values()) else 0)
+    elif len(sys.argv) >= 3 and sys.argv[1] == 'history':
+        events_file, _ = _ledger_files(sys.argv[3] if len(sys.argv) > 3 else 'loyalty.json')
+        for event in LoyaltyEventLog(events_file, read_only=True).replay():
+            if event['user_id'] == sys.argv[2]:
+                print(json.dumps(event, ensure_ascii=False))
+    else:
+        print("Usage: python loyalty_ledger.py verify [loyalty_file] | history <user_id> [loyalty_file]")
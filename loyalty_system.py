@@ -1,22 +1,33 @@
-import json
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 from decimal import Decimal
+from loyalty_ledger import get_ledger
 
 class LoyaltySystem:
-    def __init__(self, loyalty_file: str = 'loyalty.json'):
+    def __init__(self, loyalty_file: str = 'loyalty.json', write_behind: bool = False,
+                 flush_interval_ms: int = 1000, max_pending: int = 100):
+        """With write_behind=True changes are flushed in batches every
+        flush_interval_ms (the maximum data-loss window) or after max_pending
+        changes; call close() on shutdown for a durable final flush."""
         self.loyalty_file = loyalty_file
+        # Shared with bot.py when both point at the same file
+        self.ledger = get_ledger(
+            loyalty_file,
+            write_behind=write_behind,
+            flush_interval_ms=flush_interval_ms,
+            max_pending=max_pending
+        )
         self.loyalty_data = self._load_loyalty_data()
 
     def _load_loyalty_data(self) -> Dict[str, Dict[str, float]]:
-        try:
-            with open(self.loyalty_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except FileNotFoundError:
-            return {}
+        return self.ledger.store.data
 
-    def _save_loyalty_data(self):
-        with open(self.loyalty_file, 'w', encoding='utf-8') as f:
-            json.dump(self.loyalty_data, f, indent=2)
+    def flush(self):
+        """Write pending loyalty changes to disk now."""
+        self.ledger.flush()
+
+    def close(self):
+        """Flush pending changes and stop the background flusher."""
+        self.ledger.close()
 
     def calculate_points_for_order(self, order_amount: float) -> int:
         """Calculate loyalty points for an order based on the amount spent."""
@@ -26,51 +37,29 @@ class LoyaltySystem:
 
     def update_user_loyalty(self, user_id: str, order_amount: float) -> Dict[str, Any]:
         """Update user's loyalty points and total spent amount."""
-        if user_id not in self.loyalty_data:
-            self.loyalty_data[user_id] = {
-                "points": 0,
-                "total_spent": 0
-            }
-
         points_earned = self.calculate_points_for_order(order_amount)
-        self.loyalty_data[user_id]["points"] += points_earned
-        self.loyalty_data[user_id]["total_spent"] += order_amount
-        
-        self._save_loyalty_data()
+        record = self.ledger.credit(user_id, points_earned, spent=order_amount)
         
         return {
             "user_id": user_id,
             "points_earned": points_earned,
-            "total_points": self.loyalty_data[user_id]["points"],
-            "total_spent": self.loyalty_data[user_id]["total_spent"]
+            "total_points": record["points"],
+            "total_spent": record["total_spent"]
         }
 
     def get_user_loyalty(self, user_id: str) -> Dict[str, Any]:
         """Get user's current loyalty status."""
-        if user_id not in self.loyalty_data:
-            return {
-                "user_id": user_id,
-                "points": 0,
-                "total_spent": 0
-            }
+        record = self.ledger.get(user_id)
         
         return {
             "user_id": user_id,
-            "points": self.loyalty_data[user_id]["points"],
-            "total_spent": self.loyalty_data[user_id]["total_spent"]
+            "points": record["points"],
+            "total_spent": record["total_spent"]
         }
 
     def use_points(self, user_id: str, points_to_use: int) -> bool:
         """Use loyalty points for a discount. Returns True if successful."""
-        if user_id not in self.loyalty_data:
-            return False
-            
-        if self.loyalty_data[user_id]["points"] < points_to_use:
-            return False
-            
-        self.loyalty_data[user_id]["points"] -= points_to_use
-        self._save_loyalty_data()
-        return True
+        return self.ledger.debit_if_sufficient(user_id, points_to_use) is not None
 
 # Example usage:
 if __name__ == "__main__":
@@ -0,0 +1,155 @@
+import os
+import json
+import time
+import asyncio
+import logging
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+
+import telegram
+from telegram import InlineKeyboardMarkup
+from telegram.error import RetryAfter, BadRequest, TelegramError
+
+
+class NotificationOutbox:
+    """Durable queue of bot messages that must reach a chat eventually.
+
+    ``enqueue()`` writes the message to ``state_file`` (atomic replace) before
+    returning, and a background task delivers it.  Failed sends are retried
+    with exponential backoff (``base_delay`` doubling up to ``max_delay``);
+    ``RetryAfter`` waits exactly as long as Telegram asks.  Messages left in
+    the file after a crash or restart are sent on the next start.  A message
+    Telegram rejects as malformed (``BadRequest``) is never retried and is
+    kept under ``dead`` in the file, so nothing disappears silently.
+
+    Delivery is at-least-once: a crash right after a send may repeat it.
+    """
+
+    def __init__(self, state_file: str = 'notifications.json',
+                 base_delay: float = 2.0, max_delay: float = 300.0):
+        self.state_file = state_file
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        state = self._load()
+        self.messages: List[Dict[str, Any]] = state.get('messages', [])
+        self.dead: List[Dict[str, Any]] = state.get('dead', [])
+        self.bot: Optional[telegram.Bot] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._save_lock: Optional[asyncio.Lock] = None
+
+    # State file
+    def _load(self) -> Dict[str, Any]:
+        try:
+            with open(self.state_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (json.JSONDecodeError, ValueError) as e:
+            logging.error(f"Cannot read {self.state_file}, pending notifications are lost: {e}")
+            return {}
+
+    def _write(self, data: str):
+        tmp_file = f"{self.state_file}.tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.state_file)
+
+    async def save(self):
+        # Snapshot on the loop, write off it; the lock keeps writes in order
+        async with self._save_lock:
+            data = json.dumps({'messages': self.messages, 'dead': self.dead},
+                              ensure_ascii=False, separators=(',', ':'))
+            await asyncio.get_running_loop().run_in_executor(None, self._write, data)
+
+    # Lifecycle
+    def start_background(self, bot: telegram.Bot):
+        """Attach the bot and start delivering; call once the loop runs"""
+        self.bot = bot
+        self._wakeup = asyncio.Event()
+        self._save_lock = asyncio.Lock()
+        if self.messages:
+            logging.info(f"Resuming {len(self.messages)} pending notifications")
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def enqueue(self, chat_id, text: str, reply_markup: Optional[InlineKeyboardMarkup] = None):
+        """Persist a message for delivery; returns once it is on disk"""
+        self.messages.append({
+            'id': datetime.now().strftime("%Y%m%d_%H%M%S_%f"),
+            'chat_id': chat_id,
+            'text': text,
+            'reply_markup': reply_markup.to_dict() if reply_markup else None,
+            'attempts': 0,
+            'next_attempt': 0,
+            'error': None
+        })
+        await self.save()
+        self._wakeup.set()
+
+    def pending(self) -> int:
+        return len(self.messages)
+
+    # Delivery
+    async def _send(self, message: Dict[str, Any]) -> bool:
+        """One delivery attempt; True when the message is done with"""
+        markup = message['reply_markup']
+        try:
+            await self.bot.send_message(
+                chat_id=message['chat_id'],
+                text=message['text'],
+                reply_markup=InlineKeyboardMarkup.de_json(markup, self.bot) if markup else None
+            )
+            return True
+        except RetryAfter as e:
+            delay = e.retry_after
+            message['error'] = str(e)
+        except BadRequest as e:
+            logging.error(f"Notification {message['id']} rejected by Telegram, not retrying: {e}")
+            message['error'] = str(e)
+            self.dead.append(message)
+            return True
+        except TelegramError as e:
+            # Network trouble, timeouts, bot kicked from the chat: try again later
+            delay = min(self.max_delay, self.base_delay * 2 ** message['attempts'])
+            message['error'] = str(e)
+        message['attempts'] += 1
+        message['next_attempt'] = time.time() + delay
+        logging.warning(f"Notification {message['id']} failed (attempt {message['attempts']}), "
+                        f"retrying in {delay:.1f} s: {message['error']}")
+        return False
+
+    async def _run(self):
+        while True:
+            now = time.time()
+            due = [message for message in self.messages if message['next_attempt'] <= now]
+            if not due:
+                self._wakeup.clear()
+                timeout = min(message['next_attempt'] for message in self.messages) - now if self.messages else None
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            for message in due:
+                try:
+                    done = await self._send(message)
+                except Exception as e:
+                    logging.error(f"Error delivering notification {message['id']}: {e}")
+                    message['attempts'] += 1
+                    message['next_attempt'] = time.time() + self.max_delay
+                    done = False
+                if done:
+                    self.messages.remove(message)
+                try:
+                    await self.save()
+                except Exception as e:
+                    logging.error(f"Error saving notification outbox: {e}")
@@ -0,0 +1,318 @@
+import sys
+import time
+import random
+import threading
+from datetime import date, datetime, time as dt_time, timedelta
+from typing import Dict, Any, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from order_record import Order
+
+TOP_PRODUCTS = 10   # products listed in the text report
+REPORT_WEEKS = 8    # weekly series rows in the text report
+REPORT_DAYS = 7     # daily series rows in the text report
+REPORT_COHORTS = 6  # cohort rows in the text report
+
+# Column -> (dtype, value of an order); the CODED columns store codes into
+# ``labels`` instead of the strings
+COLUMNS = {
+    'created_at': (np.int64, lambda order: order.created_at),
+    'user': (np.int32, lambda order: order.user_id or ''),
+    'product': (np.int32, lambda order: order.product_name or order.product_id or '—'),
+    'quantity': (np.int32, lambda order: order.quantity or 0),
+    'price': (np.float64, lambda order: order.final_price or 0),
+    'delivery': (np.int32, lambda order: order.delivery_method or ''),
+    'points': (np.float64, lambda order: order.points_used or 0)
+}
+CODED = ('user', 'product', 'delivery')
+
+
+def _local_midnight(day: date) -> int:
+    """Timestamp of the local midnight that starts ``day``"""
+    return int(datetime.combine(day, dt_time.min).timestamp())
+
+
+def _add_month(month: date) -> date:
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+class SalesAnalytics:
+    """Columnar copy of the order history for sales reports.
+
+    Every order is one row of NumPy columns (time, buyer, product, quantity,
+    ``final_price``, delivery method, points used); strings are stored as
+    codes into ``labels``.  The order store calls ``put()`` on every write,
+    which overwrites the order's row or appends one (capacity doubles), and
+    ``load()`` on reload.  ``report()`` answers a date window with masked
+    ``bincount`` passes instead of Python loops over orders.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clear()
+
+    # Updates
+    def clear(self, capacity: int = 1024):
+        with self._lock:
+            self.size = 0
+            self._rows: Dict[str, int] = {}
+            self._codes: Dict[str, Dict[str, int]] = {name: {} for name in CODED}
+            self.labels: Dict[str, List[str]] = {name: [] for name in CODED}
+            self._data = {name: np.zeros(capacity, dtype) for name, (dtype, _) in COLUMNS.items()}
+
+    def _code(self, column: str, label: str) -> int:
+        codes = self._codes[column]
+        code = codes.get(label)
+        if code is None:
+            code = codes[label] = len(codes)
+            self.labels[column].append(label)
+        return code
+
+    def load(self, orders: Iterable[Tuple[str, Order]]):
+        """Replace the contents with ``orders``.
+
+        The columns are built one at a time outside the lock and swapped in
+        together, so reports see either the old or the new history.
+        """
+        orders = list(orders)
+        count = len(orders)
+        rows = {order_id: row for row, (order_id, _) in enumerate(orders)}
+        codes: Dict[str, Dict[str, int]] = {}
+        labels: Dict[str, List[str]] = {}
+        data = {}
+        for name, (dtype, value) in COLUMNS.items():
+            values = [value(order) for _, order in orders]
+            if name in CODED:
+                labels[name] = list(dict.fromkeys(values))
+                codes[name] = {label: code for code, label in enumerate(labels[name])}
+                values = map(codes[name].__getitem__, values)
+            data[name] = np.zeros(max(1024, count), dtype)
+            data[name][:count] = np.fromiter(values, dtype, count)
+        with self._lock:
+            self.size, self._rows, self._codes, self.labels, self._data = count, rows, codes, labels, data
+
+    def put(self, order_id: str, order: Order):
+        """Add an order, or overwrite its row after a change"""
+        with self._lock:
+            row = self._rows.get(order_id)
+            if row is None:
+                row = self._rows[order_id] = self.size
+                if row == len(self._data['created_at']):
+                    for name, column in self._data.items():
+                        self._data[name] = np.concatenate([column, np.zeros_like(column)])
+                self.size += 1
+            for name, (_, value) in COLUMNS.items():
+                self._data[name][row] = self._code(name, value(order)) if name in CODED else value(order)
+
+    def _snapshot(self) -> Tuple[Dict[str, np.ndarray], Dict[str, List[str]]]:
+        # Views of the filled rows: growing replaces the arrays instead of
+        # resizing them, so a report never sees a half-copied column.  A row
+        # overwritten mid-report is off by one order change at most.
+        with self._lock:
+            columns = {name: column[:self.size] for name, column in self._data.items()}
+            labels = {name: list(values) for name, values in self.labels.items()}
+        return columns, labels
+
+    # Reports
+    def report(self, since: date, until: date) -> Dict[str, Any]:
+        """Sales figures for the days ``since`` .. ``until`` inclusive"""
+        columns, labels = self._snapshot()
+        days = (until - since).days + 1
+        # Days are bucketed between local midnights, so DST days have 23 or 25 hours
+        midnights = np.array([_local_midnight(since + timedelta(days=i)) for i in range(days + 1)])
+        start, end = int(midnights[0]), int(midnights[-1])
+
+        created = columns['created_at']
+        in_window = (created >= start) & (created < end)
+        price = columns['price'][in_window]
+        points = columns['points'][in_window]
+        user = columns['user'][in_window]
+        product = columns['product'][in_window]
+        delivery = columns['delivery'][in_window]
+        users = len(labels['user'])
+        orders = len(price)
+        revenue = float(price.sum())
+
+        # Revenue per product and per delivery method
+        products = len(labels['product'])
+        product_revenue = np.bincount(product, weights=price, minlength=products)
+        product_quantity = np.bincount(product, weights=columns['quantity'][in_window], minlength=products)
+        product_orders = np.bincount(product, minlength=products)
+        top = [code for code in np.argsort(product_revenue, kind='stable')[::-1][:TOP_PRODUCTS] if product_orders[code]]
+        methods = len(labels['delivery'])
+        delivery_revenue = np.bincount(delivery, weights=price, minlength=methods)
+        delivery_orders = np.bincount(delivery, minlength=methods)
+
+        # Daily series, and weekly series in calendar weeks (Monday first)
+        day = np.searchsorted(midnights, created[in_window], side='right') - 1
+        daily_orders = np.bincount(day, minlength=days)[:days]
+        daily_revenue = np.bincount(day, weights=price, minlength=days)[:days]
+        week = (day + since.weekday()) // 7
+        weeks = (days - 1 + since.weekday()) // 7 + 1
+        weekly_orders = np.bincount(week, minlength=weeks)[:weeks]
+        weekly_revenue = np.bincount(week, weights=price, minlength=weeks)[:weeks]
+
+        # Customers: first order ever, window and lifetime order counts
+        all_users = columns['user']
+        first_order = np.full(users, np.iinfo(np.int64).max)
+        np.minimum.at(first_order, all_users, created)
+        lifetime_orders = np.bincount(all_users, minlength=users)
+        lifetime_revenue = np.bincount(all_users, weights=columns['price'], minlength=users)
+        window_orders = np.bincount(user, minlength=users)
+        active = window_orders > 0
+        returning = active & (first_order < start)
+
+        # Cohorts: customers acquired in the window, by month of first order
+        acquired = (first_order >= start) & (first_order < end)
+        month_starts = [since.replace(day=1)]
+        while month_starts[-1] <= until:
+            month_starts.append(_add_month(month_starts[-1]))
+        month_index = np.searchsorted(
+            np.array([_local_midnight(month) for month in month_starts]), first_order[acquired], side='right'
+        ) - 1
+        present, cohort = np.unique(month_index, return_inverse=True)
+        months = [month_starts[i] for i in present]
+        cohort_size = np.bincount(cohort, minlength=len(months))
+        cohort_repeat = np.bincount(cohort, weights=lifetime_orders[acquired] >= 2, minlength=len(months))
+        cohort_revenue = np.bincount(cohort, weights=lifetime_revenue[acquired], minlength=len(months))
+
+        # Points redemption
+        redeeming = points > 0
+        redeeming_customers = np.count_nonzero(np.bincount(user[redeeming], minlength=users))
+        customers = int(np.count_nonzero(active))
+
+        return {
+            'since': since,
+            'until': until,
+            'orders': orders,
+            'revenue': revenue,
+            'average_check': revenue / orders if orders else 0.0,
+            'products': [
+                (labels['product'][code], float(product_revenue[code]), int(product_quantity[code]), int(product_orders[code]))
+                for code in top
+            ],
+            'delivery': sorted(
+                ((labels['delivery'][code], float(delivery_revenue[code]), int(delivery_orders[code]))
+                 for code in np.flatnonzero(delivery_orders)),
+                key=lambda x: x[1], reverse=True
+            ),
+            'daily': [
+                (since + timedelta(days=i), int(daily_orders[i]), float(daily_revenue[i])) for i in range(days)
+            ],
+            'weekly': [
+                (since - timedelta(days=since.weekday()) + timedelta(weeks=i), int(weekly_orders[i]), float(weekly_revenue[i]))
+                for i in range(weeks)
+            ],
+            'customers': customers,
+            'new_customers': customers - int(np.count_nonzero(returning)),
+            'returning_customers': int(np.count_nonzero(returning)),
+            'repeat_in_window': int(np.count_nonzero(window_orders >= 2)),
+            'cohorts': [
+                (f"{months[i]:%Y-%m}", int(cohort_size[i]), int(cohort_repeat[i]), float(cohort_revenue[i]))
+                for i in range(len(months))
+            ],
+            'points_orders': int(np.count_nonzero(redeeming)),
+            'points_rate': float(redeeming.mean()) if orders else 0.0,
+            'points_redeemed': float(points.sum()),
+            'points_customers_rate': redeeming_customers / customers if customers else 0.0
+        }
+
+
+def _percent(part: float, whole: float) -> str:
+    return f"{part / whole * 100:.1f}%" if whole else "0.0%"
+
+
+def format_report(report: Dict[str, Any], delivery_names: Optional[Dict[str, str]] = None) -> str:
+    """Telegram text of a ``report()`` result"""
+    delivery_names = delivery_names or {}
+    lines = [
+        f"📈 Аналитика {report['since']:%d.%m.%Y} — {report['until']:%d.%m.%Y}",
+        "━━━━━━━━━━━━━━━",
+        "",
+        f"Заказов: {report['orders']}",
+        f"Выручка: {report['revenue']:.0f} р.",
+        f"Средний чек: {report['average_check']:.2f} р.",
+        "",
+        "🏷 Выручка по товарам:"
+    ]
+    for name, revenue, quantity, orders in report['products']:
+        lines.append(f"• {name}: {revenue:.0f} р. ({quantity} шт., {orders} зак.)")
+
+    lines += ["", "🚚 По способам доставки:"]
+    for method, revenue, orders in report['delivery']:
+        # Old orders stored the method's name instead of its id
+        name = delivery_names.get(method, method or 'не указан')
+        lines.append(f"• {name}: {revenue:.0f} р. ({orders} зак., {_percent(revenue, report['revenue'])})")
+
+    lines += ["", "📅 По неделям:"]
+    for week, orders, revenue in report['weekly'][-REPORT_WEEKS:]:
+        lines.append(f"• с {week:%d.%m}: {orders} зак., {revenue:.0f} р.")
+    lines += ["", "📆 Последние дни:"]
+    for day, orders, revenue in report['daily'][-REPORT_DAYS:]:
+        lines.append(f"• {day:%d.%m}: {orders} зак., {revenue:.0f} р.")
+
+    lines += [
+        "",
+        "👥 Покупатели:",
+        f"Всего: {report['customers']}, новых: {report['new_customers']}, "
+        f"вернувшихся: {report['returning_customers']}",
+        f"Повторно купили за период: {report['repeat_in_window']} "
+        f"({_percent(report['repeat_in_window'], report['customers'])})"
+    ]
+    if report['cohorts']:
+        lines.append("Когорты (месяц первого заказа: покупателей, вернулись, выручка):")
+        for month, size, repeat, revenue in report['cohorts'][-REPORT_COHORTS:]:
+            lines.append(f"• {month}: {size}, {repeat} ({_percent(repeat, size)}), {revenue:.0f} р.")
+
+    lines += [
+        "",
+        "💎 Баллы:",
+        f"Заказов с баллами: {report['points_orders']} ({report['points_rate'] * 100:.1f}%)",
+        f"Списано баллов: {report['points_redeemed']:.0f}",
+        f"Покупателей, списавших баллы: {report['points_customers_rate'] * 100:.1f}%"
+    ]
+    return "\n".join(lines)
+
+
+# Example usage:
+#   python order_analytics.py [orders]
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    rng = random.Random(42)
+    now = datetime.now()
+    products = [f"Товар {i}" for i in range(200)]
+    methods = ['shuttle', 'euro_post', 'bel_post', 'pickup']
+    orders = [
+        (f"ORDER_{i}", Order(
+            user_id=rng.randint(1, count // 10),
+            product_name=rng.choice(products),
+            quantity=rng.randint(1, 3),
+            final_price=rng.randint(10, 500),
+            delivery_method=rng.choice(methods),
+            points_used=rng.choice((0, 0, 0, 50, 100)),
+            created_at=int(now.timestamp()) - rng.randint(0, 3 * 365 * 86400)
+        ))
+        for i in range(count)
+    ]
+
+    analytics = SalesAnalytics()
+    started = time.perf_counter()
+    analytics.load(orders)
+    print(f"Loaded {count} orders in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+    started = time.perf_counter()
+    for order_id, order in orders[:1000]:
+        analytics.put(order_id, order.updated({'delivered': True}))
+    print(f"Order change: {(time.perf_counter() - started) * 1000:.3f} us each")
+
+    today = now.date()
+    for days in (30, 365, 3 * 365):
+        since = today - timedelta(days=days - 1)
+        analytics.report(since, today)  # warm-up
+        runs = 10
+        started = time.perf_counter()
+        for _ in range(runs):
+            text = format_report(analytics.report(since, today))
+        elapsed = (time.perf_counter() - started) / runs * 1000
+        print(f"{days}-day report: {elapsed:.1f} ms ({len(text)} characters)")
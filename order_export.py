@@ -0,0 +1,380 @@
+"""Order report export that runs in its own process.
+
+The bot starts ``python order_export.py ...`` as a subprocess, reads its
+progress lines from stdout and sends the finished file.  The worker streams
+the orders of the requested time range straight into the output file
+(xlsx in constant_memory mode, CSV or gzipped JSON lines), so neither the
+event loop nor the bot's memory pays for large histories.
+
+The SQLite backend is read by the worker itself through the created_at
+index.  The JSON journal has no index on disk, so for it the bot slices the
+range out of its in-memory time index and pipes those orders to the worker
+as JSON lines; a one-day export never parses the whole history either way.
+"""
+import os
+import csv
+import sys
+import gzip
+import json
+import time
+import asyncio
+import argparse
+import logging
+import tempfile
+from datetime import datetime
+from typing import Dict, Any, Awaitable, Callable, IO, Iterable, Iterator, List, Optional, Tuple
+
+import xlsxwriter
+
+from order_record import Order, ORDER_TIME_FORMAT
+from order_store import OrderStore, create_order_store
+
+COLUMNS = [
+    'ID заказа', 'Дата', 'Покупатель ID', 'Товар', 'Количество', 'Сумма',
+    'Способ доставки', 'Статус', 'Трек-код', 'Использовано баллов', 'Комментарий'
+]
+SUM_COLUMN = 5
+DATE_WIDTH = len('2025-01-01 00:00:00')
+MAX_COLUMN_WIDTH = 255  # Excel's limit
+PROGRESS_EVERY = 1000   # rows between progress reports
+FEED_CHUNK = 1000       # orders per write when piping them to the worker
+
+ProgressCallback = Callable[[int, int], None]
+
+
+def order_row(order_id: str, order: Order, delivery_names: Dict[str, str]) -> List[Any]:
+    """One report row, in COLUMNS order"""
+    return [
+        order_id,
+        order.created if order.created_at else None,
+        order.user_id,
+        order.product_name,
+        order.quantity,
+        order.final_price,
+        # Old orders stored the delivery method's name instead of its id
+        delivery_names.get(order.delivery_method, order.delivery_method or ''),
+        'Доставлен' if order.delivered else 'В обработке',
+        order.tracking_code or '',
+        order.points_used,
+        order.comment or ''
+    ]
+
+
+def write_orders_xlsx(path: str, orders: Iterable[Tuple[str, Order]], delivery_names: Dict[str, str],
+                      total: int = 0, progress: Optional[ProgressCallback] = None) -> int:
+    """Stream orders into an .xlsx file; returns the number of rows.
+
+    Rows go to disk as they are written (constant_memory), so they must
+    arrive in their final order.  Column widths are tracked per value as the
+    rows pass by and applied at the end.
+    """
+    workbook = xlsxwriter.Workbook(path, {'constant_memory': True})
+    worksheet = workbook.add_worksheet('Заказы')
+    header_format = workbook.add_format({
+        'bold': True,
+        'bg_color': '#4B5563',
+        'font_color': 'white',
+        'border': 1
+    })
+    cell_format = workbook.add_format({'border': 1})
+    date_format = workbook.add_format({'border': 1, 'num_format': 'yyyy-mm-dd hh:mm:ss'})
+
+    widths = [len(title) for title in COLUMNS]
+    worksheet.write_row(0, 0, COLUMNS, header_format)
+
+    # Explicit types: write() would turn "=..." comments into formulas
+    write_blank, write_number, write_string = worksheet.write_blank, worksheet.write_number, worksheet.write_string
+    write_datetime = worksheet.write_datetime
+    row = 0
+    for row, (order_id, order) in enumerate(orders, 1):
+        for col, value in enumerate(order_row(order_id, order, delivery_names)):
+            if value is None:
+                write_blank(row, col, None, cell_format)
+                continue
+            if isinstance(value, str):
+                write_string(row, col, value, cell_format)
+                width = len(value)
+            elif isinstance(value, datetime):
+                write_datetime(row, col, value, date_format)
+                width = DATE_WIDTH
+            elif isinstance(value, (int, float)):
+                write_number(row, col, value, cell_format)
+                width = len(str(value))
+            else:
+                value = str(value)
+                write_string(row, col, value, cell_format)
+                width = len(value)
+            if width > widths[col]:
+                widths[col] = width
+        if progress and row % PROGRESS_EVERY == 0:
+            progress(row, total)
+
+    for col, width in enumerate(widths):
+        worksheet.set_column(col, col, min(width + 2, MAX_COLUMN_WIDTH))
+
+    # Add totals
+    if row:
+        total_row = row + 2
+        worksheet.write_string(total_row, 0, 'ИТОГО:', header_format)
+        worksheet.write_formula(total_row, SUM_COLUMN, f'=SUM(F2:F{row + 1})', header_format)
+    workbook.close()
+    return row
+
+
+def write_orders_csv(path: str, orders: Iterable[Tuple[str, Order]], delivery_names: Dict[str, str],
+                     total: int = 0, progress: Optional[ProgressCallback] = None) -> int:
+    """Stream orders into a CSV file (UTF-8 with BOM for Excel); returns the number of rows"""
+    row = 0
+    with open(path, 'w', encoding='utf-8-sig', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(COLUMNS)
+        for row, (order_id, order) in enumerate(orders, 1):
+            values = order_row(order_id, order, delivery_names)
+            for col, value in enumerate(values):
+                if value is None:
+                    values[col] = ''
+                elif isinstance(value, datetime):
+                    values[col] = value.strftime(ORDER_TIME_FORMAT)
+                elif isinstance(value, str) and value[:1] in ('=', '+', '-', '@'):
+                    # Spreadsheets would run "=..." comments as formulas
+                    values[col] = "'" + value
+            writer.writerow(values)
+            if progress and row % PROGRESS_EVERY == 0:
+                progress(row, total)
+    return row
+
+
+def order_line(order_id: str, order: Order) -> str:
+    """One JSON line: the order id and the full stored record"""
+    return json.dumps({'order_id': order_id, 'order': order.to_dict()},
+                      ensure_ascii=False, separators=(',', ':')) + '\n'
+
+
+def read_order_lines(stream: IO[str]) -> Iterator[Tuple[str, Order]]:
+    """Orders from ``order_line()`` lines, e.g. a .jsonl export or the worker's stdin"""
+    for line in stream:
+        if line.strip():
+            record = json.loads(line)
+            yield record['order_id'], Order.from_dict(record['order'])
+
+
+def write_orders_jsonl(path: str, orders: Iterable[Tuple[str, Order]], delivery_names: Dict[str, str],
+                       total: int = 0, progress: Optional[ProgressCallback] = None) -> int:
+    """Stream full order records into a gzipped JSON lines file; returns the number of rows"""
+    row = 0
+    with gzip.open(path, 'wt', encoding='utf-8') as f:
+        for row, (order_id, order) in enumerate(orders, 1):
+            f.write(order_line(order_id, order))
+            if progress and row % PROGRESS_EVERY == 0:
+                progress(row, total)
+    return row
+
+
+# Export format (also the file suffix) -> writer
+FORMATS: Dict[str, Callable[..., int]] = {
+    'xlsx': write_orders_xlsx,
+    'csv': write_orders_csv,
+    'jsonl.gz': write_orders_jsonl
+}
+
+
+def _encode_lines(orders: List[Tuple[str, Order]]) -> bytes:
+    return ''.join(order_line(order_id, order) for order_id, order in orders).encode('utf-8')
+
+
+class OrderExporter:
+    """Runs report exports in a subprocess, one at a time.
+
+    ``export()`` starts the worker for one format and time range, forwards
+    its progress to ``on_progress`` (at most every ``progress_interval``
+    seconds) and returns the path of the finished file, which the caller
+    deletes once it is sent.  Cancelling the call kills the worker.  A caller
+    that runs the export as a background task claims the exporter with
+    ``reserve()`` before creating the task and passes ``reserved=True``.
+
+    With ``cache`` (the bot's CachedOrderStore) and a backend other than
+    SQLite, the orders are piped to the worker from the cache's time index.
+    ``mark_exported()`` records in ``state_file`` how far the last complete
+    export reached, which is where ``last_export`` exports continue from.
+    """
+
+    def __init__(self, backend: str, orders_file: str, db_file: str,
+                 delivery_names: Dict[str, str], cache: Optional[OrderStore] = None,
+                 state_file: str = 'exports.json', progress_interval: float = 2.0):
+        self.backend = backend
+        self.orders_file = orders_file
+        self.db_file = db_file
+        self.delivery_names = delivery_names
+        self.cache = cache
+        self.state_file = state_file
+        self.progress_interval = progress_interval
+        self.running = False
+        self.last_export: Optional[datetime] = None
+        state = self._load()
+        if state.get('last_export'):
+            self.last_export = datetime.fromtimestamp(state['last_export'])
+
+    # State file
+    def _load(self) -> Dict[str, Any]:
+        try:
+            with open(self.state_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (json.JSONDecodeError, ValueError) as e:
+            logging.error(f"Cannot read {self.state_file}, the next incremental export starts over: {e}")
+            return {}
+
+    def _write(self, data: str):
+        tmp_file = f"{self.state_file}.tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.state_file)
+
+    async def mark_exported(self, until: datetime):
+        """Remember that every order placed before ``until`` has been exported"""
+        self.last_export = until
+        data = json.dumps({'last_export': int(until.timestamp())})
+        await asyncio.get_running_loop().run_in_executor(None, self._write, data)
+
+    # Export
+    def reserve(self) -> bool:
+        """Claim the exporter for one export(); False if one is running"""
+        if self.running:
+            return False
+        self.running = True
+        return True
+
+    async def export(self, fmt: str = 'xlsx', since: Optional[datetime] = None, until: Optional[datetime] = None,
+                     on_progress: Optional[Callable[[int, int], Awaitable[Any]]] = None,
+                     reserved: bool = False) -> Tuple[str, int]:
+        """Build the report of orders placed in [since, until); returns (path, rows)"""
+        if not reserved and not self.reserve():
+            raise RuntimeError("An export is already running")
+        if fmt not in FORMATS:
+            self.running = False
+            raise ValueError(f"Unknown export format: {fmt}")
+        fd, path = tempfile.mkstemp(prefix='orders_', suffix=f'.{fmt}')
+        os.close(fd)
+        process = None
+        try:
+            args = [
+                '--format', fmt,
+                '--delivery-names', json.dumps(self.delivery_names, ensure_ascii=False),
+                '--output', path,
+                '--progress'
+            ]
+            if since:
+                args += ['--since', str(int(since.timestamp()))]
+            if until:
+                args += ['--until', str(int(until.timestamp()))]
+
+            orders = None
+            if self.cache is not None and self.backend != 'sqlite':
+                orders = await asyncio.get_running_loop().run_in_executor(
+                    None, lambda: list(self.cache.iter_orders(since, until))
+                )
+                args += ['--backend', 'stdin', '--total', str(len(orders))]
+            else:
+                args += ['--backend', self.backend, '--orders-file', self.orders_file, '--db-file', self.db_file]
+
+            process = await asyncio.create_subprocess_exec(
+                sys.executable, os.path.abspath(__file__), *args,
+                stdin=asyncio.subprocess.PIPE if orders is not None else asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE
+            )
+            rows, errors, _ = await asyncio.gather(
+                self._read_progress(process, on_progress),
+                process.stderr.read(),
+                self._feed(process, orders)
+            )
+            if await process.wait() != 0 or rows is None:
+                raise RuntimeError(f"Export worker failed: {errors.decode(errors='replace')[-500:]}")
+            return path, rows
+        except BaseException:
+            if process is not None and process.returncode is None:
+                process.kill()
+                await process.wait()
+            os.remove(path)
+            raise
+        finally:
+            self.running = False
+
+    @staticmethod
+    async def _feed(process, orders: Optional[List[Tuple[str, Order]]]):
+        """Pipe orders to the worker in chunks, encoded off the loop"""
+        if orders is None:
+            return
+        loop = asyncio.get_running_loop()
+        try:
+            for start in range(0, len(orders), FEED_CHUNK):
+                data = await loop.run_in_executor(None, _encode_lines, orders[start:start + FEED_CHUNK])
+                process.stdin.write(data)
+                await process.stdin.drain()
+            process.stdin.close()
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # the worker died; its exit code and stderr tell why
+
+    async def _read_progress(self, process, on_progress) -> Optional[int]:
+        rows = None
+        reported = 0.0
+        loop = asyncio.get_running_loop()
+        async for line in process.stdout:
+            fields = line.decode().split()
+            if fields[:1] == ['progress'] and on_progress and loop.time() - reported >= self.progress_interval:
+                reported = loop.time()
+                try:
+                    await on_progress(int(fields[1]), int(fields[2]))
+                except Exception as e:
+                    logging.warning(f"Export progress not reported: {e}")
+            elif fields[:1] == ['done']:
+                rows = int(fields[1])
+        return rows
+
+
+def _main():
+    parser = argparse.ArgumentParser(description="Export orders placed in a time range")
+    parser.add_argument('--backend', default='journal',
+                        help="order store backend: journal, sqlite, or stdin for order_line() JSON lines")
+    parser.add_argument('--orders-file', default='orders.json')
+    parser.add_argument('--db-file', default='orders.db')
+    parser.add_argument('--format', default='xlsx', choices=list(FORMATS))
+    parser.add_argument('--since', type=int, help='epoch seconds, inclusive')
+    parser.add_argument('--until', type=int, help='epoch seconds, exclusive')
+    parser.add_argument('--total', type=int, default=0, help='number of orders on stdin, for progress')
+    parser.add_argument('--delivery-names', default='{}', help='JSON: delivery method id -> name')
+    parser.add_argument('--output', help='default: orders.<format>')
+    parser.add_argument('--progress', action='store_true', help='print "progress <done> <total>" lines')
+    args = parser.parse_args()
+    output = args.output or f"orders.{args.format}"
+    since = datetime.fromtimestamp(args.since) if args.since is not None else None
+    until = datetime.fromtimestamp(args.until) if args.until is not None else None
+
+    def report(done: int, total: int):
+        print(f"progress {done} {total}", flush=True)
+
+    started = time.perf_counter()
+    store = None
+    if args.backend == 'stdin':
+        # The bot already applied the time range
+        sys.stdin.reconfigure(encoding='utf-8')
+        orders, total = read_order_lines(sys.stdin), args.total
+    else:
+        store = create_order_store(args.backend, args.orders_file, args.db_file, read_only=True)
+        orders, total = store.iter_orders(since, until), store.count(since, until)
+    rows = FORMATS[args.format](output, orders, json.loads(args.delivery_names),
+                                total, report if args.progress else None)
+    if store is not None:
+        store.close()
+    print(f"done {rows}", flush=True)
+    print(f"Exported {rows} orders to {output} in {time.perf_counter() - started:.1f} s", file=sys.stderr)
+
+
+# Example usage:
+#   python order_export.py --backend sqlite --db-file orders.db --output orders.xlsx
+#   python order_export.py --backend sqlite --format csv --since 1735689600 --until 1735776000
+if __name__ == "__main__":
+    _main()
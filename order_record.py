@@ -0,0 +1,126 @@
+from datetime import datetime
+from typing import Dict, Any, Callable, Optional
+
+# Version of the stored order layout; records carry it as "v"
+SCHEMA_VERSION = 2
+
+# Human-readable order times (display, exports, version 1 records)
+ORDER_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def _upgrade_v1(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Version 1: ids of either type, final_sum/final_price, string timestamps"""
+    data = dict(data)
+    if data.get('user_id') is not None:
+        data['user_id'] = str(data['user_id'])
+    final_sum = data.pop('final_sum', None)
+    if data.get('final_price') is None and final_sum is not None:
+        data['final_price'] = final_sum
+    timestamp = data.pop('timestamp', None)
+    if timestamp and 'created_at' not in data:
+        data['created_at'] = int(datetime.strptime(timestamp, ORDER_TIME_FORMAT).timestamp())
+    return data
+
+
+# version -> function that turns a record of that version into the next one
+MIGRATIONS: Dict[int, Callable[[Dict[str, Any]], Dict[str, Any]]] = {
+    1: _upgrade_v1
+}
+
+
+class Order:
+    """One stored order, normalized once when it is read.
+
+    ``user_id`` is always a string, ``final_price`` is the only price field
+    and ``created_at`` is epoch seconds, so readers compare and sort without
+    re-parsing.  Keys this class does not know about are kept in ``extra``
+    and written back unchanged.
+    """
+
+    __slots__ = (
+        'user_id', 'username', 'full_name', 'product_id', 'product_name',
+        'quantity', 'total_price', 'final_price', 'points_used',
+        'delivery_method', 'comment', 'user_data', 'created_at',
+        'delivered', 'tracking_code', 'extra'
+    )
+
+    def __init__(self, user_id=None, username: Optional[str] = None, full_name: Optional[str] = None,
+                 product_id: Optional[str] = None, product_name: Optional[str] = None,
+                 quantity: Optional[int] = None, total_price=None, final_price=0,
+                 points_used=0, delivery_method: Optional[str] = None,
+                 comment: Optional[str] = None, user_data: Optional[str] = None,
+                 created_at: int = 0, delivered: bool = False,
+                 tracking_code: Optional[str] = None, extra: Optional[Dict[str, Any]] = None):
+        self.user_id = str(user_id) if user_id is not None else None
+        self.username = username
+        self.full_name = full_name
+        self.product_id = product_id
+        self.product_name = product_name
+        self.quantity = quantity
+        self.total_price = total_price
+        self.final_price = final_price if final_price is not None else 0
+        self.points_used = points_used or 0
+        self.delivery_method = delivery_method
+        self.comment = comment
+        self.user_data = user_data
+        self.created_at = int(created_at or 0)
+        self.delivered = bool(delivered)
+        self.tracking_code = tracking_code
+        self.extra = extra or {}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'Order':
+        """Build from a stored record of any schema version"""
+        version = data.get('v', 1)
+        while version < SCHEMA_VERSION:
+            data = MIGRATIONS[version](data)
+            version += 1
+        fields = {}
+        extra = {}
+        for key, value in data.items():
+            if key == 'v':
+                continue
+            if key in cls.__slots__ and key != 'extra':
+                fields[key] = value
+            else:
+                extra[key] = value
+        return cls(extra=extra, **fields)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Current-version record; empty optional fields are left out"""
+        data: Dict[str, Any] = {'v': SCHEMA_VERSION}
+        for key in self.__slots__[:-1]:
+            value = getattr(self, key)
+            if value is not None and not (key == 'delivered' and not value):
+                data[key] = value
+        data.update(self.extra)
+        return data
+
+    def updated(self, fields: Dict[str, Any]) -> 'Order':
+        """Copy with ``fields`` applied, e.g. status or tracking code"""
+        order = Order.from_dict(self.to_dict())
+        for key, value in fields.items():
+            if key in self.__slots__ and key != 'extra':
+                setattr(order, key, value)
+            else:
+                order.extra[key] = value
+        if order.user_id is not None:
+            order.user_id = str(order.user_id)
+        return order
+
+    @property
+    def created(self) -> datetime:
+        return datetime.fromtimestamp(self.created_at)
+
+    @property
+    def timestamp(self) -> str:
+        """``created_at`` in ORDER_TIME_FORMAT, for display"""
+        return self.created.strftime(ORDER_TIME_FORMAT)
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, Order):
+            return NotImplemented
+        return self.to_dict() == other.to_dict()
+
+    def __repr__(self) -> str:
+        return f"Order({self.to_dict()!r})"
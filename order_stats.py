@@ -0,0 +1,195 @@
+import sys
+import time
+import heapq
+import random
+import threading
+from datetime import date, datetime, timedelta
+from typing import Dict, Any, List, Optional, Tuple
+
+from order_record import Order
+
+
+def _new_bucket() -> Dict[str, Any]:
+    return {'orders': 0, 'sum': 0, 'completed': 0, 'users': {}}
+
+
+class OrderStats:
+    """Order aggregates per calendar day, kept up to date as orders change.
+
+    Every order contributes to the bucket of its day (local date of
+    ``created_at``): order count, ``final_price`` sum, delivered count and
+    ``{user_id: [orders, sum]}``.  The order store calls ``add()`` and
+    ``remove()`` on every write, so a status change is a remove of the old
+    version plus an add of the new one.  Window figures are sums over at most
+    one bucket per day, whatever the size of the order history.
+
+    For the rolling ``window_days`` window the per-user totals are also kept
+    in a max-heap with lazy deletion: changed totals are pushed again and
+    stale entries are dropped when ``top_clients()`` meets them.
+    """
+
+    def __init__(self, window_days: int = 7):
+        self.window_days = window_days
+        self._days: Dict[str, Dict[str, Any]] = {}
+        self._window_start: Optional[str] = None
+        self._window_totals: Dict[str, List[float]] = {}
+        self._heap: List[Tuple[float, str]] = []
+        self._lock = threading.Lock()
+
+    # Updates
+    def clear(self):
+        with self._lock:
+            self._days = {}
+            self._window_start = None
+            self._window_totals = {}
+            self._heap = []
+
+    def add(self, order: Order):
+        self._apply(order, 1)
+
+    def remove(self, order: Order):
+        self._apply(order, -1)
+
+    def _apply(self, order: Order, sign: int):
+        if not order.created_at:
+            return
+        day = date.fromtimestamp(order.created_at).isoformat()
+        price = order.final_price or 0
+        user_id = order.user_id
+        with self._lock:
+            bucket = self._days.get(day)
+            if bucket is None:
+                bucket = self._days[day] = _new_bucket()
+            bucket['orders'] += sign
+            bucket['sum'] += sign * price
+            if order.delivered:
+                bucket['completed'] += sign
+            if user_id:
+                user = bucket['users'].setdefault(user_id, [0, 0])
+                user[0] += sign
+                user[1] += sign * price
+                if user[0] <= 0:
+                    del bucket['users'][user_id]
+                if self._window_start is not None and day >= self._window_start:
+                    window = self._window_totals.setdefault(user_id, [0, 0])
+                    window[0] += sign
+                    window[1] += sign * price
+                    if window[0] <= 0:
+                        del self._window_totals[user_id]
+                    else:
+                        heapq.heappush(self._heap, (-window[1], user_id))
+            if bucket['orders'] <= 0:
+                del self._days[day]
+
+    # Windows
+    @staticmethod
+    def _day_keys(since: date, until: date) -> List[str]:
+        return [(since + timedelta(days=i)).isoformat() for i in range((until - since).days + 1)]
+
+    def _window_days(self) -> List[str]:
+        start = date.fromisoformat(self._window_start)
+        return self._day_keys(start, start + timedelta(days=self.window_days - 1))
+
+    def window(self, since: date, until: date) -> Dict[str, Any]:
+        """Totals for the days ``since`` .. ``until`` inclusive"""
+        result = {'total_orders': 0, 'total_sum': 0, 'completed': 0}
+        users = set()
+        with self._lock:
+            for day in self._day_keys(since, until):
+                bucket = self._days.get(day)
+                if bucket is None:
+                    continue
+                result['total_orders'] += bucket['orders']
+                result['total_sum'] += bucket['sum']
+                result['completed'] += bucket['completed']
+                users.update(bucket['users'])
+        result['in_progress'] = result['total_orders'] - result['completed']
+        result['customers'] = len(users)
+        return result
+
+    def last_days(self, days: int, today: Optional[date] = None) -> Dict[str, Any]:
+        """Totals for the last ``days`` calendar days, today included"""
+        today = today or datetime.now().date()
+        return self.window(today - timedelta(days=days - 1), today)
+
+    # Top clients
+    def _roll(self, today: date):
+        """Rebuild the rolling window totals when the day changes"""
+        start = (today - timedelta(days=self.window_days - 1)).isoformat()
+        if start == self._window_start:
+            return
+        self._window_start = start
+        totals: Dict[str, List[float]] = {}
+        for day in self._window_days():
+            bucket = self._days.get(day)
+            if bucket is not None:
+                for user_id, (orders, total) in bucket['users'].items():
+                    window = totals.setdefault(user_id, [0, 0])
+                    window[0] += orders
+                    window[1] += total
+        self._window_totals = totals
+        self._rebuild_heap()
+
+    def _rebuild_heap(self):
+        self._heap = [(-total, user_id) for user_id, (_, total) in self._window_totals.items()]
+        heapq.heapify(self._heap)
+
+    def top_clients(self, limit: int = 3, today: Optional[date] = None) -> List[Tuple[str, float]]:
+        """(user_id, total) of the biggest spenders in the rolling window"""
+        with self._lock:
+            self._roll(today or datetime.now().date())
+            if len(self._heap) > 4 * len(self._window_totals) + 64:
+                self._rebuild_heap()
+            top: List[Tuple[float, str]] = []
+            seen = set()
+            while self._heap and len(top) < limit:
+                entry = heapq.heappop(self._heap)
+                total, user_id = -entry[0], entry[1]
+                window = self._window_totals.get(user_id)
+                if user_id in seen or window is None or window[1] != total:
+                    continue  # stale or duplicate entry
+                seen.add(user_id)
+                top.append(entry)
+            for entry in top:
+                heapq.heappush(self._heap, entry)
+            return [(user_id, -total) for total, user_id in top]
+
+
+# Example usage:
+#   python order_stats.py [orders]
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    rng = random.Random(42)
+    now = datetime.now()
+    orders = [
+        Order(
+            user_id=rng.randint(1, count // 10),
+            final_price=rng.randint(10, 500),
+            delivered=rng.random() < 0.7,
+            created_at=int(now.timestamp()) - rng.randint(0, 365 * 86400)
+        )
+        for _ in range(count)
+    ]
+
+    stats = OrderStats()
+    started = time.perf_counter()
+    for order in orders:
+        stats.add(order)
+    print(f"Loaded {count} orders in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+    started = time.perf_counter()
+    for _ in range(1000):
+        stats.last_days(7)
+        stats.top_clients(3)
+    print(f"7-day totals + top 3: {(time.perf_counter() - started):.3f} ms per call")
+
+    started = time.perf_counter()
+    for _ in range(100):
+        stats.last_days(30)
+    print(f"30-day totals: {(time.perf_counter() - started) * 10:.3f} ms per call")
+
+    started = time.perf_counter()
+    for order in orders[:1000]:
+        stats.remove(order)
+        stats.add(order.updated({'delivered': True}))
+    print(f"Status change: {(time.perf_counter() - started) * 1000:.3f} us each")
@@ -0,0 +1,731 @@
+import os
+import sys
+import json
+import logging
+import sqlite3
+import time
+import bisect
+import threading
+from datetime import datetime
+from typing import Dict, Any, Optional, List, Tuple, Set, Iterable, Iterator
+
+from order_record import Order, SCHEMA_VERSION
+from order_stats import OrderStats
+
+
+class OrderJournal:
+    """Append-only order journal with periodic compaction into a snapshot.
+
+    The snapshot keeps the familiar ``orders.json`` layout (order_id -> order).
+    Every write appends one JSON record per line to the journal, so writing an
+    order costs O(1) regardless of history size.  Once the journal grows past
+    ``compact_every`` records the current state is folded into a new snapshot
+    and the journal is truncated.
+
+    A ``read_only`` journal (another process reading the live files) never
+    repairs a torn tail: it may just be an append still in progress.
+    """
+
+    def __init__(self, snapshot_file: str = 'orders.json', journal_file: Optional[str] = None,
+                 compact_every: int = 1000, fsync: bool = True, read_only: bool = False):
+        self.snapshot_file = snapshot_file
+        self.journal_file = journal_file or f"{os.path.splitext(snapshot_file)[0]}.journal"
+        self.compact_every = compact_every
+        self.fsync = fsync
+        self.read_only = read_only
+        self.orders: Dict[str, Dict[str, Any]] = {}
+        self._journal_records = 0
+        self._loaded = False
+
+    def load(self) -> Dict[str, Dict[str, Any]]:
+        """Rebuild orders from the snapshot plus the journal tail"""
+        orders = self._load_snapshot()
+        self._journal_records = self._replay_journal(orders)
+        self.orders = orders
+        self._loaded = True
+        return orders
+
+    def _load_snapshot(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            with open(self.snapshot_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def _replay_journal(self, orders: Dict[str, Dict[str, Any]]) -> int:
+        if not os.path.exists(self.journal_file):
+            return 0
+
+        records = 0
+        good_offset = 0
+        with open(self.journal_file, 'rb') as f:
+            for raw in f:
+                if not raw.endswith(b'\n'):
+                    # Torn final line left by a crash mid-append
+                    break
+                try:
+                    record = json.loads(raw)
+                except ValueError:
+                    logging.error(f"Skipping corrupt journal record at offset {good_offset}")
+                    good_offset += len(raw)
+                    continue
+                self._apply(orders, record)
+                records += 1
+                good_offset += len(raw)
+            size = f.seek(0, os.SEEK_END)
+
+        if size > good_offset and not self.read_only:
+            logging.warning(
+                f"Truncating torn tail of {self.journal_file}: {size - good_offset} bytes"
+            )
+            with open(self.journal_file, 'r+b') as f:
+                f.truncate(good_offset)
+        return records
+
+    @staticmethod
+    def _apply(orders: Dict[str, Dict[str, Any]], record: Dict[str, Any]):
+        op = record.get('op')
+        if op == 'put':
+            orders[record['id']] = record['order']
+        elif op == 'update':
+            orders.setdefault(record['id'], {}).update(record['fields'])
+
+    def _ensure_loaded(self):
+        # Compaction writes self.orders out, so never compact a state we have not read
+        if not self._loaded:
+            self.load()
+
+    def _append(self, record: Dict[str, Any]):
+        line = json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n'
+        with open(self.journal_file, 'a', encoding='utf-8') as f:
+            f.write(line)
+            if self.fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        self._journal_records += 1
+        if self._journal_records >= self.compact_every:
+            self.compact()
+
+    def put(self, order_id: str, order: Dict[str, Any]):
+        """Store a new (or replace an existing) order"""
+        self._ensure_loaded()
+        self.orders[order_id] = order
+        self._append({'op': 'put', 'id': order_id, 'order': order})
+
+    def update(self, order_id: str, fields: Dict[str, Any]):
+        """Merge fields into an existing order, e.g. status or tracking code"""
+        self._ensure_loaded()
+        self.orders.setdefault(order_id, {}).update(fields)
+        self._append({'op': 'update', 'id': order_id, 'fields': fields})
+
+    def compact(self):
+        """Fold the journal into a fresh snapshot and truncate the journal.
+
+        Replaying a journal on top of a snapshot that already contains it is
+        harmless, so a crash between the two steps loses nothing.
+        """
+        tmp_file = f"{self.snapshot_file}.tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(self.orders, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.snapshot_file)
+        with open(self.journal_file, 'w', encoding='utf-8'):
+            pass
+        self._journal_records = 0
+
+
+def upgrade_journal(journal: OrderJournal) -> int:
+    """Rewrite records older than SCHEMA_VERSION; returns how many changed.
+
+    The upgraded orders go out as a fresh snapshot through ``compact()``, so
+    the old files are replaced atomically and the journal starts empty.
+    """
+    orders = journal.load()
+    old = [order_id for order_id, order in orders.items() if order.get('v', 1) < SCHEMA_VERSION]
+    if old:
+        for order_id in old:
+            orders[order_id] = Order.from_dict(orders[order_id]).to_dict()
+        journal.compact()
+        logging.info(f"Upgraded {len(old)} orders in {journal.snapshot_file} to schema version {SCHEMA_VERSION}")
+    return len(old)
+
+
+def order_status(order: Order) -> str:
+    """Status used by the storage indexes"""
+    return 'delivered' if order.delivered else 'new'
+
+
+def _epoch(moment: datetime) -> int:
+    return int(moment.timestamp())
+
+
+class OrderStore:
+    """Interface shared by the order storage backends.
+
+    The query helpers have linear-scan defaults; indexed backends override them.
+    Every query returns ``(order_id, order)`` pairs of typed ``Order`` records.
+    """
+
+    def all_orders(self) -> Dict[str, Order]:
+        raise NotImplementedError
+
+    def put(self, order_id: str, order: Order):
+        raise NotImplementedError
+
+    def update(self, order_id: str, fields: Dict[str, Any]):
+        raise NotImplementedError
+
+    def get(self, order_id: str) -> Optional[Order]:
+        return self.all_orders().get(order_id)
+
+    def count(self, since: Optional[datetime] = None, until: Optional[datetime] = None) -> int:
+        """Number of orders, optionally only those placed in [since, until)"""
+        if since is None and until is None:
+            return len(self.all_orders())
+        return sum(1 for _ in self.iter_orders(since, until))
+
+    def iter_orders(self, since: Optional[datetime] = None,
+                    until: Optional[datetime] = None) -> Iterator[Tuple[str, Order]]:
+        """Orders placed in [since, until), newest first; either end may be open.
+
+        Backends that can stream or seek by time override this.
+        """
+        start = _epoch(since) if since else None
+        end = _epoch(until) if until else None
+        orders = [
+            (order_id, order) for order_id, order in self.all_orders().items()
+            if (start is None or order.created_at >= start) and (end is None or order.created_at < end)
+        ]
+        return iter(sorted(orders, key=lambda x: x[1].created_at, reverse=True))
+
+    def orders_for_user(self, user_id) -> List[Tuple[str, Order]]:
+        """User's orders, newest first"""
+        user_id = str(user_id)
+        orders = [
+            (order_id, order) for order_id, order in self.all_orders().items()
+            if order.user_id == user_id
+        ]
+        return sorted(orders, key=lambda x: x[1].created_at, reverse=True)
+
+    def orders_since(self, since: datetime) -> List[Tuple[str, Order]]:
+        """Orders placed after ``since``, oldest first"""
+        since_epoch = _epoch(since)
+        orders = [
+            (order_id, order) for order_id, order in self.all_orders().items()
+            if order.created_at > since_epoch
+        ]
+        return sorted(orders, key=lambda x: x[1].created_at)
+
+    def user_ids(self, since: Optional[datetime] = None) -> Set[str]:
+        """Distinct buyers, optionally only those who ordered after ``since``"""
+        orders = self.orders_since(since) if since else self.all_orders().items()
+        return {order.user_id for _, order in orders if order.user_id}
+
+    def data_files(self) -> List[str]:
+        """Files whose mtime/size reveal changes made outside this process"""
+        return []
+
+    def invalidate(self):
+        """Forget anything read earlier; the next read goes to the files"""
+        pass
+
+    def close(self):
+        pass
+
+
+class JournalOrderStore(OrderStore):
+    """OrderStore backed by the JSON snapshot + append-only journal.
+
+    The files are read on first use; after that the decoded orders live in
+    memory and writes update them, so reads never re-parse the journal.
+    ``invalidate()`` drops them when another process changed the files.
+    """
+
+    def __init__(self, journal: OrderJournal):
+        self.journal = journal
+        self._orders: Optional[Dict[str, Order]] = None
+
+    def all_orders(self) -> Dict[str, Order]:
+        """Loaded orders; callers must treat the result as read-only"""
+        if self._orders is None:
+            self._orders = {order_id: Order.from_dict(order) for order_id, order in self.journal.load().items()}
+        return self._orders
+
+    def put(self, order_id: str, order: Order):
+        self.journal.put(order_id, order.to_dict())
+        if self._orders is not None:
+            self._orders[order_id] = order
+
+    def update(self, order_id: str, fields: Dict[str, Any]):
+        self.journal.update(order_id, fields)
+        if self._orders is not None:
+            self._orders[order_id] = Order.from_dict(self.journal.orders[order_id])
+
+    def invalidate(self):
+        self._orders = None
+
+    def data_files(self) -> List[str]:
+        return [self.journal.snapshot_file, self.journal.journal_file]
+
+
+class SqliteOrderStore(OrderStore):
+    """OrderStore backed by SQLite in WAL mode with indexed query paths"""
+
+    def __init__(self, db_file: str = 'orders.db', read_only: bool = False):
+        self.db_file = db_file
+        self._lock = threading.Lock()
+        if read_only:
+            # Readers in other processes: no schema changes, no writes
+            self.conn = sqlite3.connect(f"file:{db_file}?mode=ro", uri=True, check_same_thread=False)
+            return
+        self.conn = sqlite3.connect(db_file, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.conn:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+        if self._has_orders_table() and int(self.get_meta('schema_version') or 1) < SCHEMA_VERSION:
+            self._upgrade_schema()
+        with self.conn:
+            self.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS orders (
+                    order_id TEXT PRIMARY KEY,
+                    user_id TEXT,
+                    created_at INTEGER,
+                    status TEXT,
+                    data TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_orders_user_created ON orders (user_id, created_at);
+                CREATE INDEX IF NOT EXISTS idx_orders_created ON orders (created_at);
+                CREATE INDEX IF NOT EXISTS idx_orders_status ON orders (status);
+            """)
+        self.set_meta('schema_version', str(SCHEMA_VERSION))
+
+    def _has_orders_table(self) -> bool:
+        row = self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'orders'"
+        ).fetchone()
+        return row is not None
+
+    def _upgrade_schema(self):
+        """Rebuild the version 1 table (text timestamps) with every record upgraded"""
+        rows = self.conn.execute("SELECT order_id, data FROM orders").fetchall()
+        self.conn.execute("BEGIN")
+        try:
+            for index in ('idx_orders_user_ts', 'idx_orders_ts', 'idx_orders_status'):
+                self.conn.execute(f"DROP INDEX IF EXISTS {index}")
+            self.conn.execute("DROP TABLE orders")
+            self.conn.execute("""
+                CREATE TABLE orders (
+                    order_id TEXT PRIMARY KEY,
+                    user_id TEXT,
+                    created_at INTEGER,
+                    status TEXT,
+                    data TEXT NOT NULL
+                )
+            """)
+            self.conn.executemany(
+                "INSERT INTO orders VALUES (?, ?, ?, ?, ?)",
+                (self._row(order_id, Order.from_dict(json.loads(data))) for order_id, data in rows)
+            )
+            self.conn.execute(
+                "INSERT OR REPLACE INTO meta VALUES ('schema_version', ?)", (str(SCHEMA_VERSION),)
+            )
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        logging.info(f"Upgraded {len(rows)} orders in {self.db_file} to schema version {SCHEMA_VERSION}")
+
+    @staticmethod
+    def _row(order_id: str, order: Order) -> tuple:
+        return (
+            order_id,
+            order.user_id,
+            order.created_at,
+            order_status(order),
+            json.dumps(order.to_dict(), ensure_ascii=False, separators=(',', ':'))
+        )
+
+    def _query(self, sql: str, params: tuple = ()) -> List[Tuple[str, Order]]:
+        with self._lock:
+            rows = self.conn.execute(sql, params).fetchall()
+        return [(order_id, Order.from_dict(json.loads(data))) for order_id, data in rows]
+
+    def all_orders(self) -> Dict[str, Order]:
+        return dict(self._query("SELECT order_id, data FROM orders"))
+
+    def get(self, order_id: str) -> Optional[Order]:
+        rows = self._query("SELECT order_id, data FROM orders WHERE order_id = ?", (order_id,))
+        return rows[0][1] if rows else None
+
+    def put(self, order_id: str, order: Order):
+        with self._lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO orders VALUES (?, ?, ?, ?, ?)",
+                self._row(order_id, order)
+            )
+
+    @staticmethod
+    def _time_range(since: Optional[datetime], until: Optional[datetime]) -> Tuple[str, tuple]:
+        """WHERE clause on created_at (served by idx_orders_created) and its parameters"""
+        clauses, params = [], []
+        if since:
+            clauses.append("created_at >= ?")
+            params.append(_epoch(since))
+        if until:
+            clauses.append("created_at < ?")
+            params.append(_epoch(until))
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), tuple(params)
+
+    def count(self, since: Optional[datetime] = None, until: Optional[datetime] = None) -> int:
+        where, params = self._time_range(since, until)
+        with self._lock:
+            return self.conn.execute(f"SELECT COUNT(*) FROM orders{where}", params).fetchone()[0]
+
+    def iter_orders(self, since: Optional[datetime] = None,
+                    until: Optional[datetime] = None) -> Iterator[Tuple[str, Order]]:
+        # Streams rows from the index instead of fetching them all; meant for
+        # a reader that owns its connection (the export worker)
+        where, params = self._time_range(since, until)
+        cursor = self.conn.cursor()
+        cursor.execute(f"SELECT order_id, data FROM orders{where} ORDER BY created_at DESC", params)
+        for order_id, data in cursor:
+            yield order_id, Order.from_dict(json.loads(data))
+
+    def put_many(self, orders: Iterable[Tuple[str, Order]], replace: bool = True) -> int:
+        verb = "INSERT OR REPLACE" if replace else "INSERT OR IGNORE"
+        with self._lock, self.conn:
+            cursor = self.conn.executemany(
+                f"{verb} INTO orders VALUES (?, ?, ?, ?, ?)",
+                (self._row(order_id, order) for order_id, order in orders)
+            )
+            return cursor.rowcount
+
+    def update(self, order_id: str, fields: Dict[str, Any]):
+        with self._lock, self.conn:
+            row = self.conn.execute(
+                "SELECT data FROM orders WHERE order_id = ?", (order_id,)
+            ).fetchone()
+            order = Order.from_dict(json.loads(row[0])) if row else Order()
+            self.conn.execute(
+                "INSERT OR REPLACE INTO orders VALUES (?, ?, ?, ?, ?)",
+                self._row(order_id, order.updated(fields))
+            )
+
+    def orders_for_user(self, user_id) -> List[Tuple[str, Order]]:
+        return self._query(
+            "SELECT order_id, data FROM orders WHERE user_id = ? ORDER BY created_at DESC",
+            (str(user_id),)
+        )
+
+    def orders_since(self, since: datetime) -> List[Tuple[str, Order]]:
+        return self._query(
+            "SELECT order_id, data FROM orders WHERE created_at > ? ORDER BY created_at",
+            (_epoch(since),)
+        )
+
+    def orders_with_status(self, status: str) -> List[Tuple[str, Order]]:
+        return self._query(
+            "SELECT order_id, data FROM orders WHERE status = ? ORDER BY created_at",
+            (status,)
+        )
+
+    def user_ids(self, since: Optional[datetime] = None) -> Set[str]:
+        with self._lock:
+            if since:
+                rows = self.conn.execute(
+                    "SELECT DISTINCT user_id FROM orders WHERE created_at > ? AND user_id IS NOT NULL",
+                    (_epoch(since),)
+                ).fetchall()
+            else:
+                rows = self.conn.execute(
+                    "SELECT DISTINCT user_id FROM orders WHERE user_id IS NOT NULL"
+                ).fetchall()
+        return {row[0] for row in rows}
+
+    def get_meta(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key: str, value: str):
+        with self._lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO meta VALUES (?, ?)", (key, value))
+
+    def data_files(self) -> List[str]:
+        return [self.db_file, f"{self.db_file}-wal"]
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+
+class CachedOrderStore(OrderStore):
+    """Process-wide in-memory order cache in front of another OrderStore.
+
+    Orders are loaded once, writes go through to the backend, and reads are
+    served from memory with per-user and timestamp indexes.  The backend files
+    are stat-ed at most once per ``check_interval`` seconds; if their
+    mtime/size changed (someone edited them by hand) the cache reloads.
+
+    ``order_stats`` (per-day aggregates) and, when given, ``order_analytics``
+    (order_analytics.SalesAnalytics, columnar copy for reports) are kept in
+    step with every write and reload.
+    """
+
+    def __init__(self, backend: OrderStore, check_interval: float = 1.0,
+                 order_stats: Optional[OrderStats] = None, order_analytics=None):
+        self.backend = backend
+        self.check_interval = check_interval
+        self.order_stats = order_stats if order_stats is not None else OrderStats()
+        self.order_analytics = order_analytics
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.RLock()
+        self._orders: Dict[str, Order] = {}
+        self._by_user: Dict[str, Set[str]] = {}
+        self._by_time: List[Tuple[int, str]] = []
+        self._signature = None
+        self._checked_at = 0.0
+        self.reload()
+
+    def _file_signature(self) -> tuple:
+        signature = []
+        for path in self.backend.data_files():
+            try:
+                st = os.stat(path)
+                signature.append((path, st.st_mtime_ns, st.st_size))
+            except FileNotFoundError:
+                signature.append((path, None, None))
+        return tuple(signature)
+
+    def reload(self):
+        """Re-read everything from the backend and rebuild the indexes"""
+        with self._lock:
+            signature = self._file_signature()
+            self.backend.invalidate()
+            orders = self.backend.all_orders()
+            self._orders = {}
+            self._by_user = {}
+            self._by_time = []
+            self.order_stats.clear()
+            for order_id, order in orders.items():
+                self._index(order_id, order)
+                self.order_stats.add(order)
+            self._by_time.sort()
+            if self.order_analytics is not None:
+                self.order_analytics.load(orders.items())
+            self._signature = signature
+            self._checked_at = time.monotonic()
+
+    def _index(self, order_id: str, order: Order, keep_sorted: bool = False):
+        self._orders[order_id] = order
+        if order.user_id is not None:
+            self._by_user.setdefault(order.user_id, set()).add(order_id)
+        entry = (order.created_at, order_id)
+        if keep_sorted:
+            bisect.insort(self._by_time, entry)
+        else:
+            self._by_time.append(entry)
+
+    def _unindex(self, order_id: str, order: Order):
+        self._orders.pop(order_id, None)
+        user_orders = self._by_user.get(order.user_id)
+        if user_orders:
+            user_orders.discard(order_id)
+        entry = (order.created_at, order_id)
+        pos = bisect.bisect_left(self._by_time, entry)
+        if pos < len(self._by_time) and self._by_time[pos] == entry:
+            del self._by_time[pos]
+
+    def _ensure_fresh(self):
+        with self._lock:
+            now = time.monotonic()
+            if now - self._checked_at < self.check_interval:
+                self.hits += 1
+                return
+            self._checked_at = now
+            if self._file_signature() == self._signature:
+                self.hits += 1
+                return
+            self.misses += 1
+            logging.info("Order files changed on disk, reloading order cache")
+            self.reload()
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'orders': len(self._orders)
+        }
+
+    def all_orders(self) -> Dict[str, Order]:
+        """Cached orders; callers must treat the result as read-only"""
+        self._ensure_fresh()
+        return self._orders
+
+    def get(self, order_id: str) -> Optional[Order]:
+        self._ensure_fresh()
+        return self._orders.get(order_id)
+
+    def put(self, order_id: str, order: Order):
+        with self._lock:
+            self._ensure_fresh()
+            old = self._orders.get(order_id)
+            self.backend.put(order_id, order)
+            if old is not None:
+                self._unindex(order_id, old)
+                self.order_stats.remove(old)
+            self._index(order_id, order, keep_sorted=True)
+            self.order_stats.add(order)
+            if self.order_analytics is not None:
+                self.order_analytics.put(order_id, order)
+            # Our own write changed the files, do not treat it as external
+            self._signature = self._file_signature()
+
+    def update(self, order_id: str, fields: Dict[str, Any]):
+        with self._lock:
+            self._ensure_fresh()
+            # Records are replaced, never changed in place, so readers holding
+            # the old one are unaffected
+            old = self._orders.get(order_id)
+            self.backend.update(order_id, fields)
+            order = (old or Order()).updated(fields)
+            if old is not None:
+                self._unindex(order_id, old)
+                self.order_stats.remove(old)
+            self._index(order_id, order, keep_sorted=True)
+            self.order_stats.add(order)
+            if self.order_analytics is not None:
+                self.order_analytics.put(order_id, order)
+            self._signature = self._file_signature()
+
+    def aggregates(self) -> OrderStats:
+        """Per-day order aggregates, revalidated like any other read"""
+        self._ensure_fresh()
+        return self.order_stats
+
+    def analytics(self):
+        """The SalesAnalytics given at construction, revalidated like any other read"""
+        if self.order_analytics is None:
+            raise RuntimeError("Order analytics are not enabled for this store")
+        self._ensure_fresh()
+        return self.order_analytics
+
+    def orders_for_user(self, user_id) -> List[Tuple[str, Order]]:
+        self._ensure_fresh()
+        with self._lock:
+            orders = [(order_id, self._orders[order_id]) for order_id in self._by_user.get(str(user_id), ())]
+        return sorted(orders, key=lambda x: x[1].created_at, reverse=True)
+
+    def orders_since(self, since: datetime) -> List[Tuple[str, Order]]:
+        self._ensure_fresh()
+        # Sentinel sorts after every order_id with the same second
+        start = (_epoch(since), '\uffff')
+        with self._lock:
+            pos = bisect.bisect_right(self._by_time, start)
+            return [(order_id, self._orders[order_id]) for _, order_id in self._by_time[pos:]]
+
+    def _time_slice(self, since: Optional[datetime], until: Optional[datetime]) -> slice:
+        # '' sorts before every order_id of the same second: [since, until)
+        start = bisect.bisect_left(self._by_time, (_epoch(since), '')) if since else 0
+        end = bisect.bisect_left(self._by_time, (_epoch(until), '')) if until else len(self._by_time)
+        return slice(start, end)
+
+    def count(self, since: Optional[datetime] = None, until: Optional[datetime] = None) -> int:
+        self._ensure_fresh()
+        with self._lock:
+            window = self._time_slice(since, until)
+            return max(0, window.stop - window.start)
+
+    def iter_orders(self, since: Optional[datetime] = None,
+                    until: Optional[datetime] = None) -> Iterator[Tuple[str, Order]]:
+        # Snapshot of the range taken under the lock, so writers never race the reader
+        self._ensure_fresh()
+        with self._lock:
+            entries = self._by_time[self._time_slice(since, until)]
+            orders = [(order_id, self._orders[order_id]) for _, order_id in reversed(entries)]
+        return iter(orders)
+
+    def user_ids(self, since: Optional[datetime] = None) -> Set[str]:
+        if since:
+            return super().user_ids(since)
+        self._ensure_fresh()
+        with self._lock:
+            return {user_id for user_id, order_ids in self._by_user.items() if order_ids}
+
+    def data_files(self) -> List[str]:
+        return self.backend.data_files()
+
+    def close(self):
+        self.backend.close()
+
+
+def migrate_json_orders(store: SqliteOrderStore,
+                        json_files: Iterable[str] = ('orders.json', 'orders_data.json'),
+                        force: bool = False) -> int:
+    """One-shot import of the JSON order files into SQLite.
+
+    Rows already present in the database win, so re-running is harmless; the
+    ``migrated_from`` meta key makes the normal startup path skip it entirely.
+    """
+    if store.get_meta('migrated_from') and not force:
+        return 0
+
+    imported = 0
+    sources = []
+    for path in json_files:
+        if not os.path.exists(path):
+            continue
+        # Replays orders.journal too, if the journal backend was used before
+        orders = OrderJournal(path).load()
+        imported += store.put_many(
+            ((order_id, Order.from_dict(order)) for order_id, order in orders.items()),
+            replace=False
+        )
+        sources.append(path)
+        logging.info(f"Migrated {len(orders)} orders from {path}")
+
+    store.set_meta('migrated_from', ','.join(sources))
+    return imported
+
+
+def create_order_store(backend: str = 'journal', orders_file: str = 'orders.json',
+                       db_file: str = 'orders.db', read_only: bool = False) -> OrderStore:
+    """Build the configured order backend ('journal' or 'sqlite').
+
+    ``read_only`` opens the files of a store another process owns (exports):
+    no migrations, upgrades or repairs.
+    """
+    if backend == 'sqlite':
+        store = SqliteOrderStore(db_file, read_only=read_only)
+        if not read_only:
+            migrate_json_orders(store, (orders_file, 'orders_data.json'))
+        return store
+    if backend == 'journal':
+        journal = OrderJournal(orders_file, read_only=read_only)
+        if not read_only:
+            upgrade_journal(journal)
+        return JournalOrderStore(journal)
+    raise ValueError(f"Unknown order store backend: {backend}")
+
+
+# Example usage:
+#   python order_store.py migrate orders.db orders.json orders_data.json
+#   python order_store.py upgrade orders.json orders_data.json
+if __name__ == "__main__":
+    if len(sys.argv) >= 3 and sys.argv[1] == 'migrate':
+        store = SqliteOrderStore(sys.argv[2])
+        count = migrate_json_orders(store, sys.argv[3:] or ('orders.json', 'orders_data.json'), force=True)
+        print(f"Imported {count} orders into {sys.argv[2]}")
+        store.close()
+    elif len(sys.argv) >= 3 and sys.argv[1] == 'upgrade':
+        for path in sys.argv[2:]:
+            count = upgrade_journal(OrderJournal(path))
+            print(f"Upgraded {count} orders in {path} to schema version {SCHEMA_VERSION}")
+    else:
+        print("Usage: python order_store.py migrate <db_file> [json_file ...]\n"
+              "       python order_store.py upgrade <json_file> ...")
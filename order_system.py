@@ -1,20 +1,23 @@
 from typing import Dict, List, Optional
 from loyalty_system import LoyaltySystem
+from catalog import get_catalog
 
 class OrderSystem:
-    def __init__(self):
+    def __init__(self, catalog_file: str = 'catalog.json'):
         self.loyalty_system = LoyaltySystem()
-        self.products = {
-            "Блок 20w (AAA+)": 1500,
-            "Кабель lightning": 800,
-            "Кабель Magsafe": 1200
-        }
+        # Same catalog (and prices) as the bot; follows hot reloads
+        self.catalog = get_catalog(catalog_file)
         self.delivery_methods = {
             1: "Самовывоз",
             2: "Курьер",
             3: "Почта России"
         }
 
+    @property
+    def products(self) -> Dict[str, float]:
+        """Product name -> price from the live catalog"""
+        return self.catalog.current.prices_by_name
+
     def get_products(self) -> Dict[str, float]:
         """Return available products and their prices"""
         return self.products
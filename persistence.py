@@ -0,0 +1,160 @@
+import json
+import asyncio
+import logging
+import sqlite3
+import threading
+from typing import Dict, Any, Optional, Set, Tuple
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+
+class ShopPersistence(BasePersistence):
+    """SQLite persistence for user_data and ConversationHandler states.
+
+    Tuned for the bot's write pattern:
+    * only user_data and conversations are stored (no bot/chat/callback data);
+    * PTB hands over only the users touched since the last run of its
+      persistence loop, and those rows are written in one transaction;
+    * rows are compact JSON, not a pickle of the whole dict;
+    * user_data is loaded lazily, the first time a user sends an update,
+      so startup cost does not grow with the number of known users.
+      Conversation states are small ints and are loaded up front.
+    """
+
+    def __init__(self, db_file: str = 'bot_state.db', update_interval: float = 5):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval
+        )
+        self.db_file = db_file
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(db_file, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.conn:
+            self.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS user_data (
+                    user_id INTEGER PRIMARY KEY,
+                    data TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS conversations (
+                    name TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    state INTEGER NOT NULL,
+                    PRIMARY KEY (name, key)
+                );
+            """)
+        self._loaded_users: Set[int] = set()
+        self._pending_users: Dict[int, Optional[str]] = {}
+        self._pending_conversations: Dict[Tuple[str, str], Optional[int]] = {}
+        self._commit_task: Optional[asyncio.Task] = None
+
+    # Batching: every update_* call only records the row; one task per
+    # persistence run commits everything that piled up in a single transaction.
+    # The pending dicts are only touched on the event loop: they are swapped
+    # out here and the executor gets the swapped-out copies.
+    def _schedule_commit(self):
+        if self._commit_task is None or self._commit_task.done():
+            self._commit_task = asyncio.get_running_loop().create_task(self._commit_soon())
+
+    def _take_pending(self) -> Tuple[Dict[int, Optional[str]], Dict[Tuple[str, str], Optional[int]]]:
+        users, self._pending_users = self._pending_users, {}
+        conversations, self._pending_conversations = self._pending_conversations, {}
+        return users, conversations
+
+    async def _commit_soon(self):
+        # Rows queued while a commit runs are picked up by the next round
+        while self._pending_users or self._pending_conversations:
+            users, conversations = self._take_pending()
+            await asyncio.get_running_loop().run_in_executor(None, self._commit, users, conversations)
+
+    def _commit(self, users: Dict[int, Optional[str]], conversations: Dict[Tuple[str, str], Optional[int]]):
+        with self._lock:
+            with self.conn:
+                for user_id, data in users.items():
+                    if data is None:
+                        self.conn.execute("DELETE FROM user_data WHERE user_id = ?", (user_id,))
+                    else:
+                        self.conn.execute("INSERT OR REPLACE INTO user_data VALUES (?, ?)", (user_id, data))
+                for (name, key), state in conversations.items():
+                    if state is None:
+                        self.conn.execute("DELETE FROM conversations WHERE name = ? AND key = ?", (name, key))
+                    else:
+                        self.conn.execute("INSERT OR REPLACE INTO conversations VALUES (?, ?, ?)", (name, key, state))
+
+    def _load_user(self, user_id: int) -> Dict[str, Any]:
+        with self._lock:
+            row = self.conn.execute("SELECT data FROM user_data WHERE user_id = ?", (user_id,)).fetchone()
+        return json.loads(row[0]) if row else {}
+
+    # user_data
+    async def get_user_data(self) -> Dict[int, Dict[Any, Any]]:
+        # Loaded per user in refresh_user_data instead
+        return {}
+
+    async def refresh_user_data(self, user_id: int, user_data: Dict[Any, Any]) -> None:
+        if user_id in self._loaded_users:
+            return
+        self._loaded_users.add(user_id)
+        stored = await asyncio.get_running_loop().run_in_executor(None, self._load_user, user_id)
+        # Keep anything set before the first refresh, stored values fill the rest
+        for key, value in stored.items():
+            user_data.setdefault(key, value)
+
+    async def update_user_data(self, user_id: int, data: Dict[Any, Any]) -> None:
+        try:
+            self._pending_users[user_id] = json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+        except (TypeError, ValueError) as e:
+            logging.error(f"Cannot persist user_data of {user_id}: {e}")
+            return
+        self._loaded_users.add(user_id)
+        self._schedule_commit()
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._pending_users[user_id] = None
+        self._schedule_commit()
+
+    # conversations
+    async def get_conversations(self, name: str) -> Dict[Tuple[int, ...], object]:
+        with self._lock:
+            rows = self.conn.execute("SELECT key, state FROM conversations WHERE name = ?", (name,)).fetchall()
+        return {tuple(json.loads(key)): state for key, state in rows}
+
+    async def update_conversation(self, name: str, key: Tuple[int, ...], new_state: Optional[object]) -> None:
+        self._pending_conversations[(name, json.dumps(list(key)))] = new_state
+        self._schedule_commit()
+
+    async def flush(self) -> None:
+        if self._commit_task is not None:
+            await self._commit_task
+        self._commit(*self._take_pending())
+        with self._lock:
+            self.conn.close()
+
+    # Data kinds the bot does not persist
+    async def get_chat_data(self) -> Dict[int, Any]:
+        return {}
+
+    async def get_bot_data(self) -> Dict[Any, Any]:
+        return {}
+
+    async def get_callback_data(self) -> None:
+        return None
+
+    async def update_chat_data(self, chat_id: int, data: Any) -> None:
+        pass
+
+    async def update_bot_data(self, data: Any) -> None:
+        pass
+
+    async def update_callback_data(self, data: Any) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: Any) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: Any) -> None:
+        pass
@@ -0,0 +1,361 @@
+import re
+import sys
+import time
+import heapq
+import random
+import threading
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from typing import Dict, Any, List, Mapping, Optional, Set, Tuple
+
+# How strongly a hit in each product field counts
+FIELD_WEIGHTS = {'name': 3, 'category': 2, 'description': 1}
+# How strongly each kind of term match counts
+EXACT, PREFIX, TYPO = 3, 2, 1
+
+MIN_PREFIX_LENGTH = 2
+MAX_PREFIX_TERMS = 64  # bounds the work for very short prefixes
+MIN_TYPO_LENGTH = 4    # shorter words get too many one-letter neighbours
+
+_TOKEN_RE = re.compile(r'\w+')
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens; 'ё' is folded into 'е'"""
+    return _TOKEN_RE.findall(text.lower().replace('ё', 'е'))
+
+
+def _deletes(term: str) -> Set[str]:
+    """All variants of ``term`` with one character removed"""
+    return {term[:i] + term[i + 1:] for i in range(len(term))}
+
+
+def _within_one_edit(a: str, b: str) -> bool:
+    """True if ``a`` and ``b`` differ by one insertion, deletion, substitution
+    or transposition of adjacent characters"""
+    if a == b:
+        return True
+    la, lb = len(a), len(b)
+    if abs(la - lb) > 1:
+        return False
+    i = 0
+    while i < min(la, lb) and a[i] == b[i]:
+        i += 1
+    if la == lb:
+        if a[i + 1:] == b[i + 1:]:
+            return True
+        return a[i + 1:i + 2] == b[i:i + 1] and a[i:i + 1] == b[i + 1:i + 2] and a[i + 2:] == b[i + 2:]
+    if la > lb:
+        return a[i + 1:] == b[i:]
+    return a[i:] == b[i + 1:]
+
+
+class SearchIndex:
+    """One version of the inverted index over product name, category and description.
+
+    ``postings`` maps a term to ``{product_id: field weight}``.  A query term
+    matches index terms exactly, by prefix (a binary search over the sorted
+    term list) and within one typo (a precomputed one-deletion neighbourhood,
+    so no scan over the vocabulary).  All query terms must match; products are
+    ranked by match quality times field weight.
+
+    Postings are also bucketed by field weight, so a one-word query walks the
+    buckets best score first and stops after ``limit`` products; longer
+    queries only score the candidates of their rarest word.
+
+    A published index is never modified.  ``updated()`` derives the next
+    version copy-on-write: only the containers of the terms that changed
+    are copied, everything else is shared with this version.
+    """
+
+    def __init__(self, base: Optional["SearchIndex"] = None):
+        if base is None:
+            self.postings: Dict[str, Dict[str, int]] = {}
+            self._by_weight: Dict[str, Dict[int, Dict[str, None]]] = {}
+            self._terms: List[str] = []
+            self._deletes: Dict[str, Set[str]] = {}
+            self.products: Dict[str, Dict[str, Any]] = {}
+            self._product_terms: Dict[str, Dict[str, int]] = {}
+        else:
+            self.postings = dict(base.postings)
+            self._by_weight = dict(base._by_weight)
+            self._terms = list(base._terms)
+            self._deletes = dict(base._deletes)
+            self.products = dict(base.products)
+            self._product_terms = dict(base._product_terms)
+        # Terms and deletion variants whose inner containers this version owns
+        self._own_terms: Set[str] = set()
+        self._own_variants: Set[str] = set()
+
+    # Building
+    @staticmethod
+    def _product_terms_of(product: Dict[str, Any]) -> Dict[str, int]:
+        terms: Dict[str, int] = {}
+        for field, weight in FIELD_WEIGHTS.items():
+            for term in tokenize(str(product.get(field, ''))):
+                if terms.get(term, 0) < weight:
+                    terms[term] = weight
+        return terms
+
+    def _own_term(self, term: str):
+        if term not in self._own_terms:
+            self._own_terms.add(term)
+            self.postings[term] = dict(self.postings[term])
+            self._by_weight[term] = {weight: dict(ids) for weight, ids in self._by_weight[term].items()}
+
+    def _own_variant(self, variant: str) -> Set[str]:
+        if variant not in self._own_variants:
+            self._own_variants.add(variant)
+            self._deletes[variant] = set(self._deletes.get(variant, ()))
+        return self._deletes[variant]
+
+    def _add_term(self, term: str):
+        insort(self._terms, term)
+        if len(term) >= MIN_TYPO_LENGTH:
+            for variant in _deletes(term):
+                self._own_variant(variant).add(term)
+
+    def _drop_term(self, term: str):
+        del self._terms[bisect_left(self._terms, term)]
+        if len(term) >= MIN_TYPO_LENGTH:
+            for variant in _deletes(term):
+                neighbours = self._own_variant(variant)
+                neighbours.discard(term)
+                if not neighbours:
+                    del self._deletes[variant]
+
+    def _index(self, product_id: str, product: Dict[str, Any]):
+        terms = self._product_terms_of(product)
+        for term, weight in terms.items():
+            if term in self.postings:
+                self._own_term(term)
+            else:
+                self.postings[term] = {}
+                self._by_weight[term] = {}
+                self._own_terms.add(term)
+                self._add_term(term)
+            self.postings[term][product_id] = weight
+            self._by_weight[term].setdefault(weight, {})[product_id] = None
+        self.products[product_id] = product
+        self._product_terms[product_id] = terms
+
+    def _unindex(self, product_id: str):
+        for term in self._product_terms.pop(product_id):
+            self._own_term(term)
+            posting = self.postings[term]
+            weight = posting.pop(product_id)
+            buckets = self._by_weight[term]
+            del buckets[weight][product_id]
+            if not buckets[weight]:
+                del buckets[weight]
+            if not posting:
+                del self.postings[term]
+                del self._by_weight[term]
+                self._drop_term(term)
+        del self.products[product_id]
+
+    def updated(self, products: Mapping[str, Dict[str, Any]]) -> Tuple["SearchIndex", int]:
+        """The index for ``products`` and how many products changed"""
+        index = SearchIndex(self)
+        changed = 0
+        for product_id in [pid for pid in self.products if pid not in products]:
+            index._unindex(product_id)
+            changed += 1
+        for product_id, product in products.items():
+            old = self.products.get(product_id)
+            if old is product or old == product:
+                continue
+            if old is not None:
+                index._unindex(product_id)
+            index._index(product_id, product)
+            changed += 1
+        return index, changed
+
+    # Querying
+    def _expansions(self, token: str) -> List[Tuple[int, str]]:
+        """(match quality, index term) pairs a query token matches"""
+        return [
+            (EXACT if term == token else PREFIX if term.startswith(token) else TYPO, term)
+            for term in self._expand(token)
+        ]
+
+    def _top_for_token(self, expansions: List[Tuple[int, str]], limit: int) -> List[str]:
+        levels = sorted(
+            ((quality * weight, term, weight) for quality, term in expansions for weight in self._by_weight[term]),
+            reverse=True
+        )
+        result: Dict[str, None] = {}
+        for _, term, weight in levels:
+            for product_id in self._by_weight[term][weight]:
+                result[product_id] = None
+                if len(result) >= limit:
+                    return list(result)
+        return list(result)
+
+    def _score(self, expansions: List[Tuple[int, str]], candidates: Optional[Dict[str, int]]) -> Dict[str, int]:
+        """Add one token's best score to each candidate, dropping those it misses"""
+        if candidates is None:
+            scores: Dict[str, int] = {}
+            for quality, term in expansions:
+                for product_id, weight in self.postings[term].items():
+                    if scores.get(product_id, 0) < quality * weight:
+                        scores[product_id] = quality * weight
+            return scores
+        postings = [(quality, self.postings[term]) for quality, term in expansions]
+        scores = {}
+        for product_id, score in candidates.items():
+            best = 0
+            for quality, posting in postings:
+                weight = posting.get(product_id)
+                if weight and quality * weight > best:
+                    best = quality * weight
+            if best:
+                scores[product_id] = score + best
+        return scores
+
+    def _expand(self, token: str) -> Set[str]:
+        terms = set()
+        if token in self.postings:
+            terms.add(token)
+        if len(token) >= MIN_PREFIX_LENGTH:
+            start = bisect_left(self._terms, token)
+            for term in self._terms[start:start + MAX_PREFIX_TERMS]:
+                if not term.startswith(token):
+                    break
+                terms.add(term)
+        if len(token) >= MIN_TYPO_LENGTH:
+            # A term within one edit is the token minus a letter, or shares
+            # a one-deletion variant with it
+            for variant in _deletes(token) | {token}:
+                if variant in self.postings:
+                    terms.add(variant)
+                for term in self._deletes.get(variant, ()):
+                    if term not in terms and _within_one_edit(token, term):
+                        terms.add(term)
+        return terms
+
+    def search(self, tokens: List[str], limit: int) -> Tuple[str, ...]:
+        expansions = [self._expansions(token) for token in dict.fromkeys(tokens)]
+        if len(expansions) == 1:
+            return tuple(self._top_for_token(expansions[0], limit))
+        # Rarest word first: it bounds the candidates every other word checks
+        expansions.sort(key=lambda pairs: sum(len(self.postings[term]) for _, term in pairs))
+        scores: Optional[Dict[str, int]] = None
+        for pairs in expansions:
+            scores = self._score(pairs, scores)
+            if not scores:
+                break
+        return tuple(heapq.nlargest(limit, scores, key=scores.get))
+
+
+class ProductSearch:
+    """Product search over the live catalog.
+
+    ``sync()`` builds the next ``SearchIndex`` from only the products that
+    changed since the last catalog version, off to the side, and swaps a
+    single reference, like ``CatalogManager`` does with ``CatalogIndex``.
+    Searches take ``index`` once and never wait for indexing.  Recent query
+    results are kept in a small LRU cache that belongs to the index version,
+    so it is dropped with it.
+    """
+
+    def __init__(self, cache_size: int = 1024):
+        self.version: Optional[int] = None
+        self.cache_size = cache_size
+        self.index = SearchIndex()
+        self._cache: "OrderedDict[Tuple[str, int], Tuple[str, ...]]" = OrderedDict()
+        self._sync_lock = threading.Lock()
+        self._cache_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def sync(self, products: Mapping[str, Dict[str, Any]], version: Optional[int] = None) -> int:
+        """Bring the index up to date with a catalog; returns how many products changed"""
+        with self._sync_lock:
+            index, changed = self.index.updated(products)
+            if changed:
+                with self._cache_lock:
+                    self.index, self._cache = index, OrderedDict()
+            self.version = version
+            return changed
+
+    def search(self, query: str, limit: int = 10) -> Tuple[str, ...]:
+        """Ids of the best matching products, best first"""
+        tokens = tokenize(query)
+        if not tokens:
+            return ()
+        key = (' '.join(tokens), limit)
+        with self._cache_lock:
+            index, cache = self.index, self._cache
+            cached = cache.get(key)
+            if cached is not None:
+                cache.move_to_end(key)
+                self.hits += 1
+                return cached
+            self.misses += 1
+
+        result = index.search(tokens, limit)
+        with self._cache_lock:
+            cache[key] = result
+            if len(cache) > self.cache_size:
+                cache.popitem(last=False)
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        index = self.index
+        return {
+            'products': len(index.products),
+            'terms': len(index.postings),
+            'hits': self.hits,
+            'misses': self.misses
+        }
+
+
+def _synthetic_catalog(count: int) -> Dict[str, Dict[str, Any]]:
+    rng = random.Random(42)
+    words = ['беспроводные', 'наушники', 'часы', 'зарядка', 'кабель', 'чехол', 'премиум', 'качество',
+             'шумоподавление', 'быстрое', 'подключение', 'влагозащита', 'экран', 'ремешок', 'звук']
+    brands = ['airpods', 'watch', 'dyson', 'casio', 'block', 'magsafe', 'dualsock', 'galaxy', 'xiaomi']
+    categories = ['Наушники', 'Часы', 'Аксессуары', 'Другое']
+    return {
+        f'item_{i}': {
+            'name': f"{rng.choice(brands).title()} {rng.choice(words)} {i}",
+            'price': rng.randint(10, 500),
+            'category': rng.choice(categories),
+            'description': ' '.join(rng.choice(words) for _ in range(12))
+        }
+        for i in range(count)
+    }
+
+
+# Example usage:
+#   python product_search.py [products] [queries]
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    catalog = _synthetic_catalog(count)
+
+    search = ProductSearch(cache_size=0)
+    started = time.perf_counter()
+    search.sync(catalog, version=1)
+    print(f"Indexed {count} products in {(time.perf_counter() - started) * 1000:.0f} ms: {search.stats()}")
+
+    catalog['item_0'] = dict(catalog['item_0'], name='Casio Vintage Gold')
+    started = time.perf_counter()
+    changed = search.sync(catalog, version=2)
+    print(f"Incremental sync of {changed} product: {(time.perf_counter() - started) * 1000:.2f} ms")
+
+    queries = ['airpods 42', 'наушн', 'шумоподавлние', 'casio vintage', 'dualsock звук', 'galaxy', 'xiaomi 9999']
+    for query in queries:
+        started = time.perf_counter()
+        for _ in range(rounds):
+            result = search.search(query)
+        elapsed = (time.perf_counter() - started) / rounds * 1000
+        print(f"{query!r:>20}: {elapsed:.3f} ms uncached, {len(result)} results")
+
+    search.cache_size = 1024
+    search.search('наушн')
+    started = time.perf_counter()
+    for _ in range(rounds):
+        search.search('наушн')
+    print(f"{'наушн'!r:>20}: {(time.perf_counter() - started) / rounds * 1000:.4f} ms cached")
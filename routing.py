@@ -0,0 +1,108 @@
+import sys
+import time
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Mapping
+
+from telegram import Chat, Message, Update, User
+from telegram.ext import BaseHandler, CallbackQueryHandler, ContextTypes, MessageHandler, filters
+
+from callback_codec import CallbackData, decode_callback
+
+HandlerCallback = Callable[[Update, ContextTypes.DEFAULT_TYPE], Awaitable[Any]]
+CallbackHandlerCallback = Callable[[Update, ContextTypes.DEFAULT_TYPE, CallbackData], Awaitable[Any]]
+
+
+class TextRouter:
+    """Routes a state's text messages to handlers by exact button text.
+
+    One ``MessageHandler`` per conversation state replaces a chain of
+    ``filters.Regex`` handlers: the conversation checks a single cheap filter
+    and the router finds the handler with one dict lookup.  Anything that is
+    not a known button goes to ``fallback``.  Build routers once at startup.
+    """
+
+    __slots__ = ('routes', 'fallback')
+
+    def __init__(self, routes: Mapping[str, HandlerCallback], fallback: HandlerCallback):
+        self.routes: Dict[str, HandlerCallback] = dict(routes)
+        self.fallback = fallback
+
+    def resolve(self, text: str) -> HandlerCallback:
+        return self.routes.get(text, self.fallback)
+
+    async def __call__(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        return await self.routes.get(update.message.text, self.fallback)(update, context)
+
+    def handler(self) -> MessageHandler:
+        """The single handler to put in a ConversationHandler state"""
+        return MessageHandler(filters.TEXT & ~filters.COMMAND, self)
+
+
+class CallbackRouter:
+    """Routes inline button presses by the action in their callback_data.
+
+    The payload is decoded once (see callback_codec) and handed to the
+    handler as a third argument: ``handler(update, context, data)``.  Buttons
+    with an unknown action or foreign payload are answered and dropped, so no
+    per-action ``pattern`` regexes are needed.
+    """
+
+    __slots__ = ('routes',)
+
+    def __init__(self, routes: Mapping[str, CallbackHandlerCallback]):
+        self.routes: Dict[str, CallbackHandlerCallback] = dict(routes)
+
+    async def __call__(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        data = decode_callback(update.callback_query.data)
+        handler = self.routes.get(data.action) if data else None
+        if handler is None:
+            await update.callback_query.answer()
+            return None
+        return await handler(update, context, data)
+
+    def handler(self) -> CallbackQueryHandler:
+        """The single callback handler to put in a ConversationHandler state"""
+        return CallbackQueryHandler(self)
+
+
+def _first_match(handlers: List[BaseHandler], update: Update):
+    """What ConversationHandler does for a state: check handlers in order"""
+    for handler in handlers:
+        check = handler.check_update(update)
+        if check is not None and check is not False:
+            return handler
+    return None
+
+
+# Example usage:
+#   python routing.py [rounds]
+if __name__ == "__main__":
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+    async def _noop(update, context):
+        return None
+
+    buttons = ["🛍 Каталог", "🎁 Бонусная программа", "📦 Мои заказы",
+               "❓ FAQ", "🚚 Доставка", "🔄 Перезапустить бота"]
+    chain = [MessageHandler(filters.Regex(f"^{text}$"), _noop) for text in buttons]
+    chain.append(MessageHandler(filters.TEXT & ~filters.COMMAND, _noop))
+    router = TextRouter({text: _noop for text in buttons}, _noop)
+    routed = [router.handler()]
+
+    chat = Chat(1, Chat.PRIVATE)
+    user = User(1, 'Bench', False)
+    updates = [
+        Update(i, message=Message(i, datetime.now(), chat, from_user=user, text=text))
+        for i, text in enumerate(buttons + ["случайный текст"])
+    ]
+
+    for name, dispatch in (
+        ("regex chain", lambda update: _first_match(chain, update)),
+        ("text router", lambda update: _first_match(routed, update) and router.resolve(update.message.text))
+    ):
+        started = time.perf_counter()
+        for _ in range(rounds // len(updates)):
+            for update in updates:
+                dispatch(update)
+        elapsed = time.perf_counter() - started
+        print(f"{name}: {elapsed / (rounds // len(updates) * len(updates)) * 1e6:.2f} us per update")
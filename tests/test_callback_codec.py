@@ -0,0 +1,51 @@
+import pytest
+
+from callback_codec import (
+    MAX_BYTES, CallbackData, decode_callback, encode_callback, pack_order_id, unpack_order_id
+)
+
+
+@pytest.mark.parametrize('order_id', [
+    'ORDER_20241231_235959_7100115774',
+    'ORDER_20240101_000000_1',
+    'custom-order-id',
+    ''
+])
+def test_order_id_round_trip(order_id):
+    assert unpack_order_id(pack_order_id(order_id)) == order_id
+
+
+def test_regular_order_ids_are_packed():
+    order_id = 'ORDER_20241231_235959_7100115774'
+    assert len(pack_order_id(order_id)) < len(order_id) / 2 + 2
+
+
+@pytest.mark.parametrize('action, order_id, page', [
+    ('track', 'ORDER_20241231_235959_7100115774', 0),
+    ('orders_page', '', 3),
+    ('admin_back', '', 0),
+    ('track', 'legacy_id', 12)
+])
+def test_callback_round_trip(action, order_id, page):
+    data = encode_callback(action, order_id, page)
+    assert len(data.encode('utf-8')) <= MAX_BYTES
+    assert decode_callback(data) == CallbackData(action, order_id, page)
+
+
+def test_encode_rejects_bad_payloads():
+    with pytest.raises(ValueError):
+        encode_callback('a:b')
+    with pytest.raises(ValueError):
+        encode_callback('track', 'x' * MAX_BYTES)
+
+
+@pytest.mark.parametrize('data, expected', [
+    ('track|7100115774', CallbackData('track', user_id=7100115774)),
+    ('admin_stats', CallbackData('admin_stats')),
+    ('track|not-a-number', None),
+    ('something else', None),
+    ('1:track:x:', None),
+    (None, None)
+])
+def test_decode_legacy_and_foreign_payloads(data, expected):
+    assert decode_callback(data) == expected
@@ -0,0 +1,71 @@
+import os
+
+from loyalty_ledger import LoyaltyEventLog, LoyaltyLedger, _ledger_files, verify_files
+from write_behind import WriteBehindFile
+
+
+def _open(path, snapshot_every=5) -> LoyaltyLedger:
+    events_file, snapshot_file = _ledger_files(str(path))
+    return LoyaltyLedger(
+        WriteBehindFile(str(path), write_behind=False),
+        events=LoyaltyEventLog(events_file, fsync=False),
+        snapshot_file=snapshot_file,
+        snapshot_every=snapshot_every
+    )
+
+
+def _fill(path) -> LoyaltyLedger:
+    ledger = _open(path)
+    for i in range(12):
+        ledger.credit(str(i % 3), 10, spent=100, orders=1)
+    ledger.debit_if_sufficient('1', 15)
+    ledger.flush()
+    return ledger
+
+
+def test_restart_replays_snapshot_tail(tmp_path):
+    _fill(tmp_path / 'loyalty.json').close()
+    ledger = _open(tmp_path / 'loyalty.json')
+    assert ledger.events.seq == 13
+    assert ledger.get('1') == {'points': 25, 'total_spent': 400, 'orders': 4}
+    assert ledger.verify() == {'snapshot': {}, 'current': {}}
+    ledger.close()
+
+
+def test_corrupt_event_is_skipped(tmp_path):
+    _fill(tmp_path / 'loyalty.json').close()
+    events_file, snapshot_file = _ledger_files(str(tmp_path / 'loyalty.json'))
+    with open(events_file, 'a', encoding='utf-8') as f:
+        f.write('{"seq": 14, "user_id": \n')
+    os.remove(snapshot_file)
+
+    ledger = _open(tmp_path / 'loyalty.json')
+    assert ledger.events.seq == 13
+    assert ledger.get('0')['points'] == 40
+    ledger.close()
+
+
+def test_verify_files_is_read_only(tmp_path):
+    _fill(tmp_path / 'loyalty.json').close()
+    events_file, _ = _ledger_files(str(tmp_path / 'loyalty.json'))
+    with open(events_file, 'a', encoding='utf-8') as f:
+        f.write('{"seq": 14, "user_id"')  # an append still in progress
+    files = {name: (tmp_path / name).read_bytes() for name in os.listdir(tmp_path)}
+
+    assert verify_files(str(tmp_path / 'loyalty.json')) == {'snapshot': {}, 'current': {}}
+    assert {name: (tmp_path / name).read_bytes() for name in os.listdir(tmp_path)} == files
+
+
+def test_torn_tail_is_truncated_on_open(tmp_path):
+    _fill(tmp_path / 'loyalty.json').close()
+    events_file, _ = _ledger_files(str(tmp_path / 'loyalty.json'))
+    size = os.path.getsize(events_file)
+    with open(events_file, 'a', encoding='utf-8') as f:
+        f.write('{"seq": 14')
+
+    ledger = _open(tmp_path / 'loyalty.json')
+    assert os.path.getsize(events_file) == size == ledger.events.size
+    ledger.credit('5', 1)
+    ledger.flush()
+    assert ledger.verify() == {'snapshot': {}, 'current': {}}
+    ledger.close()
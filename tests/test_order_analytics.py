@@ -0,0 +1,123 @@
+import time
+import random
+from datetime import date, datetime, timedelta
+
+import pytest
+
+from order_analytics import SalesAnalytics, format_report
+from order_record import Order
+
+SINCE, UNTIL = date(2024, 3, 1), date(2024, 4, 30)
+
+
+@pytest.fixture
+def berlin_time(monkeypatch):
+    """Local time with a DST change inside the report window (2024-03-31)"""
+    monkeypatch.setenv('TZ', 'Europe/Berlin')
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+
+def _orders(count: int):
+    rng = random.Random(7)
+    start = int(datetime(2024, 1, 1).timestamp())
+    end = int(datetime(2024, 5, 31).timestamp())
+    return [
+        (f"ORDER_{i}", Order(
+            user_id=rng.randint(1, 200),
+            product_name=rng.choice(['Часы', 'Наушники', 'Кабель']),
+            quantity=rng.randint(1, 3),
+            final_price=rng.randint(10, 500),
+            delivery_method=rng.choice(['shuttle', 'pickup']),
+            points_used=rng.choice((0, 0, 50)),
+            created_at=rng.randint(start, end)
+        ))
+        for i in range(count)
+    ]
+
+
+def _in_window(orders):
+    return [order for _, order in orders if SINCE <= order.created.date() <= UNTIL]
+
+
+def _window_start() -> int:
+    return int(datetime.combine(SINCE, datetime.min.time()).timestamp())
+
+
+def test_report_matches_a_scan(berlin_time):
+    orders = _orders(5000)
+    # Orders just after local midnight on both sides of the DST change
+    for day in (date(2024, 3, 31), date(2024, 4, 1)):
+        orders.append((f"MIDNIGHT_{day}", Order(
+            user_id=1, product_name='Часы', quantity=1, final_price=5,
+            created_at=int(datetime(day.year, day.month, day.day, 0, 15).timestamp())
+        )))
+    analytics = SalesAnalytics()
+    analytics.load(orders)
+    report = analytics.report(SINCE, UNTIL)
+    window = _in_window(orders)
+
+    assert report['orders'] == len(window)
+    assert report['revenue'] == sum(order.final_price for order in window)
+
+    daily = {}
+    for order in window:
+        day = order.created.date()
+        daily[day] = daily.get(day, 0) + 1
+    assert {day: count for day, count, _ in report['daily'] if count} == daily
+
+    weekly = {}
+    for order in window:
+        day = order.created.date()
+        monday = day - timedelta(days=day.weekday())
+        weekly[monday] = weekly.get(monday, 0) + order.final_price
+    assert {week: revenue for week, _, revenue in report['weekly'] if revenue} == weekly
+
+    products = {}
+    for order in window:
+        products[order.product_name] = products.get(order.product_name, 0) + order.final_price
+    assert {name: revenue for name, revenue, _, _ in report['products']} == products
+    assert [revenue for _, revenue, _, _ in report['products']] == sorted(products.values(), reverse=True)
+
+    first_order = {}
+    for _, order in orders:
+        first_order[order.user_id] = min(first_order.get(order.user_id, order.created_at), order.created_at)
+    customers = {order.user_id for order in window}
+    returning = {user_id for user_id in customers if first_order[user_id] < _window_start()}
+    assert report['customers'] == len(customers)
+    assert report['returning_customers'] == len(returning)
+    cohorts = {}
+    for user_id, first in first_order.items():
+        day = datetime.fromtimestamp(first).date()
+        if SINCE <= day <= UNTIL:
+            cohorts[f"{day:%Y-%m}"] = cohorts.get(f"{day:%Y-%m}", 0) + 1
+    assert {month: size for month, size, _, _ in report['cohorts']} == cohorts
+
+    assert report['points_orders'] == sum(1 for order in window if order.points_used)
+    assert '📈 Аналитика 01.03.2024 — 30.04.2024' in format_report(report)
+
+
+def test_put_adds_and_overwrites_rows():
+    orders = _orders(1500)
+    analytics = SalesAnalytics()
+    analytics.load(orders[:1000])
+    for order_id, order in orders[1000:]:
+        analytics.put(order_id, order)
+    order_id, order = orders[0]
+    changed = order.updated({'final_price': order.final_price + 1000})
+    analytics.put(order_id, changed)
+
+    expected = _in_window([(order_id, changed)] + orders[1:])
+    report = analytics.report(SINCE, UNTIL)
+    assert report['orders'] == len(expected)
+    assert report['revenue'] == sum(order.final_price for order in expected)
+
+
+def test_load_replaces_the_history():
+    analytics = SalesAnalytics()
+    analytics.load(_orders(1000))
+    analytics.load(_orders(10))
+    assert analytics.size == 10
+    assert analytics.report(SINCE, UNTIL)['orders'] == len(_in_window(_orders(10)))
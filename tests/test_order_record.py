@@ -0,0 +1,63 @@
+from datetime import datetime
+
+from order_record import ORDER_TIME_FORMAT, SCHEMA_VERSION, Order
+from order_store import OrderJournal, upgrade_journal
+
+V1_RECORD = {
+    'user_id': 7100115774,
+    'username': '@buyer',
+    'product_id': 'watch_9',
+    'product_name': 'Apple Watch 9',
+    'quantity': 2,
+    'final_sum': 130,
+    'delivery_method': 'shuttle',
+    'timestamp': '2024-03-30 12:00:00',  # not in a DST gap, so it round-trips in any TZ
+    'delivered': True,
+    'gift_wrap': 'yes'
+}
+
+
+def test_v1_record_is_migrated():
+    order = Order.from_dict(V1_RECORD)
+    assert order.user_id == '7100115774'
+    assert order.final_price == 130
+    assert order.created_at == int(datetime.strptime(V1_RECORD['timestamp'], ORDER_TIME_FORMAT).timestamp())
+    assert order.timestamp == V1_RECORD['timestamp']
+    assert order.delivered is True
+    assert order.extra == {'gift_wrap': 'yes'}
+
+    data = order.to_dict()
+    assert data['v'] == SCHEMA_VERSION
+    assert 'final_sum' not in data and 'timestamp' not in data
+
+
+def test_final_price_wins_over_final_sum():
+    order = Order.from_dict(dict(V1_RECORD, final_price=120))
+    assert order.final_price == 120
+
+
+def test_current_record_round_trip():
+    order = Order.from_dict(V1_RECORD)
+    assert Order.from_dict(order.to_dict()) == order
+    # Current records are not migrated again: their user_id stays as stored
+    assert Order.from_dict({'v': SCHEMA_VERSION, 'user_id': '42'}).user_id == '42'
+
+
+def test_updated_keeps_the_original():
+    order = Order.from_dict(V1_RECORD)
+    changed = order.updated({'tracking_code': 'RB123', 'note': 'call first'})
+    assert changed.tracking_code == 'RB123'
+    assert changed.extra['note'] == 'call first'
+    assert order.tracking_code is None and 'note' not in order.extra
+
+
+def test_upgrade_journal_rewrites_old_records(tmp_path):
+    journal = OrderJournal(str(tmp_path / 'orders.json'), fsync=False)
+    journal.put('ORDER_1', V1_RECORD)
+    journal.put('ORDER_2', Order(user_id=1, created_at=1000).to_dict())
+
+    assert upgrade_journal(journal) == 1
+    orders = OrderJournal(str(tmp_path / 'orders.json')).load()
+    assert {order['v'] for order in orders.values()} == {SCHEMA_VERSION}
+    assert Order.from_dict(orders['ORDER_1']) == Order.from_dict(V1_RECORD)
+    assert upgrade_journal(OrderJournal(str(tmp_path / 'orders.json'), fsync=False)) == 0
@@ -0,0 +1,95 @@
+import time
+import random
+from datetime import date, datetime, timedelta
+
+import pytest
+
+from order_record import Order
+from order_stats import OrderStats
+
+TODAY = date(2024, 3, 31)  # a 23-hour day: DST starts in Europe/Berlin
+
+
+@pytest.fixture(autouse=True)
+def berlin_time(monkeypatch):
+    """Local time with a DST change on TODAY, so day buckets span it"""
+    monkeypatch.setenv('TZ', 'Europe/Berlin')
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+
+def _at(day: date, hour: int = 12) -> int:
+    return int(datetime(day.year, day.month, day.day, hour).timestamp())
+
+
+def _random_orders(count: int, days: int = 30):
+    rng = random.Random(42)
+    return [
+        Order(
+            user_id=rng.randint(1, 50),
+            final_price=rng.randint(10, 500),
+            delivered=rng.random() < 0.7,
+            created_at=_at(TODAY - timedelta(days=rng.randint(0, days - 1)), rng.randint(0, 23))
+        )
+        for _ in range(count)
+    ]
+
+
+def test_window_totals_match_a_scan():
+    orders = _random_orders(2000)
+    stats = OrderStats()
+    for order in orders:
+        stats.add(order)
+
+    since = TODAY - timedelta(days=6)
+    in_window = [order for order in orders if since <= order.created.date() <= TODAY]
+    totals = stats.last_days(7, today=TODAY)
+    assert totals['total_orders'] == len(in_window)
+    assert totals['total_sum'] == sum(order.final_price for order in in_window)
+    assert totals['completed'] == sum(order.delivered for order in in_window)
+    assert totals['in_progress'] == totals['total_orders'] - totals['completed']
+    assert totals['customers'] == len({order.user_id for order in in_window})
+
+
+def test_top_clients_follow_changes():
+    orders = _random_orders(2000)
+    stats = OrderStats()
+    for order in orders:
+        stats.add(order)
+    # Status changes are a remove plus an add; removed orders leave the totals
+    for order in orders[:200]:
+        stats.remove(order)
+        stats.add(order.updated({'delivered': True}))
+    for order in orders[200:300]:
+        stats.remove(order)
+
+    cutoff = TODAY - timedelta(days=6)
+    expected = {}
+    for order in orders[:200] + orders[300:]:
+        if order.created.date() >= cutoff:
+            expected[order.user_id] = expected.get(order.user_id, 0) + order.final_price
+    top = stats.top_clients(3, today=TODAY)
+    assert [total for _, total in top] == sorted(expected.values(), reverse=True)[:3]
+    assert all(expected[user_id] == total for user_id, total in top)
+
+
+def test_window_rolls_with_the_day():
+    stats = OrderStats(window_days=2)
+    stats.add(Order(user_id=1, final_price=100, created_at=_at(TODAY - timedelta(days=2))))
+    stats.add(Order(user_id=2, final_price=50, created_at=_at(TODAY)))
+    assert stats.top_clients(3, today=TODAY - timedelta(days=1)) == [('1', 100)]
+    assert stats.top_clients(3, today=TODAY) == [('2', 50)]
+
+
+def test_clear_resets_top_clients():
+    stats = OrderStats()
+    stats.add(Order(user_id=1, final_price=100, created_at=_at(TODAY)))
+    assert stats.top_clients(3, today=TODAY) == [('1', 100)]
+
+    stats.clear()
+    assert stats.top_clients(3, today=TODAY) == []
+    stats.add(Order(user_id=1, final_price=30, created_at=_at(TODAY)))
+    assert stats.top_clients(3, today=TODAY) == [('1', 30)]
+    assert stats.last_days(1, today=TODAY)['total_sum'] == 30
@@ -0,0 +1,78 @@
+import os
+
+from order_record import Order
+from order_store import OrderJournal, JournalOrderStore, SqliteOrderStore
+
+
+def _order(user_id: int, created_at: int, **fields) -> Order:
+    return Order(user_id=user_id, product_name='Часы', quantity=1, final_price=100,
+                 created_at=created_at, **fields)
+
+
+def test_journal_replays_snapshot_and_tail(tmp_path):
+    journal = OrderJournal(str(tmp_path / 'orders.json'), compact_every=3, fsync=False)
+    for i in range(4):
+        journal.put(f'ORDER_{i}', {'user_id': str(i)})
+    journal.update('ORDER_3', {'delivered': True})
+
+    # Three records went into the snapshot, the rest are still in the journal
+    assert os.path.getsize(journal.journal_file) > 0
+    orders = OrderJournal(str(tmp_path / 'orders.json')).load()
+    assert sorted(orders) == ['ORDER_0', 'ORDER_1', 'ORDER_2', 'ORDER_3']
+    assert orders['ORDER_3'] == {'user_id': '3', 'delivered': True}
+
+
+def test_journal_truncates_torn_tail(tmp_path):
+    journal = OrderJournal(str(tmp_path / 'orders.json'), fsync=False)
+    journal.put('ORDER_1', {'user_id': '1'})
+    good_size = os.path.getsize(journal.journal_file)
+    with open(journal.journal_file, 'a', encoding='utf-8') as f:
+        f.write('{"op":"put","id":"ORDER_2","ord')
+
+    orders = OrderJournal(str(tmp_path / 'orders.json')).load()
+    assert list(orders) == ['ORDER_1']
+    assert os.path.getsize(journal.journal_file) == good_size
+
+    # Appends after the repair start on a clean line
+    recovered = OrderJournal(str(tmp_path / 'orders.json'), fsync=False)
+    recovered.put('ORDER_3', {'user_id': '3'})
+    assert sorted(OrderJournal(str(tmp_path / 'orders.json')).load()) == ['ORDER_1', 'ORDER_3']
+
+
+def test_read_only_journal_keeps_torn_tail(tmp_path):
+    journal = OrderJournal(str(tmp_path / 'orders.json'), fsync=False)
+    journal.put('ORDER_1', {'user_id': '1'})
+    with open(journal.journal_file, 'a', encoding='utf-8') as f:
+        f.write('{"op":"put"')
+    size = os.path.getsize(journal.journal_file)
+
+    orders = OrderJournal(str(tmp_path / 'orders.json'), read_only=True).load()
+    assert list(orders) == ['ORDER_1']
+    assert os.path.getsize(journal.journal_file) == size
+
+
+def test_journal_store_keeps_orders_current(tmp_path):
+    store = JournalOrderStore(OrderJournal(str(tmp_path / 'orders.json'), fsync=False))
+    store.put('ORDER_1', _order(1, 1000))
+    store.update('ORDER_1', {'tracking_code': 'RB123'})
+    assert store.get('ORDER_1').tracking_code == 'RB123'
+
+    # Another process appends to the same files
+    other = JournalOrderStore(OrderJournal(str(tmp_path / 'orders.json'), fsync=False))
+    other.put('ORDER_2', _order(2, 2000))
+    assert store.get('ORDER_2') is None
+    store.invalidate()
+    assert store.get('ORDER_2') == _order(2, 2000)
+
+
+def test_sqlite_store_time_range(tmp_path):
+    store = SqliteOrderStore(str(tmp_path / 'orders.db'))
+    try:
+        for i in range(5):
+            store.put(f'ORDER_{i}', _order(i, 1000 + i * 100))
+        since, until = _order(0, 1100).created, _order(0, 1400).created
+        assert [order_id for order_id, _ in store.iter_orders(since, until)] == ['ORDER_3', 'ORDER_2', 'ORDER_1']
+        assert store.count(since, until) == 3
+        assert store.count() == 5
+    finally:
+        store.close()
@@ -0,0 +1,212 @@
+import os
+import json
+import logging
+from bisect import bisect_left, insort
+from datetime import datetime
+from typing import Dict, Any, Iterable, List, Optional, Set, Tuple
+
+from order_record import Order
+from write_behind import WriteBehindFile
+
+USER_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Segment names accepted by UserRegistry.segment()
+ALL = 'all'
+ORDERED = 'ordered'
+NOT_ORDERED = 'not_ordered'
+NEW = 'new'
+ACTIVE = 'active'
+BLOCKED = 'blocked'
+
+
+class UserRegistry:
+    """Everyone who talked to the bot, with per-user flags.
+
+    Records live in users.json as ``{user_id: {"first_seen", "last_seen",
+    "blocked", "has_ordered", "username"}}`` and are written back in batches
+    by a WriteBehindFile.  Segment queries are answered from in-memory
+    indexes that every update maintains incrementally:
+    * sets of blocked and ordering users;
+    * ``(first_seen, user_id)`` and ``(last_seen, user_id)`` lists kept
+      sorted, so "new/active since" is a binary search.
+
+    The old users.json was a plain list of ids; it is converted on load.
+    ``<name>_meta.json`` next to it records when customers known only from
+    orders were imported, so that happens once.
+    """
+
+    def __init__(self, path: str = 'users.json', **store_options):
+        self.store = WriteBehindFile(path, **store_options)
+        self.meta_file = f"{os.path.splitext(path)[0]}_meta.json"
+        self.meta = self._load_meta()
+        # True until the users known only from orders are imported (see import_orders)
+        self.needs_import = not self.meta.get('imported_orders')
+        if not isinstance(self.store.data, dict):
+            now = datetime.now().strftime(USER_TIME_FORMAT)
+            logging.info(f"Converting {path} from a user id list to the user registry")
+            self.store.data = {str(user_id): self._new_record(now) for user_id in self.store.data}
+            self.store.mark_dirty()
+        self._blocked: Set[str] = set()
+        self._ordered: Set[str] = set()
+        self._by_first_seen: List[Tuple[str, str]] = []
+        self._by_last_seen: List[Tuple[str, str]] = []
+        for user_id, record in self.store.data.items():
+            self._index(user_id, record)
+        self._by_first_seen.sort()
+        self._by_last_seen.sort()
+
+    def _load_meta(self) -> Dict[str, Any]:
+        try:
+            with open(self.meta_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def _set_meta(self, key: str, value: Any):
+        self.meta[key] = value
+        tmp_file = f"{self.meta_file}.tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(self.meta, f, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.meta_file)
+
+    @staticmethod
+    def _new_record(now: str) -> Dict[str, Any]:
+        return {"first_seen": now, "last_seen": now, "blocked": False, "has_ordered": False}
+
+    def _index(self, user_id: str, record: Dict[str, Any]):
+        if record.get("blocked"):
+            self._blocked.add(user_id)
+        if record.get("has_ordered"):
+            self._ordered.add(user_id)
+        self._by_first_seen.append((record["first_seen"], user_id))
+        self._by_last_seen.append((record["last_seen"], user_id))
+
+    def _set_last_seen(self, user_id: str, record: Dict[str, Any], now: str):
+        old = (record["last_seen"], user_id)
+        position = bisect_left(self._by_last_seen, old)
+        if position < len(self._by_last_seen) and self._by_last_seen[position] == old:
+            del self._by_last_seen[position]
+        record["last_seen"] = now
+        insort(self._by_last_seen, (now, user_id))
+
+    def _get_or_create(self, user_id: str, now: str) -> Dict[str, Any]:
+        record = self.store.data.get(user_id)
+        if record is None:
+            record = self.store.data[user_id] = self._new_record(now)
+            # New users are (almost always) the newest, so these inserts append
+            insort(self._by_first_seen, (now, user_id))
+            insort(self._by_last_seen, (now, user_id))
+        return record
+
+    # Updates
+    def touch(self, user_id, username: Optional[str] = None, when: Optional[datetime] = None) -> Dict[str, Any]:
+        """Register a visit: creates the user, refreshes last_seen, clears 'blocked'"""
+        user_id = str(user_id)
+        now = (when or datetime.now()).strftime(USER_TIME_FORMAT)
+        with self.store.lock:
+            record = self._get_or_create(user_id, now)
+            if record["last_seen"] < now:
+                self._set_last_seen(user_id, record, now)
+            if record.get("blocked"):
+                record["blocked"] = False
+                self._blocked.discard(user_id)
+            if username and record.get("username") != username:
+                record["username"] = username
+            self.store.mark_dirty(user_id)
+            return dict(record)
+
+    def mark_ordered(self, user_id):
+        user_id = str(user_id)
+        with self.store.lock:
+            record = self._get_or_create(user_id, datetime.now().strftime(USER_TIME_FORMAT))
+            if not record.get("has_ordered"):
+                record["has_ordered"] = True
+                self._ordered.add(user_id)
+                self.store.mark_dirty(user_id)
+
+    def set_blocked(self, user_id, blocked: bool = True):
+        """Called when Telegram reports that the user blocked the bot"""
+        user_id = str(user_id)
+        with self.store.lock:
+            record = self.store.data.get(user_id)
+            if record is None or bool(record.get("blocked")) == blocked:
+                return
+            record["blocked"] = blocked
+            if blocked:
+                self._blocked.add(user_id)
+            else:
+                self._blocked.discard(user_id)
+            self.store.mark_dirty(user_id)
+
+    def import_orders(self, orders: Iterable[Order]) -> int:
+        """Add customers known only from orders; returns how many were added"""
+        added = 0
+        with self.store.lock:
+            for order in orders:
+                user_id = order.user_id
+                if not user_id or not order.created_at:
+                    continue
+                timestamp = order.created.strftime(USER_TIME_FORMAT)
+                if user_id not in self.store.data:
+                    added += 1
+                record = self._get_or_create(user_id, timestamp)
+                if timestamp < record["first_seen"]:
+                    self._by_first_seen.remove((record["first_seen"], user_id))
+                    record["first_seen"] = timestamp
+                    insort(self._by_first_seen, (timestamp, user_id))
+                if record["last_seen"] < timestamp:
+                    self._set_last_seen(user_id, record, timestamp)
+                record["has_ordered"] = True
+                self._ordered.add(user_id)
+            self.needs_import = False
+            self.store.mark_dirty()
+        # The marker goes down only after the imported users did
+        self.store.flush()
+        self._set_meta('imported_orders', datetime.now().strftime(USER_TIME_FORMAT))
+        return added
+
+    # Queries
+    def get(self, user_id) -> Optional[Dict[str, Any]]:
+        with self.store.lock:
+            record = self.store.data.get(str(user_id))
+            return dict(record) if record is not None else None
+
+    def _since(self, index: List[Tuple[str, str]], since: datetime) -> List[str]:
+        position = bisect_left(index, (since.strftime(USER_TIME_FORMAT), ''))
+        return [user_id for _, user_id in index[position:]]
+
+    def new_users(self, since: datetime) -> List[str]:
+        """Users first seen at or after ``since``, oldest first"""
+        with self.store.lock:
+            return self._since(self._by_first_seen, since)
+
+    def segment(self, name: str = ALL, since: Optional[datetime] = None) -> List[str]:
+        """User ids of a broadcast segment; blocked users are left out
+        (except in the 'blocked' segment itself)"""
+        with self.store.lock:
+            if name == BLOCKED:
+                return sorted(self._blocked)
+            if name == ALL:
+                users = self.store.data.keys() - self._blocked
+            elif name == ORDERED:
+                users = self._ordered - self._blocked
+            elif name == NOT_ORDERED:
+                users = self.store.data.keys() - self._ordered - self._blocked
+            elif name == NEW:
+                users = set(self._since(self._by_first_seen, since)) - self._blocked
+            elif name == ACTIVE:
+                users = set(self._since(self._by_last_seen, since)) - self._blocked
+            else:
+                raise ValueError(f"Unknown user segment: {name}")
+            return sorted(users)
+
+    def __len__(self) -> int:
+        return len(self.store.data)
+
+    def flush(self):
+        self.store.flush()
+
+    def close(self):
+        self.store.close()
@@ -0,0 +1,194 @@
+"""Local webhook harness: measures end-to-end handler latency without Telegram.
+
+Starts a fake Bot API server, runs bot.py in webhook mode against it (in a
+temporary directory, so real data files are untouched) and POSTs synthetic
+updates to the webhook.  Latency is the time from POSTing an update until the
+bot's reply (sendMessage / editMessageText) reaches the fake API.
+
+    python webhook_harness.py --users 50 --texts "/start" "🛍 Каталог"
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+import urllib.error
+import urllib.request
+from urllib.parse import parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict, List
+
+BOT_TOKEN = '123456:HARNESS'
+SECRET = 'harness-secret'
+REPLY_METHODS = {'sendMessage', 'editMessageText', 'sendDocument'}
+
+_replies: Dict[int, List[float]] = {}
+_replies_cond = threading.Condition()
+
+
+class FakeBotApi(BaseHTTPRequestHandler):
+    """Answers Bot API calls with minimal valid results and records replies"""
+
+    def log_message(self, format, *args):
+        pass
+
+    def _params(self) -> dict:
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0) or 0))
+        content_type = self.headers.get('Content-Type', '')
+        if 'json' in content_type:
+            return json.loads(body or b'{}')
+        if 'urlencoded' in content_type:
+            return {key: values[0] for key, values in parse_qs(body.decode()).items()}
+        return {}
+
+    def do_POST(self):
+        method = self.path.rsplit('/', 1)[-1]
+        params = self._params()
+        chat_id = int(params.get('chat_id', 0) or 0)
+        now = int(time.time())
+
+        if method == 'getMe':
+            result = {'id': 1, 'is_bot': True, 'first_name': 'Harness', 'username': 'harness_bot',
+                      'can_join_groups': True, 'can_read_all_group_messages': False,
+                      'supports_inline_queries': True}
+        elif method in REPLY_METHODS:
+            result = {'message_id': now, 'date': now, 'chat': {'id': chat_id, 'type': 'private'},
+                      'text': params.get('text', '')}
+            with _replies_cond:
+                _replies.setdefault(chat_id, []).append(time.perf_counter())
+                _replies_cond.notify_all()
+        else:
+            result = True
+
+        payload = json.dumps({'ok': True, 'result': result}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _make_update(update_id: int, user_id: int, text: str) -> dict:
+    message = {
+        'message_id': update_id,
+        'date': int(time.time()),
+        'chat': {'id': user_id, 'type': 'private'},
+        'from': {'id': user_id, 'is_bot': False, 'first_name': f'User{user_id}'},
+        'text': text
+    }
+    if text.startswith('/'):
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+    return {'update_id': update_id, 'message': message}
+
+
+def _post(url: str, update: dict, secret: str) -> int:
+    request = urllib.request.Request(
+        url, data=json.dumps(update).encode(),
+        headers={'Content-Type': 'application/json', 'X-Telegram-Bot-Api-Secret-Token': secret}
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def _wait_for_port(port: int, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Webhook server did not start on port {port}")
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def run(users: int, texts: List[str], timeout: float = 10):
+    api_port, webhook_port = _free_port(), _free_port()
+    api = ThreadingHTTPServer(('127.0.0.1', api_port), FakeBotApi)
+    threading.Thread(target=api.serve_forever, daemon=True).start()
+
+    workdir = tempfile.mkdtemp(prefix='webhook_harness_')
+    here = os.path.dirname(os.path.abspath(__file__))
+    shutil.copy(os.path.join(here, 'catalog.json'), workdir)
+    env = dict(
+        os.environ,
+        BOT_TOKEN=BOT_TOKEN,
+        TELEGRAM_API_URL=f'http://127.0.0.1:{api_port}',
+        WEBHOOK_URL=f'http://127.0.0.1:{webhook_port}/telegram',
+        WEBHOOK_LISTEN='127.0.0.1',
+        WEBHOOK_PORT=str(webhook_port),
+        WEBHOOK_PATH='telegram',
+        WEBHOOK_SECRET=SECRET
+    )
+    bot = subprocess.Popen(
+        [sys.executable, os.path.join(here, 'bot.py')],
+        cwd=workdir, env=env
+    )
+    url = f'http://127.0.0.1:{webhook_port}/telegram'
+    latencies: List[float] = []
+    try:
+        _wait_for_port(webhook_port)
+
+        rejected = _post(url, _make_update(1, 1, '/start'), 'wrong-secret')
+        print(f"Wrong secret token -> HTTP {rejected}")
+
+        update_id = 10
+        for text in texts:
+            pending = []
+            for user_id in range(1000, 1000 + users):
+                with _replies_cond:
+                    seen = len(_replies.get(user_id, []))
+                update_id += 1
+                started = time.perf_counter()
+                status = _post(url, _make_update(update_id, user_id, text), SECRET)
+                if status != 200:
+                    print(f"Update {update_id} rejected: HTTP {status}")
+                    continue
+                pending.append((user_id, seen, started))
+
+            for user_id, seen, started in pending:
+                with _replies_cond:
+                    replied = _replies_cond.wait_for(
+                        lambda: len(_replies.get(user_id, [])) > seen, timeout=timeout
+                    )
+                    if replied:
+                        latencies.append(_replies[user_id][seen] - started)
+                if not replied:
+                    print(f"No reply to {text!r} for user {user_id}")
+    finally:
+        bot.terminate()
+        bot.wait(timeout=15)
+        api.shutdown()
+
+    if latencies:
+        print(f"Updates: {len(latencies)}")
+        print(f"Latency p50: {_percentile(latencies, 50) * 1000:.1f} ms")
+        print(f"Latency p95: {_percentile(latencies, 95) * 1000:.1f} ms")
+        print(f"Latency max: {max(latencies) * 1000:.1f} ms")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=20, help='number of simulated users')
+    parser.add_argument('--texts', nargs='+', default=['/start', '🛍 Каталог'],
+                        help='messages every user sends, in order')
+    args = parser.parse_args()
+    run(args.users, args.texts)
@@ -0,0 +1,179 @@
+import os
+import json
+import atexit
+import logging
+import threading
+from collections import deque
+from typing import Dict, Any, Deque, Optional, Set, Callable, Tuple
+
+# Marks a dirty key that was deleted from ``data``
+_DELETED = object()
+
+
+def _copy_value(value: Any) -> Any:
+    # Records are flat dicts (or lists); a shallow copy is a stable snapshot
+    if isinstance(value, dict):
+        return dict(value)
+    if isinstance(value, list):
+        return list(value)
+    return value
+
+
+class WriteBehindFile:
+    """JSON dict file kept in memory and written back in coalesced batches.
+
+    Callers mutate ``data`` and call ``mark_dirty(key)``.  With write-behind
+    enabled the file is rewritten at most once per ``flush_interval_ms`` (or
+    as soon as ``max_pending`` changes pile up), so ``flush_interval_ms`` is
+    the maximum data-loss window on a crash.  ``close()`` does a final durable
+    flush and is also registered with atexit.  With write-behind disabled
+    every ``mark_dirty`` flushes immediately, like the old code did.
+
+    A flush copies only the dirty records while holding ``lock``; encoding
+    them and writing the file happen outside it, from per-key JSON kept
+    between flushes.  ``mark_dirty()`` without a key re-encodes everything.
+    """
+
+    def __init__(self, path: str, write_behind: bool = True,
+                 flush_interval_ms: int = 1000, max_pending: int = 100):
+        self.path = path
+        self.write_behind = write_behind
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_pending = max_pending
+        self.data: Dict[str, Any] = self._load()
+        # Optional hook run before each file write, e.g. to persist an event log first
+        self.before_write: Optional[Callable[[], None]] = None
+        self.flushes = 0
+        self._dirty: Set[str] = set()
+        self._pending = 0
+        self._full = True
+        # Record copies waiting to be encoded, in the order they were taken
+        self._batches: Deque[Tuple[bool, Dict[str, Any]]] = deque()
+        # key -> '"key":<json value>'; only touched under _flush_lock
+        self._encoded: Dict[str, str] = {}
+        self._unwritten = False
+        self._lock = threading.RLock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = False
+        self._thread: Optional[threading.Thread] = None
+        atexit.register(self.close)
+
+    def _load(self) -> Dict[str, Any]:
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def mark_dirty(self, key: Optional[str] = None):
+        """Record that ``key`` (usually a user id) changed since the last flush"""
+        with self._lock:
+            if key is not None:
+                self._dirty.add(key)
+            else:
+                self._full = True
+            self._pending += 1
+            pending = self._pending
+
+        if not self.write_behind or self._stopped:
+            self.flush()
+            return
+
+        if self._thread is None:
+            self._start()
+        if pending >= self.max_pending:
+            self._wake.set()
+
+    @property
+    def lock(self) -> threading.RLock:
+        """Hold this while mutating ``data`` so a flush never sees a half-done change"""
+        return self._lock
+
+    @property
+    def dirty_keys(self) -> Set[str]:
+        with self._lock:
+            return set(self._dirty)
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name=f"write-behind:{self.path}", daemon=True
+                )
+                self._thread.start()
+
+    def _run(self):
+        while not self._stopped:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error(f"Write-behind flush of {self.path} failed: {e}")
+
+    def flush(self):
+        """Write the file once if anything changed"""
+        with self._lock:
+            if not self._pending:
+                return
+            if self._full:
+                records = {key: _copy_value(value) for key, value in self.data.items()}
+            else:
+                records = {
+                    key: _copy_value(self.data[key]) if key in self.data else _DELETED
+                    for key in self._dirty
+                }
+            self._batches.append((self._full, records))
+            pending = self._pending
+            self._dirty, self._pending, self._full = set(), 0, False
+
+        # Callers may still hold self._lock here, so never take it again while
+        # holding _flush_lock; batches are applied in the order they were taken
+        try:
+            with self._flush_lock:
+                if self.before_write is not None:
+                    self.before_write()
+                if not self._apply_batches() and not self._unwritten:
+                    return  # a concurrent flush already wrote this batch
+                self._unwritten = True
+                payload = '{' + ','.join(self._encoded.values()) + '}'
+                tmp_file = f"{self.path}.tmp"
+                with open(tmp_file, 'w', encoding='utf-8') as f:
+                    f.write(payload)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_file, self.path)
+                self._unwritten = False
+                self.flushes += 1
+        except Exception:
+            # The changes are encoded already; make sure a later flush writes them
+            with self._lock:
+                self._pending += pending
+            raise
+
+    def _apply_batches(self) -> bool:
+        """Encode queued record copies into ``_encoded``; False if there were none"""
+        applied = False
+        while self._batches:
+            full, records = self._batches.popleft()
+            if full:
+                self._encoded = {}
+            for key, value in records.items():
+                if value is _DELETED:
+                    self._encoded.pop(key, None)
+                else:
+                    self._encoded[key] = (
+                        json.dumps(key, ensure_ascii=False) + ':'
+                        + json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+                    )
+            applied = True
+        return applied
+
+    def close(self):
+        """Stop the flusher thread and flush durably"""
+        self._stopped = True
+        self._wake.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=5)
+        self.flush()